@@ -0,0 +1,557 @@
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import collections
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+import numpy as np
+
+# maximum number of results returned by the search API for a query
+MAX_SEARCH_RESULTS = 1000
+
+MAX_PER_PAGE = 100
+
+# first creation date of the generated repositories
+MIN_CREATION_DATE = '2010-01-01'
+
+# requests by token in each window of the budget, as in the API
+DEFAULT_QUOTAS = {'core': (5000, 3600), 'search': (30, 60), 'graphql': (5000, 3600)}
+
+DAY_SECONDS = 86400
+
+def to_seconds(date):
+    # dates of the queries (YYYY-MM-DD) or of the API (YYYY-MM-DDTHH:MM:SSZ)
+    date = str(date).replace('Z', '')
+    date_format = '%Y-%m-%dT%H:%M:%S' if 'T' in date else '%Y-%m-%d'
+
+    return int(datetime.strptime(date, date_format).replace(tzinfo=timezone.utc).timestamp())
+
+def to_iso(seconds):
+    return datetime.fromtimestamp(int(seconds), tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def parse_range(value, parse):
+    # inclusive bounds of a qualifier: a, a..b, a..*, *..b, >a, >=a, <a, <=a
+    if '..' in value:
+        start, end = value.split('..', 1)
+        return (parse(start) if start != '*' else None, parse(end) if end != '*' else None)
+
+    for operator in ['>=', '<=', '>', '<']:
+        if value.startswith(operator):
+            bound = parse(value[len(operator):])
+            return {'>=': (bound, None), '<=': (None, bound), '>': (bound + 1, None), '<': (None, bound - 1)}[operator]
+
+    return parse(value), parse(value)
+
+def parse_day(value):
+    return to_seconds(value[:10]) // DAY_SECONDS
+
+def parse_search_query(q):
+    # qualifiers of the search query, as key:value separated by spaces
+    qualifiers = {}
+
+    for term in q.split():
+        if ':' not in term:
+            continue
+
+        key, value = term.split(':', 1)
+        if key == 'stars':
+            qualifiers[key] = parse_range(value, int)
+        elif key in ['created', 'pushed']:
+            qualifiers[key] = parse_range(value, parse_day)
+        elif key == 'language':
+            qualifiers[key] = value.strip('"').replace('+', ' ').lower()
+
+    return qualifiers
+
+def in_range(values, bounds):
+    start, end = bounds
+    selected = np.ones(len(values), dtype=bool)
+
+    if start is not None:
+        selected &= values >= start
+    if end is not None:
+        selected &= values <= end
+
+    return selected
+
+class MockData:
+    # deterministic repositories and commits of one language, generated from the seed
+    def __init__(self, language, repositories, start_date, end_date, seed=42, developers=None, max_commits=5000,
+                 not_found_rate=0.01, unlinked_rate=0.1):
+        self.language = language.replace('+', ' ').lower()
+        self.seed = seed
+        self.developers = developers if developers else max(repositories // 2, 10)
+        self.unlinked_rate = unlinked_rate
+
+        rng = np.random.default_rng(seed)
+
+        self.ids = np.arange(repositories, dtype=np.int64) * 7 + 100000
+        self.owner_ids = rng.integers(1, self.developers + 1, size=repositories)
+
+        # the repositories were pushed in the crawled period and created before it
+        start, end = to_seconds(start_date), to_seconds(end_date) + DAY_SECONDS - 1
+        self.pushed_at = rng.integers(start, end + 1, size=repositories)
+        self.created_at = rng.integers(to_seconds(MIN_CREATION_DATE), self.pushed_at)
+        self.updated_at = np.minimum(self.pushed_at + rng.integers(0, DAY_SECONDS, size=repositories), end)
+
+        # stars, forks and commits are very skewed, as in the API
+        self.stars = np.minimum(rng.zipf(1.7, size=repositories) - 1, 200000)
+        self.forks = rng.binomial(self.stars, 0.15)
+        self.commits = np.minimum(rng.zipf(1.6, size=repositories), max_commits)
+        self.sizes = (self.commits * rng.uniform(5, 50, size=repositories)).astype(np.int64)
+
+        self.not_found = rng.random(repositories) < not_found_rate
+
+        self.created_days = self.created_at // DAY_SECONDS
+        self.pushed_days = self.pushed_at // DAY_SECONDS
+
+        self.names = [f'owner{owner_id}/repo{repository_id}' for owner_id, repository_id in zip(self.owner_ids, self.ids)]
+        self.positions = {name.lower(): position for position, name in enumerate(self.names)}
+
+    def search(self, qualifiers, sort=None):
+        selected = np.ones(len(self.ids), dtype=bool)
+
+        if qualifiers.get('language', self.language) != self.language:
+            selected[:] = False
+        if 'stars' in qualifiers:
+            selected &= in_range(self.stars, qualifiers['stars'])
+        if 'created' in qualifiers:
+            selected &= in_range(self.created_days, qualifiers['created'])
+        if 'pushed' in qualifiers:
+            selected &= in_range(self.pushed_days, qualifiers['pushed'])
+
+        positions = np.flatnonzero(selected)
+
+        # best match is approximated by the id, the stars sort from the most starred
+        if sort == 'stars':
+            positions = positions[np.argsort(-self.stars[positions], kind='stable')]
+
+        return positions
+
+    def get_repository(self, position, base_url):
+        owner_login, name = self.names[position].split('/')
+        full_name = self.names[position]
+
+        return {'id': int(self.ids[position]),
+                'node_id': f'R_{self.ids[position]}',
+                'name': name,
+                'full_name': full_name,
+                'private': False,
+                'owner': {'login': owner_login, 'id': int(self.owner_ids[position]), 'type': 'User'},
+                'html_url': f'https://github.com/{full_name}',
+                'url': f'{base_url}/repos/{full_name}',
+                'commits_url': f'{base_url}/repos/{full_name}/commits{{/sha}}',
+                'fork': False,
+                'archived': False,
+                'created_at': to_iso(self.created_at[position]),
+                'updated_at': to_iso(self.updated_at[position]),
+                'pushed_at': to_iso(self.pushed_at[position]),
+                'size': int(self.sizes[position]),
+                'stargazers_count': int(self.stars[position]),
+                'watchers_count': int(self.stars[position]),
+                'forks_count': int(self.forks[position]),
+                'open_issues_count': int(self.forks[position] // 3),
+                'language': self.language.title(),
+                'default_branch': 'main',
+                'license': {'key': 'mit', 'spdx_id': 'MIT'} if position % 3 else None,
+                'score': 1.0}
+
+    def find_repository(self, full_name):
+        return self.positions.get(full_name.lower())
+
+    def get_commit_dates(self, position):
+        # commits spread from the creation to the last push, from the newest as in the API
+        commits = int(self.commits[position])
+        created, pushed = int(self.created_at[position]), int(self.pushed_at[position])
+
+        return pushed - (np.arange(commits, dtype=np.int64) * (pushed - created)) // max(commits, 1)
+
+    def get_commits(self, position, dates, indexes, base_url):
+        # authors drawn from a skewed pool of developers, with the same draws for the same repository
+        rng = np.random.default_rng([self.seed, position])
+        authors = rng.zipf(1.5, size=int(self.commits[position])) % self.developers + 1
+        unlinked = rng.random(int(self.commits[position])) < self.unlinked_rate
+
+        full_name = self.names[position]
+        items = []
+
+        for index in indexes:
+            sha = hashlib.sha1(f'{self.ids[position]}:{index}'.encode()).hexdigest()
+            author_id = int(authors[index])
+            date = to_iso(dates[index])
+
+            person = {'name': f'Developer {author_id}', 'email': f'developer{author_id}@example.com', 'date': date}
+            account = None if unlinked[index] else {'login': f'developer{author_id}', 'id': author_id, 'type': 'User'}
+
+            items.append({'sha': sha,
+                          'node_id': f'C_{sha[:20]}',
+                          'commit': {'author': person, 'committer': dict(person),
+                                     'message': f'Commit {index} of {full_name}'},
+                          'url': f'{base_url}/repos/{full_name}/commits/{sha}',
+                          'html_url': f'https://github.com/{full_name}/commit/{sha}',
+                          'author': account,
+                          'committer': account,
+                          'parents': []})
+
+        return items
+
+class RateLimits:
+    # budget of each token by resource, renewed at the end of each window
+    def __init__(self, quotas):
+        self.quotas = quotas
+        self.budgets = {}
+        self.lock = threading.Lock()
+
+    def get_budget(self, token, resource, now):
+        limit, window = self.quotas[resource]
+        budget = self.budgets.get((token, resource))
+
+        if budget is None or now >= budget['reset']:
+            budget = {'limit': limit, 'remaining': limit, 'reset': int(now) + window}
+            self.budgets[(token, resource)] = budget
+
+        return budget
+
+    def consume(self, token, resource):
+        with self.lock:
+            budget = self.get_budget(token, resource, time.time())
+
+            allowed = budget['remaining'] > 0
+            if allowed:
+                budget['remaining'] -= 1
+
+            return allowed, dict(budget)
+
+    def peek(self, token):
+        with self.lock:
+            now = time.time()
+            return {resource: dict(self.get_budget(token, resource, now)) for resource in self.quotas}
+
+class MockGitHub:
+    # behavior of the server: data, budgets, latency and injected failures
+    def __init__(self, data, quotas=None, latency_ms=0, jitter_ms=0, error_rate=0, secondary_rate=0,
+                 incomplete_rate=0, seed=42):
+        self.data = data
+        self.rate_limits = RateLimits(quotas if quotas else DEFAULT_QUOTAS)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.secondary_rate = secondary_rate
+        self.incomplete_rate = incomplete_rate
+        self.base_url = None
+
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {'calls': collections.Counter(), 'statuses': collections.Counter(), 'pages': 0, 'items': 0,
+                          'bytes': 0, 'rate_limited': 0, 'injected_errors': 0, 'not_modified': 0}
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+            stats['calls'] = dict(self.stats['calls'])
+            stats['statuses'] = dict(self.stats['statuses'])
+            stats['total_calls'] = sum(self.stats['calls'].values())
+
+            return stats
+
+    def count(self, endpoint, status, body_size, items=None, per_page=None):
+        with self.stats_lock:
+            self.stats['calls'][endpoint] += 1
+            self.stats['statuses'][f'{endpoint} {status}'] += 1
+            self.stats['bytes'] += body_size
+
+            # probes with a single item are calls, but not pages of results
+            if status == 200 and items is not None and per_page and per_page > 1:
+                self.stats['pages'] += 1
+                self.stats['items'] += items
+
+    def draw(self):
+        with self.random_lock:
+            return self.random.random()
+
+    def wait(self):
+        if not self.latency_ms and not self.jitter_ms:
+            return
+
+        with self.random_lock:
+            delay = self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)
+
+        time.sleep(max(delay, 0) / 1000)
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # the headers and the body are sent without waiting for the acknowledgment of the client
+    disable_nagle_algorithm = True
+
+    # the server is set by serve
+    mock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def get_token(self):
+        authorization = self.headers.get('Authorization', '')
+
+        return authorization.split(' ', 1)[1] if ' ' in authorization else 'anonymous'
+
+    def send_json(self, status, body, headers=None, endpoint=None, items=None, per_page=None):
+        content = json.dumps(body).encode()
+        headers = dict(headers) if headers else {}
+
+        # responses that did not change are answered without the body, as with the conditional requests of the API
+        etag = '"%s"' % hashlib.sha1(content).hexdigest()
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            status, content = 304, b''
+            with self.mock.stats_lock:
+                self.mock.stats['not_modified'] += 1
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        if status in (200, 304):
+            self.send_header('ETag', etag)
+        # the benchmark tokens are classic tokens with access to public data only
+        self.send_header('X-OAuth-Scopes', '')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+        if endpoint:
+            self.mock.count(endpoint, status, len(content), items, per_page)
+
+    def get_rate_limit_headers(self, resource, budget):
+        return {'X-RateLimit-Limit': str(budget['limit']),
+                'X-RateLimit-Remaining': str(budget['remaining']),
+                'X-RateLimit-Reset': str(budget['reset']),
+                'X-RateLimit-Used': str(budget['limit'] - budget['remaining']),
+                'X-RateLimit-Resource': resource}
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        # the body is read to keep the connection usable
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.handle_request()
+
+    def handle_request(self):
+        parts = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        path = parts.path.rstrip('/')
+
+        if path == '/_mock/stats':
+            return self.send_json(200, self.mock.get_stats())
+        if path == '/_mock/reset':
+            self.mock.reset_stats()
+            return self.send_json(200, {'reset': True})
+        if path == '/rate_limit':
+            return self.send_rate_limit()
+
+        if path == '/search/repositories':
+            endpoint, resource = 'search', 'search'
+        elif path.startswith('/repos/') and path.endswith('/commits'):
+            endpoint, resource = 'commits', 'core'
+        else:
+            return self.send_json(404, {'message': 'Not Found'}, endpoint='other')
+
+        self.mock.wait()
+
+        # injected failures come before the budget, as the errors of the API proxies
+        if self.mock.error_rate and self.mock.draw() < self.mock.error_rate:
+            with self.mock.stats_lock:
+                self.mock.stats['injected_errors'] += 1
+            return self.send_json(502, {'message': 'Server Error'}, endpoint=endpoint)
+
+        if self.mock.secondary_rate and self.mock.draw() < self.mock.secondary_rate:
+            with self.mock.stats_lock:
+                self.mock.stats['injected_errors'] += 1
+            return self.send_json(403, {'message': 'You have exceeded a secondary rate limit.'}, {'Retry-After': '1'},
+                                  endpoint=endpoint)
+
+        allowed, budget = self.mock.rate_limits.consume(self.get_token(), resource)
+        headers = self.get_rate_limit_headers(resource, budget)
+
+        if not allowed:
+            with self.mock.stats_lock:
+                self.mock.stats['rate_limited'] += 1
+            return self.send_json(403, {'message': 'API rate limit exceeded.'}, headers, endpoint=endpoint)
+
+        if endpoint == 'search':
+            return self.send_search(params, headers)
+
+        return self.send_commits(path[len('/repos/'):-len('/commits')], params, headers)
+
+    def send_rate_limit(self):
+        budgets = self.mock.rate_limits.peek(self.get_token())
+        resources = {resource: {'limit': budget['limit'], 'remaining': budget['remaining'], 'reset': budget['reset'],
+                                'used': budget['limit'] - budget['remaining']}
+                     for resource, budget in budgets.items()}
+
+        self.send_json(200, {'resources': resources, 'rate': resources['core']}, endpoint='rate_limit')
+
+    def get_paging(self, params):
+        try:
+            per_page = min(max(int(params.get('per_page', 30)), 1), MAX_PER_PAGE)
+            page = max(int(params.get('page', 1)), 1)
+        except ValueError:
+            per_page, page = 30, 1
+
+        return per_page, page
+
+    def send_search(self, params, headers):
+        per_page, page = self.get_paging(params)
+
+        if (page - 1) * per_page >= MAX_SEARCH_RESULTS:
+            return self.send_json(422, {'message': f'Only the first {MAX_SEARCH_RESULTS} search results are available'},
+                                  headers, endpoint='search')
+
+        positions = self.mock.data.search(parse_search_query(params.get('q', '')), params.get('s'))
+        page_positions = positions[:MAX_SEARCH_RESULTS][(page - 1) * per_page:page * per_page]
+
+        incomplete = bool(self.mock.incomplete_rate and self.mock.draw() < self.mock.incomplete_rate)
+        body = {'total_count': len(positions), 'incomplete_results': incomplete,
+                'items': [self.mock.data.get_repository(position, self.mock.base_url) for position in page_positions]}
+
+        self.send_json(200, body, headers, endpoint='search', items=len(page_positions), per_page=per_page)
+
+    def send_commits(self, full_name, params, headers):
+        position = self.mock.data.find_repository(full_name)
+
+        if position is None or self.mock.data.not_found[position]:
+            return self.send_json(404, {'message': 'Not Found'}, headers, endpoint='commits')
+
+        per_page, page = self.get_paging(params)
+
+        # the commits are sorted from the newest, so the dates select a contiguous slice
+        dates = self.mock.data.get_commit_dates(position)
+        first, last = 0, len(dates)
+        if 'until' in params:
+            first = int(np.searchsorted(-dates, -to_seconds(params['until'])))
+        if 'since' in params:
+            last = int(np.searchsorted(-dates, -to_seconds(params['since']), side='right'))
+        last = max(first, last)
+
+        indexes = range(first + (page - 1) * per_page, min(first + page * per_page, last))
+        last_page = max((last - first + per_page - 1) // per_page, 1)
+
+        links = self.get_links(full_name, params, page, last_page)
+        if links:
+            headers['Link'] = links
+
+        items = self.mock.data.get_commits(position, dates, indexes, self.mock.base_url)
+
+        self.send_json(200, items, headers, endpoint='commits', items=len(items), per_page=per_page)
+
+    def get_links(self, full_name, params, page, last_page):
+        # the first and the last pages do not have the links before and after them
+        url = f'{self.mock.base_url}/repos/{full_name}/commits'
+        links = []
+
+        for relation, link_page in [('prev', page - 1), ('next', page + 1), ('last', last_page), ('first', 1)]:
+            if relation in ['prev', 'first'] and page == 1:
+                continue
+            if relation in ['next', 'last'] and page >= last_page:
+                continue
+
+            query = urlencode(dict(params, page=link_page))
+            links.append(f'<{url}?{query}>; rel="{relation}"')
+
+        return ', '.join(links)
+
+def serve(mock, host='127.0.0.1', port=0):
+    # a thread per connection, so the latency of a request does not delay the others
+    handler = type('MockRequestHandler', (RequestHandler,), {'mock': mock})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    mock.base_url = f'http://{host}:{server.server_address[1]}'
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+def get_quotas(args):
+    return {'core': (int(args.core_quota), int(args.core_window)),
+            'search': (int(args.search_quota), int(args.search_window)),
+            'graphql': (int(args.core_quota), int(args.core_window))}
+
+def add_mock_arguments(parser):
+    parser.add_argument('-l', '--language', default='python',
+                        help='The programming language of the generated repositories', required=False)
+    parser.add_argument('-r', '--repositories', default=2000,
+                        help='Number of generated repositories', required=False)
+    parser.add_argument('--start_date', default='2019-12-01',
+                        help='First pushed date of the generated repositories (format: YYYY-MM-DD)', required=False)
+    parser.add_argument('--end_date', default='2019-12-31',
+                        help='Last pushed date of the generated repositories (format: YYYY-MM-DD)', required=False)
+    parser.add_argument('--seed', default=42,
+                        help='Seed of the generated data and of the injected failures', required=False)
+    parser.add_argument('--max-commits', default=5000,
+                        help='Maximum number of commits of a repository', required=False)
+    parser.add_argument('--latency', default=0,
+                        help='Mean latency of each response in milliseconds', required=False)
+    parser.add_argument('--jitter', default=0,
+                        help='Maximum variation of the latency in milliseconds', required=False)
+    parser.add_argument('--error-rate', default=0,
+                        help='Fraction of the requests answered with a server error (502)', required=False)
+    parser.add_argument('--secondary-rate', default=0,
+                        help='Fraction of the requests answered with a secondary rate limit (403 with Retry-After)',
+                        required=False)
+    parser.add_argument('--incomplete-rate', default=0,
+                        help='Fraction of the searches answered with incomplete results', required=False)
+    parser.add_argument('--not-found-rate', default=0.01,
+                        help='Fraction of the repositories without commits (404)', required=False)
+    parser.add_argument('--core-quota', default=5000,
+                        help='Requests of each token to the commits in each core window', required=False)
+    parser.add_argument('--core-window', default=3600,
+                        help='Seconds until the core budget is renewed', required=False)
+    parser.add_argument('--search-quota', default=30,
+                        help='Requests of each token to the search in each search window', required=False)
+    parser.add_argument('--search-window', default=60,
+                        help='Seconds until the search budget is renewed', required=False)
+
+def create_mock(args):
+    data = MockData(args.language, int(args.repositories), args.start_date, args.end_date, int(args.seed),
+                    max_commits=int(args.max_commits), not_found_rate=float(args.not_found_rate))
+
+    return MockGitHub(data, get_quotas(args), float(args.latency), float(args.jitter), float(args.error_rate),
+                      float(args.secondary_rate), float(args.incomplete_rate), int(args.seed))
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in of the GitHub API used by the crawlers')
+    add_mock_arguments(parser)
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Address of the server', required=False)
+    parser.add_argument('-p', '--port', default=8000,
+                        help='Port of the server', required=False)
+
+    args = parser.parse_args()
+
+    mock = create_mock(args)
+    server = serve(mock, args.host, int(args.port))
+
+    print(f'{len(mock.data.ids)} repositories with {int(mock.data.commits.sum())} commits')
+    print(f'Serving on {mock.base_url} (use GITHUB_API_URL={mock.base_url} in the crawlers)')
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+import os
+import sys
+sys.path.append('../utils')
+
+import utils as utils
+import utils_sink as sink
+import mock_github as mock_github
+
+CRAWLERS = ['repositories', 'stars', 'commits']
+
+# values compared with a previous run, the first ones are better when higher
+HIGHER_IS_BETTER = ['requests_per_second', 'pages_per_second']
+LOWER_IS_BETTER = ['seconds', 'calls', 'peak_rss_mb']
+
+def create_workspace(language, tokens):
+    # a copy of the project, so the crawlers write their data and checkpoints away from the real ones
+    workspace_path = tempfile.mkdtemp(prefix='benchmark_')
+    main_path = utils.get_main_path()
+
+    for folder in ['crawler_api', 'utils']:
+        shutil.copytree(os.path.join(main_path, 'src', folder), os.path.join(workspace_path, 'src', folder),
+                        ignore=shutil.ignore_patterns('__pycache__'))
+
+    for folder in [('stars',), ('checkpoints',), ('cache',), ('repositories', language.lower(), 'daily_crawler'),
+                   ('repositories', language.lower(), 'deduplicated_data'), ('commits', language.lower(), 'crawler_files')]:
+        os.makedirs(os.path.join(workspace_path, 'data', 'crawler', *folder), exist_ok=True)
+
+    with open(os.path.join(workspace_path, 'data', 'tokens.csv'), mode='w') as w:
+        for number in range(tokens):
+            w.write(f'benchmark{number + 1},token{number + 1}\n')
+    w.close()
+
+    return workspace_path
+
+def get_commands(args):
+    token_key = 'all' if int(args.tokens) > 1 else 'benchmark1'
+
+    # the default selection of the schemas, so the csv pages are also projected
+    repositories_fields = ['-f', ','.join(name for name, path, type_name in sink.REPOSITORIES_SCHEMA)] if args.fields else []
+    commits_fields = ['-f', ','.join(name for name, path, type_name in sink.COMMITS_SCHEMA)] if args.fields else []
+
+    return {'repositories': ['collect_repositories.py', '-t', 'benchmark1', '-l', args.language, '-d', args.start_date,
+                             '--end_date', args.end_date, '-o', args.output, '-w', str(args.window)] + repositories_fields,
+            'stars': ['collect_stars.py', '-t', 'benchmark1', '-l', args.language, '-d', args.start_date,
+                      '--cont', 'false', '-m', args.stars_mode],
+            'deduplicate': ['deduplicate_repositories.py', '-l', args.language],
+            'commits': ['collect_commits.py', '-t', token_key, '-l', args.language, '--end_date', args.end_date,
+                        '-o', args.output, '-c', str(args.concurrency)] + commits_fields}
+
+def run_crawler(workspace_path, name, command, mock, server):
+    log_path = os.path.join(workspace_path, f'{name}.log')
+    environment = dict(os.environ, GITHUB_API_URL=mock.base_url, PYTHONUNBUFFERED='1')
+
+    mock.reset_stats()
+
+    with open(log_path, mode='w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable] + command, cwd=os.path.join(workspace_path, 'src', 'crawler_api'),
+                                   env=environment, stdout=log, stderr=subprocess.STDOUT)
+
+        # the resource usage of the child has the peak memory of the crawler alone
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+    log.close()
+
+    process.returncode = os.waitstatus_to_exitcode(status)
+    stats = mock.get_stats()
+
+    return {'crawler': name,
+            'exit_code': process.returncode,
+            'seconds': round(seconds, 3),
+            'calls': stats['total_calls'],
+            'pages': stats['pages'],
+            'items': stats['items'],
+            'requests_per_second': round(stats['total_calls'] / seconds, 2),
+            'pages_per_second': round(stats['pages'] / seconds, 2),
+            'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),
+            'megabytes': round(stats['bytes'] / 1024 / 1024, 2),
+            'rate_limited': stats['rate_limited'],
+            'injected_errors': stats['injected_errors'],
+            'calls_by_endpoint': stats['calls'],
+            'statuses': stats['statuses'],
+            'log': log_path}
+
+def print_results(results, baseline=None):
+    baseline_results = {result['crawler']: result for result in baseline['results']} if baseline else {}
+
+    print(f"\n{'crawler':<14}{'exit':>5}{'seconds':>10}{'calls':>8}{'pages':>8}{'req/s':>10}{'pages/s':>10}"
+          f"{'rss MB':>9}{'limited':>9}")
+
+    for result in results:
+        print(f"{result['crawler']:<14}{result['exit_code']:>5}{result['seconds']:>10}{result['calls']:>8}"
+              f"{result['pages']:>8}{result['requests_per_second']:>10}{result['pages_per_second']:>10}"
+              f"{result['peak_rss_mb']:>9}{result['rate_limited']:>9}")
+
+        previous = baseline_results.get(result['crawler'])
+        if previous:
+            print(' ' * 14 + 'vs baseline: ' + ', '.join(get_changes(result, previous)))
+
+def get_changes(result, previous):
+    changes = []
+
+    for key in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+        if not previous.get(key):
+            continue
+
+        change = (result[key] - previous[key]) / previous[key] * 100
+        better = change > 0 if key in HIGHER_IS_BETTER else change < 0
+        changes.append(f"{key} {change:+.1f}%{' (better)' if better and abs(change) >= 1 else ''}")
+
+    return changes
+
+def save_results(args, results, mock):
+    results_path = os.path.join(utils.get_main_path(), 'data', 'benchmark')
+    os.makedirs(results_path, exist_ok=True)
+
+    file_name = f"benchmark_{args.language.lower()}_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    file_path = os.path.join(results_path, file_name)
+
+    config = {key: value for key, value in vars(args).items() if key != 'baseline'}
+    config['generated_commits'] = int(mock.data.commits.sum())
+
+    with open(file_path, mode='w') as w:
+        json.dump({'date': str(datetime.now()), 'config': config, 'results': results}, w, indent=2)
+    w.close()
+
+    return file_path
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the crawlers against a local stand-in of the GitHub API')
+    mock_github.add_mock_arguments(parser)
+    parser.add_argument('--crawlers', default=','.join(CRAWLERS),
+                        help=f'Comma separated crawlers to be run, in order ({", ".join(CRAWLERS)})', required=False)
+    parser.add_argument('--tokens', default=1,
+                        help='Number of tokens of the workspace (the commits crawler shares all of them)', required=False)
+    parser.add_argument('-o', '--output', default='csv', choices=['csv', 'parquet'],
+                        help='Output of the repositories and commits crawlers', required=False)
+    parser.add_argument('-c', '--concurrency', default=1,
+                        help='Maximum number of requests in flight of the commits crawler', required=False)
+    parser.add_argument('-f', '--fields', action='store_true',
+                        help='Save only the fields of the schemas, also in the csv pages', required=False)
+    parser.add_argument('-w', '--window', default=7,
+                        help='Number of pushed days planned together by the repositories crawler', required=False)
+    parser.add_argument('--stars-mode', default='range', choices=['single', 'range'],
+                        help='Mode of the stars crawler', required=False)
+    parser.add_argument('--baseline', default=None,
+                        help='Results of a previous benchmark to compare with', required=False)
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the workspace with the crawled data and the logs', required=False)
+
+    args = parser.parse_args()
+
+    crawlers = [crawler.strip() for crawler in args.crawlers.split(',') if crawler.strip()]
+    unknown = [crawler for crawler in crawlers if crawler not in CRAWLERS]
+    if unknown:
+        print('Unknown crawlers:', ', '.join(unknown))
+        sys.exit(-1)
+
+    # Print start time processing
+    start_time = datetime.now()
+    print(f'Benchmark stated at {start_time}\n')
+
+    mock = mock_github.create_mock(args)
+    server = mock_github.serve(mock)
+    print(f'Mock API on {mock.base_url} - {len(mock.data.ids)} repositories with {int(mock.data.commits.sum())} commits')
+
+    workspace_path = create_workspace(args.language, int(args.tokens))
+    print(f'Workspace on {workspace_path}\n')
+
+    commands = get_commands(args)
+    results = []
+
+    for crawler in crawlers:
+        # the commits crawler reads the deduplicated repositories, prepared outside of the measure
+        if crawler == 'commits':
+            if 'repositories' not in crawlers:
+                run_crawler(workspace_path, 'repositories', commands['repositories'], mock, server)
+            run_crawler(workspace_path, 'deduplicate', commands['deduplicate'], mock, server)
+
+        print(f'Running the {crawler} crawler')
+        result = run_crawler(workspace_path, crawler, commands[crawler], mock, server)
+        results.append(result)
+
+        if result['exit_code'] != 0:
+            print(f"WARNING: the {crawler} crawler finished with code {result['exit_code']} (see {result['log']})")
+
+    server.shutdown()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, mode='r') as r:
+            baseline = json.load(r)
+        r.close()
+
+    print_results(results, baseline)
+
+    results_path = save_results(args, results, mock)
+    print('\nResults saved on', results_path)
+
+    if not args.keep:
+        shutil.rmtree(workspace_path, ignore_errors=True)
+
+    # Print finish time processing
+    end_time = datetime.now()
+    print(f'\nBenchmark finished at {end_time}\n')
+
+    print('>> Benchmark finished in', end_time - start_time, '<<')
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,9 @@
-import requests
-import json
 import pandas as pd
 import math
 import csv
 import argparse
+import asyncio
+import concurrent.futures
 
 import os
 import sys
@@ -11,108 +11,454 @@ sys.path.append('../utils')
 
 import utils as utils
 import utils_api as api
+import utils_cache as cache
+import utils_checkpoint as cp
+import utils_http as http
+import utils_index as index
+import utils_metrics as metrics
+import utils_sink as sink
 
 from datetime import datetime
-
-def get_commits_by_repo(token, metadata_path, language, end_date, partition, token_key, filter_list=None):
+from urllib.parse import urlparse, parse_qs, urlencode
+
+GRAPHQL_URL = f'{api.API_URL}/graphql'
+
+# only the fields kept in the output are requested
+GRAPHQL_HISTORY = '''
+fragment commits on CommitHistoryConnection {
+  totalCount
+  pageInfo { hasNextPage endCursor }
+  nodes {
+    oid
+    author { name email date user { databaseId login } }
+    committer { name email date user { databaseId login } }
+  }
+}
+'''
+
+def get_commits_by_repo(tokens, checkpoint, language, end_date, partition, token_key, filter_list=None, concurrency=1,
+                        high_water_marks=None, resume_state=None, output='csv', backend='rest', batch_size=20,
+                        projection=None):
     # main path of files
     main_path = os.path.join(utils.get_main_path(), 'data', 'crawler')
 
     # path to save crawling files
     crawler_path = os.path.join(main_path, 'commits', language.lower(), 'crawler_files')
 
-    # file to read all repositories for the language
-    if not partition:
-        repositories_path = os.path.join(main_path, 'repositories', language.lower(), 'deduplicated_data', 'complete_repositories.csv')
-    else:
-        repositories_path = os.path.join(main_path, 'repositories', language.lower(), 'deduplicated_data', 'partitions', f'complete_repositories_part_{partition}.csv')
-
-    repositories_df = pd.read_csv(repositories_path)
+    # typed index of the deduplicated repositories, mapped from disk instead of parsing the csv file
+    repositories_index = index.load_index(language)
+    partition_ids = index.load_partition(language, partition) if partition else None
+    positions = repositories_index.select(partition_ids)
 
-    # select just the necessary columns
-    repositories_df = repositories_df[['id', 'full_name', 'updated_at', 'commits_url']]
-    repositories_df['new_commits_url'] = repositories_df['commits_url'].apply(lambda x: x.replace('{/sha}', ''))
-
-    print('Total repositories for the language:', len(repositories_df))
+    print('Total repositories for the language:', len(positions))
 
     # if filter list is not null, the crawling list needs to be filtered
     if filter_list:
-        repositories_df = repositories_df[~repositories_df['id'].isin(filter_list)]
-
-    print('Repositories to be crawled:', len(repositories_df), '\n')
+        positions = repositories_index.select(partition_ids, filter_list)
+
+    print('Repositories to be crawled:', len(positions), '\n')
+
+    # shared queue of repositories, already sorted by the updated date of the repository in the index
+    # each request uses the token with the largest budget
+    repositories_queue = index.RepositoryQueue(repositories_index, positions, api.API_URL)
+    metrics.track_queue('repositories', lambda: len(repositories_queue))
+
+    # csv files by page or parquet shards with the flattened commits
+    # the partitions crawled at the same time write shards with different names
+    # the pages of both backends are projected on the commits schema, so they have the same columns
+    prefix = f'commits_{language.lower()}_part_{partition}' if partition else f'commits_{language.lower()}'
+    commits_sink = sink.open_sink(output, crawler_path, prefix, sink.COMMITS_SCHEMA, sink.COMMITS_CONTEXT,
+                                  projection=projection if projection else sink.COMMITS_SCHEMA)
+
+    crawling = {'tokens': tokens, 'checkpoint': checkpoint, 'sink': commits_sink, 'crawler_path': crawler_path, 'language': language,
+                'end_date': end_date, 'partition': partition, 'token_key': token_key,
+                'high_water_marks': high_water_marks, 'resume_state': resume_state if resume_state else {},
+                'failed': set()}
+
+    # the buffered pages are saved also when the crawling is interrupted
+    try:
+        if backend == 'graphql':
+            crawl_repositories_graphql(repositories_queue, crawling, batch_size)
+        elif concurrency > 1:
+            asyncio.run(crawl_repositories_async(repositories_queue, crawling, concurrency))
+        else:
+            crawl_repositories(repositories_queue, crawling)
+    finally:
+        commits_sink.close()
 
-    # print('Ignoring one more repository: 301835369')
-    # repositories_df = repositories_df[repositories_df['id'] != 301835369]
-    # print('New size:', len(repositories_df), '\n')
+def crawl_repositories(repositories_queue, crawling):
+    while repositories_queue:
+        row = repositories_queue.popleft()
 
-    # sort the dataframe by the updated date of the repository
-    repositories_df = repositories_df.sort_values(by=['updated_at'])
+        # original query for the repository (only the new commits in incremental mode)
+        base_query, high_water_mark = get_base_query(row, crawling)
+        state = crawling['resume_state'].get(row['id'])
 
-    # quantity of commits per page
-    q_per_page = '&per_page=100'
+        if state and state['last_page']:
+            # the number of pages is known, only the pages not saved are requested again
+            # the other backends save the pages out of order, so a missing page can be before the last saved one
+            for page in get_missing_pages(state['last_page'], state['done_pages']):
+                crawl_repository_page(crawling, row, base_query, page, high_water_mark)
 
-    for index, row in repositories_df.iterrows():
-        # original query for the repository
-        base_query = f"{row['new_commits_url']}?until={end_date}"
+            finish_repository(crawling, row)
+            continue
 
+        # without the number of pages, the links are followed and only the pages already saved are skipped
+        done_pages = state['done_pages'] if state else set()
         page = 1
 
         # create a non empty list to start the loop
         commits = ['']
+        links = {'next': None}
 
-        while commits:
-            print(f"Requesting commits for repository {row['full_name']} - updated at {row['updated_at']} - page {page}")
+        # the last page does not have the link to the next one
+        while commits and 'next' in links:
+            # the saved pages are skipped, an empty page after the last one ends the loop
+            if page not in done_pages:
+                commits, links = crawl_repository_page(crawling, row, base_query, page, high_water_mark)
+            page = page + 1
 
-            q_page = f'&page={page}'
-            complete_query = base_query + q_per_page + q_page
+        finish_repository(crawling, row)
 
-            file_crawler_path = os.path.join(crawler_path, f"{row['id']}_{row['full_name'].replace('/', '_')}_{page}.csv")
+def get_missing_pages(last_page, done_pages):
+    return sorted(set(range(1, last_page + 1)) - done_pages)
 
-            commits = save_result_query(token, complete_query, file_crawler_path, partition, token_key, language)
-            
-            # log progress
-            save_progress_metadata(metadata_path, language, row['id'], row['full_name'], 
-                                   row['updated_at'], page, complete_query)
+def crawl_repository_page(crawling, row, base_query, page, high_water_mark):
+    commits, links = crawl_page(crawling, row, base_query, page, high_water_mark)
 
-            page = page + 1
+    # the commits are sorted from the newest, so the first one is the next high-water mark
+    if page == 1:
+        cp.save_commit_repository(crawling['checkpoint'], row, crawling['end_date'],
+                                  api.get_last_page(links) if commits else 1, commits[0] if commits else None)
 
-def save_result_query(token, query, file_name, partition, token_key, language):
-    result = requests.get(query, headers={'Authorization': 'token %s' % token}) 
-    commits = json.loads(result.content)
+    return commits, links
 
-    if commits:
-        if isinstance(commits, list):
-            commits_df = pd.DataFrame(commits)
-            commits_df.to_csv(file_name, sep=',', index=False)
+def finish_repository(crawling, row):
+    # a repository with a page given up stays unfinished, so a resumed crawling requests the page again
+    if row['id'] in crawling['failed']:
+        return
+
+    # the repository is finished in the checkpoint when all its pages are saved by the sink
+    crawling['sink'].when_saved(lambda: cp.finish_commit_repository(crawling['checkpoint'], row, crawling['end_date']))
+
+def crawl_page(crawling, row, base_query, page, high_water_mark):
+    print(f"Requesting commits for repository {row['full_name']} - updated at {row['updated_at']} - page {page}")
+
+    complete_query = base_query + f'&per_page=100&page={page}'
+    file_crawler_path = get_file_crawler_path(crawling['crawler_path'], row, page, crawling['end_date'], high_water_mark)
+
+    # a page only started was in flight and is requested again when the crawling continues
+    cp.start_commit_page(crawling['checkpoint'], row, crawling['end_date'], page, complete_query)
+
+    context_values = {'repository_id': row['id'], 'repository_full_name': row['full_name'], 'page': page}
+
+    try:
+        commits, links = save_result_query(crawling['tokens'], complete_query, crawling['sink'], file_crawler_path,
+                                           context_values, high_water_mark['last_sha'] if high_water_mark else None)
+    except api.RequestError as error:
+        save_failed_request(crawling, [row], error)
+        return [], {}
+
+    crawling['sink'].when_saved(lambda: cp.finish_commit_page(crawling['checkpoint'], row, crawling['end_date'], page))
+
+    return commits, links
+
+async def crawl_repositories_async(repositories_queue, crawling, concurrency):
+    loop = asyncio.get_running_loop()
+    checkpoint = crawling['checkpoint']
+    end_date = crawling['end_date']
+
+    # requests run in threads sharing the pooled session, limited by the semaphore
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    # the pool has a connection for each request in flight, unless a larger pool was given
+    http.configure(pool_maxsize=max(concurrency, http.POOL_MAXSIZE))
+
+    # pages waiting for a free request slot
+    waiting = {'pages': 0}
+    metrics.track_queue('pages', lambda: waiting['pages'])
+
+    async def fetch_page(row, base_query, page, high_water_mark):
+        waiting['pages'] += 1
+        async with semaphore:
+            waiting['pages'] -= 1
+            return await loop.run_in_executor(executor, crawl_page, crawling, row, base_query, page, high_water_mark)
+
+    async def crawl_repository(row):
+        base_query, high_water_mark = get_base_query(row, crawling)
+        state = crawling['resume_state'].get(row['id'])
+
+        if state and state['last_page']:
+            # the number of pages is known, only the pages not saved are requested again
+            last_page = state['last_page']
         else:
-            if commits['message'] in ['Not Found', 'Repository access blocked']:
-                print('INFO: Repository not found or access blocked!')
-                save_repositories_not_found(query, language, partition, token_key)
-                commits = []
+            commits, links = await fetch_page(row, base_query, 1, high_water_mark)
+
+            # the link to the last page gives all the remaining pages at once
+            last_page = api.get_last_page(links) if commits else 1
+            cp.save_commit_repository(checkpoint, row, end_date, last_page, commits[0] if commits else None)
+
+            state = {'done_pages': {1}}
+
+        pages = get_missing_pages(last_page, state['done_pages'])
+        if pages:
+            await asyncio.gather(*[fetch_page(row, base_query, page, high_water_mark) for page in pages])
+
+        finish_repository(crawling, row)
+
+    async def worker():
+        while repositories_queue:
+            await crawl_repository(repositories_queue.popleft())
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    finally:
+        executor.shutdown(wait=True)
+
+def get_base_query(row, crawling):
+    high_water_mark = get_high_water_mark(row, crawling)
+
+    if high_water_mark:
+        return f"{row['new_commits_url']}?since={high_water_mark['last_commit_date']}&until={crawling['end_date']}", high_water_mark
+
+    return f"{row['new_commits_url']}?until={crawling['end_date']}", None
+
+def get_file_crawler_path(crawler_path, row, page, end_date, high_water_mark=None):
+    file_name = f"{row['id']}_{row['full_name'].replace('/', '_')}"
+
+    # the new commits are saved beside the files of the previous crawlings
+    if high_water_mark:
+        file_name = f'{file_name}_until_{end_date}'
+
+    return os.path.join(crawler_path, f'{file_name}_{page}.csv')
+
+def crawl_repositories_graphql(repositories_queue, crawling, batch_size):
+    checkpoint = crawling['checkpoint']
+    end_date = crawling['end_date']
+
+    while repositories_queue:
+        batch = []
+
+        while repositories_queue and len(batch) < batch_size:
+            row = repositories_queue.popleft()
+            state = crawling['resume_state'].get(row['id'])
+
+            if not state or not state['done_pages']:
+                batch.append(row)
+                continue
+
+            # an interrupted repository continues from the cursor saved with its last page
+            page = max(state['done_pages']) + 1
+            if state['last_page'] and page > state['last_page']:
+                finish_repository(crawling, row)
+                continue
+
+            # older checkpoints keep the cursor only in the query of the next page
+            cursor = cp.get_commit_page_cursor(checkpoint, row['id'], end_date, page - 1)
+            cursor = cursor if cursor else get_page_cursor(cp.get_commit_page_query(checkpoint, row['id'], end_date, page))
+
+            # without a cursor the last saved page had no next one, the history is complete
+            if cursor:
+                crawl_history_graphql(crawling, row, page, cursor)
+            finish_repository(crawling, row)
+
+        if not batch:
+            continue
+
+        # the first page of many repositories in a single query
+        histories = request_histories(crawling, [(row, 1, None) for row in batch])
+
+        for row, history in zip(batch, histories):
+            if history is None:
+                cp.save_commit_repository(checkpoint, row, end_date, 1)
             else:
-                print('Return query:', commits)
-                print('!!! CHECK ERROR !!!')
-                sys.exit()
+                commits = history['commits']
+                cp.save_commit_repository(checkpoint, row, end_date, max(math.ceil(history['total_count'] / 100), 1),
+                                          commits[0] if commits else None)
 
-    # verify the request time from API
-    api.verify_request_time(token, 'core')
+                # only the large repositories need more requests, one page at a time
+                if history['has_next_page']:
+                    crawl_history_graphql(crawling, row, 2, history['end_cursor'])
 
-    return commits
+            finish_repository(crawling, row)
 
-def save_progress_metadata(file_name, language, repo_id, repo_full_name, updated_at, page, complete_query, separator=','):
-    with open(file_name, mode='a', newline='') as a:
-        csv_file = csv.writer(a, delimiter=separator)
-        
-        csv_file.writerow([str(datetime.now()),
-                           language, repo_id, repo_full_name, updated_at, page, complete_query])
+def crawl_history_graphql(crawling, row, page, cursor):
+    while cursor:
+        history, = request_histories(crawling, [(row, page, cursor)])
 
-    a.close()
+        if history is None or not history['has_next_page']:
+            break
+
+        cursor = history['end_cursor']
+        page = page + 1
+
+def request_histories(crawling, pages):
+    end_date = crawling['end_date']
+    variables = {'until': get_git_timestamp(end_date)}
+
+    for number, (row, page, cursor) in enumerate(pages):
+        high_water_mark = get_high_water_mark(row, crawling)
+        owner, name = row['full_name'].split('/', 1)
+
+        variables.update({f'owner{number}': owner, f'name{number}': name, f'cursor{number}': cursor,
+                          f'since{number}': high_water_mark['last_commit_date'] if high_water_mark else None})
+
+        print(f"Requesting commits for repository {row['full_name']} - updated at {row['updated_at']} - page {page}")
+        cp.start_commit_page(crawling['checkpoint'], row, end_date, page, get_page_query(row, cursor))
+
+    try:
+        result = api.post_from_pool(GRAPHQL_URL, crawling['tokens'], 'graphql',
+                                    {'query': get_history_query(len(pages)), 'variables': variables})
+    except api.RequestError as error:
+        # the missing repositories come as null in a valid answer, so any failure leaves the pages started
+        print(f'ERROR: the query was given up after {error.attempts} attempts - {error}')
+        cp.save_dead_letter(crawling['checkpoint'], error)
+        crawling['failed'].update(row['id'] for row, page, cursor in pages)
+        return [None] * len(pages)
+
+    result = api.get_data(result)
+
+    histories = []
+
+    for number, (row, page, cursor) in enumerate(pages):
+        repository = result['data'].get(f'repository{number}')
+
+        if repository is None:
+            print('INFO: Repository not found or access blocked!')
+            save_repositories_not_found(row['new_commits_url'], crawling['language'], crawling['partition'],
+                                        crawling['token_key'])
+            history = None
+        else:
+            history = save_history(crawling, row, page, repository)
+
+        end_cursor = history['end_cursor'] if history and history['has_next_page'] else None
+        crawling['sink'].when_saved(lambda row=row, page=page, end_cursor=end_cursor:
+                                    cp.finish_commit_page(crawling['checkpoint'], row, end_date, page, end_cursor))
+        histories.append(history)
+
+    return histories
+
+def save_history(crawling, row, page, repository):
+    # empty repositories do not have a default branch
+    branch = repository['defaultBranchRef']
+    connection = branch['target'].get('history') if branch and branch['target'] else None
+
+    if not connection:
+        return {'commits': [], 'total_count': 0, 'has_next_page': False, 'end_cursor': None}
+
+    high_water_mark = get_high_water_mark(row, crawling)
+    commits = [to_rest_commit(node) for node in connection['nodes']]
+
+    # the since param includes the commit of the high-water mark, that was already saved
+    if high_water_mark:
+        commits = [commit for commit in commits if commit['sha'] != high_water_mark['last_sha']]
+
+    if commits:
+        file_crawler_path = get_file_crawler_path(crawling['crawler_path'], row, page, crawling['end_date'], high_water_mark)
+        context_values = {'repository_id': row['id'], 'repository_full_name': row['full_name'], 'page': page}
+
+        crawling['sink'].write(commits, file_crawler_path, context_values)
+
+    return {'commits': commits, 'total_count': connection['totalCount'],
+            'has_next_page': connection['pageInfo']['hasNextPage'], 'end_cursor': connection['pageInfo']['endCursor']}
+
+def get_history_query(repositories):
+    # one aliased field for each repository of the batch
+    params = ['$until: GitTimestamp']
+    fields = []
+
+    for number in range(repositories):
+        params += [f'$owner{number}: String!', f'$name{number}: String!', f'$cursor{number}: String',
+                   f'$since{number}: GitTimestamp']
+        fields.append(f'''
+  repository{number}: repository(owner: $owner{number}, name: $name{number}) {{
+    defaultBranchRef {{
+      target {{
+        ... on Commit {{
+          history(first: 100, after: $cursor{number}, since: $since{number}, until: $until) {{ ...commits }}
+        }}
+      }}
+    }}
+  }}''')
+
+    return f"query({', '.join(params)}) {{{''.join(fields)}\n}}\n{GRAPHQL_HISTORY}"
+
+def to_rest_commit(node):
+    # the same fields of the commits endpoint, so both backends have the same output
+    commit = {'sha': node['oid'], 'commit': {}}
+
+    for role in ['author', 'committer']:
+        person = node[role] if node[role] else {}
+        user = person.get('user')
+
+        commit[role] = {'id': user['databaseId'], 'login': user['login']} if user else None
+        commit['commit'][role] = {'name': person.get('name'), 'email': person.get('email'),
+                                  'date': get_utc_date(person.get('date'))}
+
+    return commit
+
+def get_utc_date(date):
+    # the git dates keep the timezone of the author, the commits endpoint returns them in UTC
+    if not date:
+        return date
+
+    return pd.Timestamp(date).tz_convert('UTC').strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def get_git_timestamp(date):
+    return f'{date}T00:00:00Z' if len(date) == 10 else date
+
+def get_high_water_mark(row, crawling):
+    high_water_marks = crawling['high_water_marks']
+
+    return high_water_marks.get(row['id']) if high_water_marks else None
+
+def get_page_query(row, cursor):
+    # the cursor of each page is kept in the checkpoint to continue an interrupted repository
+    return f"{GRAPHQL_URL}?{urlencode({'repository': row['full_name'], 'after': cursor if cursor else ''})}"
+
+def get_page_cursor(complete_query):
+    if not complete_query or not complete_query.startswith(GRAPHQL_URL):
+        return None
+
+    cursor = parse_qs(urlparse(complete_query).query).get('after')
+
+    return cursor[0] if cursor else None
+
+def save_result_query(tokens, query, commits_sink, file_name, context_values, last_sha=None):
+    # not found, blocked and empty repositories are raised by utils_api as permanent failures
+    result = cache.get(query, tokens, 'core')
+    commits = api.get_data(result)
+
+    if not isinstance(commits, list):
+        raise api.RequestError(query, 'core', api.PERMANENT, result.status_code, api.get_message(result))
+
+    # the since param includes the commit of the high-water mark, that was already saved
+    if last_sha:
+        commits = [commit for commit in commits if commit['sha'] != last_sha]
+
+    if commits:
+        commits_sink.write(commits, file_name, context_values)
+
+    return commits, result.links
+
+def save_failed_request(crawling, rows, error):
+    cp.save_dead_letter(crawling['checkpoint'], error)
+
+    if error.kind == api.PERMANENT:
+        print(f'INFO: Repository not found or access blocked! ({error.status} - {error.message})')
+        save_repositories_not_found(error.url, crawling['language'], crawling['partition'], crawling['token_key'])
+        return
+
+    print(f'ERROR: the request was given up after {error.attempts} attempts - {error}')
+    for row in rows:
+        crawling['failed'].add(row['id'])
 
 def save_repositories_not_found(query, language, partition, token_key, separator=','):
     main_path = os.path.join(utils.get_main_path(), 'data', 'crawler', 'commits', language.lower())
     if not partition:
         file_name = os.path.join(main_path, 'crawling_commits_repositories_not_found.csv')
     else:
+        token_key = token_key.replace(',', '_')
         file_name = os.path.join(main_path, f'crawling_commits_repositories_not_found_part_{partition}_{token_key}.csv')
 
     with open(file_name, mode='a', newline='') as a:
@@ -120,40 +466,11 @@ def save_repositories_not_found(query, language, partition, token_key, separator
         csv_file.writerow([str(datetime.now()), query])
     a.close()
 
-def create_progress_file(in_progress, language, partition, token_key, separator=','):
-    main_path = os.path.join(utils.get_main_path(), 'data', 'crawler', 'commits', language.lower())
-
-    if not partition:
-        file_name = os.path.join(main_path, 'crawling_commits_metadata.csv')
-    else:
-        file_name = os.path.join(main_path, f'crawling_commits_metadata_part_{partition}_{token_key}.csv')
-    
-    filter_list = None
-
-    if not in_progress:
-        # create the metadata file with the header
-        with open(file_name, mode='w', newline='') as w:
-            csv_file = csv.writer(w, delimiter=separator)
-            csv_file.writerow(['log_date', 'language', 'id', 'full_name', 'updated_at', 'page', 'complete_query'])
-        w.close()
-    else:
-        # open the file and get the list of repositories
-        # the last repository will be outside the list because it could not be finished
-        # the logs for that repository have to be excluded
-        log_file_df = pd.read_csv(file_name, sep=separator)
-        last_repository = log_file_df.iloc[-1]['id']
-
-        log_file_df = log_file_df[log_file_df['id'] != last_repository]
-        log_file_df.sort_values(by=['log_date']).to_csv(file_name, sep=',', index=False)
-
-        filter_list = log_file_df['id'].unique().tolist()
-
-    return file_name, filter_list
-
 def main():    
     parser = argparse.ArgumentParser(description='Repositories collector from Github')
     parser.add_argument('-t', '--token', 
-                        help='The Github token identifier to crawling data', required=True)
+                        help='The Github token identifier to crawling data (comma separated identifiers or all share the tokens)',
+                        required=True)
     parser.add_argument('-l', '--language', 
                         help='The programming language to be collected (hint: replace spaces by +)', required=True)
     parser.add_argument('--end_date', default='2020-11-30', 
@@ -163,6 +480,37 @@ def main():
                         required=False)
     parser.add_argument('-p', '--partition', default=None,
                         help='If the input file is partitionated, this param gives the partition')
+    parser.add_argument('--incremental', default='false',
+                        help='Use this param with True value to crawl only the commits after the last crawling of each repository',
+                        required=False)
+    parser.add_argument('-o', '--output', default='csv', choices=['csv', 'parquet'],
+                        help='Save one csv file per page or parquet shards with the flattened commits', required=False)
+    parser.add_argument('-f', '--fields', default=None,
+                        help='Comma separated fields of the commits to be saved, or a json file with the fields '
+                             '(without it, every field of the commits schema)', required=False)
+    parser.add_argument('--cache', default='false',
+                        help='Use this param with True value to keep responses on disk and send conditional requests',
+                        required=False)
+    parser.add_argument('--cache-size', default=None,
+                        help='Maximum size of the responses cache in MB', required=False)
+    parser.add_argument('-c', '--concurrency', default=1,
+                        help='Maximum number of requests in flight (values above 1 crawl repositories and pages concurrently)',
+                        required=False)
+    parser.add_argument('-b', '--backend', default='rest', choices=['rest', 'graphql'],
+                        help='Request the commits from the REST endpoint or the GraphQL API', required=False)
+    parser.add_argument('--timeout', default=None,
+                        help='Seconds to wait for the response of each request (60 by default)', required=False)
+    parser.add_argument('--pool-size', default=None,
+                        help='Maximum number of connections kept open with the API (the larger of 10 and the concurrency by default)', required=False)
+    parser.add_argument('--batch-size', default=20,
+                        help='Number of repositories requested in each GraphQL query', required=False)
+    parser.add_argument('--metrics', default='false',
+                        help='Use this param with True value to save a summary of the metrics and report the throughput periodically',
+                        required=False)
+    parser.add_argument('--metrics-port', default=None,
+                        help='Port of a local Prometheus endpoint with the metrics of the crawling', required=False)
+    parser.add_argument('--metrics-interval', default=60,
+                        help='Seconds between the metrics summaries', required=False)
 
     args = parser.parse_args()
     
@@ -170,16 +518,65 @@ def main():
     start_time = datetime.now()
     print('Crawling stated at', start_time)
 
-    # Get token by key
-    token = utils.get_token_key(args.token)
-    print(f'Token successfully obtained using token key {args.token}\n')
+    # Get token by key or the pool with all tokens
+    if args.token.lower() == 'all':
+        tokens = utils.get_all_tokens()
+        print(f'{len(tokens)} tokens successfully obtained from the tokens file\n')
+    else:
+        tokens = [utils.get_token_key(token_key) for token_key in args.token.split(',')]
+        print(f'{len(tokens)} token(s) successfully obtained using token key {args.token}\n')
+
+    # Only the selected fields of the commits are saved
+    projection = None
+    if args.fields:
+        try:
+            projection = sink.select_fields(sink.COMMITS_SCHEMA, args.fields, sink.COMMITS_REQUIRED)
+        except ValueError as error:
+            print(error)
+            sys.exit(-1)
+
+    # Export the metrics of the crawling
+    metrics_name = f'collect_commits_part_{args.partition}' if args.partition else 'collect_commits'
+    metrics.start(metrics_name, args.language, args.metrics_port, args.metrics.lower() == 'true', args.metrics_interval)
+
+    # Set the timeout and the connections of the requests
+    http.configure(read_timeout=args.timeout, pool_maxsize=args.pool_size)
+
+    # Load the current budget of each token (requests to /rate_limit are free)
+    for token in tokens:
+        api.load_rate_limit(token)
 
-    # Recover the metadata file
-    in_progress = args.cont.lower() == 'true'
-    metadata_file_name, filter_list = create_progress_file(in_progress, args.language, args.partition, args.token)
+    # Enable the responses cache
+    if args.cache.lower() == 'true':
+        cache.configure(max_size_mb=args.cache_size)
+
+    # Recover the progress of the crawling from the checkpoint of the language
+    checkpoint = cp.open_checkpoint(args.language)
+
+    filter_list = None
+    resume_state = None
+    if args.cont.lower() == 'true':
+        filter_list = cp.get_finished_repositories(checkpoint, args.end_date)
+        resume_state = cp.get_unfinished_repositories(checkpoint, args.end_date)
+        print(f'{len(filter_list)} repositories finished and {len(resume_state)} interrupted in the checkpoint\n')
+
+    # Recover the newest commit already saved for each repository
+    high_water_marks = None
+    if args.incremental.lower() == 'true':
+        high_water_marks = cp.get_high_water_marks(checkpoint)
+        print(f'High-water marks found for {len(high_water_marks)} repositories\n')
 
     # Create the search query using the given params and save the results
-    get_commits_by_repo(token, metadata_file_name, args.language, args.end_date, args.partition, args.token, filter_list)
+    # the sink is closed before the checkpoint, so the pages saved by an interrupted crawling are recorded
+    try:
+        get_commits_by_repo(tokens, checkpoint, args.language, args.end_date, args.partition, args.token, filter_list,
+                            int(args.concurrency), high_water_marks, resume_state, args.output, args.backend,
+                            int(args.batch_size), projection)
+    finally:
+        checkpoint.close()
+
+        # Save the last metrics summary
+        metrics.stop()
     
     # Print finish time processing
     end_time = datetime.now()
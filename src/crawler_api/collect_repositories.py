@@ -1,8 +1,3 @@
-import requests
-import json
-import pandas as pd
-import math
-import csv
 import argparse
 
 import os
@@ -11,196 +6,234 @@ sys.path.append('../utils')
 
 import utils as utils
 import utils_api as api
+import utils_cache as cache
+import utils_checkpoint as cp
+import utils_http as http
+import utils_metrics as metrics
+import utils_sink as sink
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
-def get_repositories_by_time(token, metadata_path, language, start_date, end_date=None):
-    q_language = f'%3A\"{language}\"'
+# maximum number of results returned by the search API for a query
+MAX_SEARCH_RESULTS = 1000
+
+# first creation date considered for the repositories
+MIN_CREATION_DATE = '2010-01-01'
+
+def get_repositories_by_time(token, checkpoint, language, start_date, end_date=None, window_days=7, resume=False,
+                             output='csv', projection=None):
     q_per_page = '&per_page=100'
 
     # path to save crawling files
     crawler_path = os.path.join(utils.get_main_path(), 'data', 'crawler', 'repositories', language.lower(), 'daily_crawler')
 
-    # original query based on language and stars
-    base_query = f'https://api.github.com/search/repositories?q=stars%3A>0+created%3A>2010-01-01+language{q_language}'
-
     if not end_date:
         # if end date is not given, use the current date
         end_date = datetime.now().strftime('%Y-%m-%d')
 
-    # get all the dates for crawling
-    days = list(pd.date_range(start_date, end_date, freq='d'))
-    str_days = [d.strftime('%Y-%m-%d') for d in days]
+    # csv files by page or parquet shards with the flattened repositories
+    repositories_sink = sink.open_sink(output, crawler_path, f'repositories_{language.lower()}',
+                                       sink.REPOSITORIES_SCHEMA, sink.REPOSITORIES_CONTEXT, projection=projection)
 
-    for date in str_days:
-        q_date = f'%3A{date}'
+    start_date = parse_date(start_date)
+    end_date = parse_date(end_date)
 
-        date_query = base_query + f'+pushed{q_date}'
+    # plan and crawl one window of pushed dates at a time, so a resumed crawling loses at most one window
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + timedelta(days=window_days - 1), end_date)
 
-        r_date = requests.get(date_query, headers={'Authorization': 'token %s' % token}) 
-        data = json.loads(r_date.content)
-        total_count = data['total_count']
+        root = {'pushed': (window_start, window_end),
+                'created': (parse_date(MIN_CREATION_DATE), end_date),
+                'stars': (1, None)}
 
-        print(f'Requesting repositories for {date} - {total_count} results')
+        try:
+            with metrics.track_stage('plan'):
+                buckets = merge_buckets(plan_buckets(token, language, root))
+        except api.RequestError as error:
+            # the window is not finished, so a resumed crawling plans it again
+            print(f'ERROR: the planning of the window from {window_start} to {window_end} failed - {error}')
+            cp.save_dead_letter(checkpoint, error)
+            window_start = window_end + timedelta(days=1)
+            continue
 
-        # verify the request time from API
-        api.verify_request_time(token, 'search')
+        print(f'\nRequesting repositories pushed from {window_start} to {window_end} - {len(buckets)} queries planned\n')
+
+        window_failed = False
+
+        for bucket, total_count in buckets:
+            bucket_query = get_bucket_query(language, bucket)
+            pushed, created, stars = get_bucket_labels(bucket)
+
+            if total_count > MAX_SEARCH_RESULTS:
+                print(f'WARNING: {total_count} results for pushed {pushed}, created {created} and stars {stars} '
+                      f'can not be divided, only the first {MAX_SEARCH_RESULTS} will be collected')
 
-        if total_count <= 1000:
             page = 1
-            while data['items'] and page <= 10:
-                print(f'Requesting repositories for {date} - page {page}')
+            data = {'items': [''], 'total_count': total_count}
+            while data['items'] and (page - 1) * 100 < min(data['total_count'], MAX_SEARCH_RESULTS):
+                print(f'Requesting repositories pushed {pushed}, created {created} and stars {stars} - page {page}')
 
                 q_page = f'&page={page}'
-                complete_query = date_query + q_per_page + q_page
+                complete_query = bucket_query + q_per_page + q_page
+
+                # pages saved before the interruption are not requested again
+                if resume and cp.is_repository_page_saved(checkpoint, complete_query):
+                    page = page + 1
+                    continue
 
-                file_crawler_path = os.path.join(crawler_path, f'{language.lower()}_{date}_2010_{page}.csv')
+                file_name = '_'.join([language.lower()] + [get_file_label(label) for label in [pushed, created, stars]])
+                file_crawler_path = os.path.join(crawler_path, f'{file_name}_{page}.csv')
 
-                data = save_result_query(token, complete_query, file_crawler_path)
-                
-                # log progress
-                save_progress_metadata(metadata_path, language, 0, '2020-01-01', date, page,
-                                       data['total_count'], data['incomplete_results'], complete_query)
+                try:
+                    data = save_result_query(token, complete_query, repositories_sink, file_crawler_path)
+                except api.RequestError as error:
+                    # the page is parked and the window is not finished, so a resumed crawling requests it again
+                    print(f'ERROR: the page was given up - {error}')
+                    cp.save_dead_letter(checkpoint, error)
+                    window_failed = True
+                    break
+
+                # log progress when the page is saved by the sink
+                save_progress(repositories_sink, checkpoint, stars, created, pushed, page,
+                              data['total_count'], data['incomplete_results'], complete_query)
 
                 page = page + 1
 
-        else:
-            for year in range(2010, int(end_date[:4]) + 1):
-                q_creation_date = f'%3A{year}-01-01..{year}-12-31'
-
-                # new partitions by creation date
-                new_date_query = date_query.replace('+created%3A>2010-01-01', f'+created{q_creation_date}')
-
-                r_date = requests.get(new_date_query, headers={'Authorization': 'token %s' % token}) 
-                data = json.loads(r_date.content)
-                total_count = data['total_count']
-
-                print(f'Requesting repositories for {date} and creation year {year} - {total_count} results')
-
-                monthly_dividing = False
-
-                if total_count > 1000:
-                    monthly_dividing = True
-
-                # verify the request time from API
-                api.verify_request_time(token, 'search')
-
-                if not monthly_dividing:
-                    page = 1
-                    while data['items'] and page <= 10:
-                        print(f'Requesting repositories for {date} and creation year {year} - page {page}')
-
-                        q_page = f'&page={page}'
-                        new_complete_query = new_date_query + q_per_page + q_page
-                        
-                        new_file_crawler_path = os.path.join(crawler_path, f'{language.lower()}_{date}_{year}_{page}.csv')
-
-                        data = save_result_query(token, new_complete_query, new_file_crawler_path)
-                        
-                        # log progress
-                        save_progress_metadata(metadata_path, language, 0, f'{year}-01-01..{year}-12-31', date, page,
-                                            data['total_count'], data['incomplete_results'], new_complete_query)
-
-                        page = page + 1
-                else:
-                    month_groups = {1: ('01-01', '03-31'),
-                                    2: ('04-01', '06-30'),
-                                    3: ('07-01', '08-31'),
-                                    4: ('09-01', '10-31'),
-                                    5: ('11-01', '11-30'),
-                                    6: ('12-01', '12-31')}
-                    for month in month_groups:
-                        q_creation_date = f'%3A{year}-{month_groups[month][0]}..{year}-{month_groups[month][1]}'
-
-                        # new partitions by creation date
-                        monthly_date_query = date_query.replace('+created%3A>2010-01-01', f'+created{q_creation_date}')
-
-                        r_date = requests.get(monthly_date_query, headers={'Authorization': 'token %s' % token}) 
-                        data = json.loads(r_date.content)
-                        total_count = data['total_count']
-
-                        print(f'Requesting repositories for {date} and creation year {year} - monthly division {month} - {total_count} results')
-
-                        # verify the request time from API
-                        api.verify_request_time(token, 'search')
-
-                        page = 1
-                        while data['items'] and page <= 10:
-                            print(f'Requesting repositories for {date} and creation year {year} - monthly division {month} - page {page}')
-
-                            q_page = f'&page={page}'
-                            monthly_complete_query = monthly_date_query + q_per_page + q_page
-                            
-                            monthly_file_crawler_path = os.path.join(crawler_path, f'{language.lower()}_{date}_{year}_{month}_{page}.csv')
-
-                            data = save_result_query(token, monthly_complete_query, monthly_file_crawler_path)
-                            
-                            # log progress
-                            save_progress_metadata(metadata_path, language, 0, 
-                                                   f'{year}-{month_groups[month][0]}..{year}-{month_groups[month][1]}', 
-                                                   date, page, data['total_count'], data['incomplete_results'], monthly_complete_query)
-
-                            page = page + 1
-
-def save_result_query(token, query, file_name):
-    result = requests.get(query, headers={'Authorization': 'token %s' % token}) 
-    data = json.loads(result.content)
-
-    try:
-        total_count = data['total_count']
-        
-        if total_count > 1000:
-            print('!!! ERROR !!!')
-            print('Crawler was stopped because the total count is greater then 1000')
-            print('Please, look for another way of partition')
-            sys.exit()
-
-        if data['items']:
-            items = pd.DataFrame(data['items'])
-            items.to_csv(file_name, sep=',', index=False)
-    except:
-        print('Error to fetch data from request API')
-        print(data)
-        sys.exit()
-
-    # verify the request time from API
-    api.verify_request_time(token, 'search')
+        if not window_failed:
+            finish_window(repositories_sink, checkpoint, window_start, window_end)
 
-    return data
+        window_start = window_end + timedelta(days=1)
 
-def save_progress_metadata(file_name, language, stars, created_at, updated_at, page, total_count,
-                           incomplete_results, complete_query, separator=','):
-    with open(file_name, mode='a', newline='') as a:
-        csv_file = csv.writer(a, delimiter=separator)
-        
-        csv_file.writerow([str(datetime.now()),
-                           language, stars, created_at, updated_at,
-                           page, total_count, incomplete_results, complete_query])
+    repositories_sink.close()
 
-    a.close()
+def save_progress(repositories_sink, checkpoint, stars, created, pushed, page, total_count, incomplete_results, complete_query):
+    repositories_sink.when_saved(lambda: cp.save_repository_page(checkpoint, stars, created, pushed, page, total_count,
+                                                                 incomplete_results, complete_query))
 
-def create_progress_file(in_progress, language, separator=','):
-    file_name = os.path.join(utils.get_main_path(), 'data', 'crawler', 'repositories', language.lower(), f'crawling_repositories_metadata.csv')
-    
-    last_updated_date = None
+def finish_window(repositories_sink, checkpoint, window_start, window_end):
+    repositories_sink.when_saved(lambda: cp.finish_repository_window(checkpoint, window_start, window_end))
 
-    if not in_progress:
-        # create the metadata file with the header
-        with open(file_name, mode='w', newline='') as w:
-            csv_file = csv.writer(w, delimiter=separator)
-            csv_file.writerow(['log_date', 'language', 'stars', 'created_at', 'updated_at', 'page', 
-                               'total_count', 'incomplete_results', 'complete_query'])
-        w.close()
+def plan_buckets(token, language, bucket, total_count=None):
+    if total_count is None:
+        total_count = get_total_count(token, get_bucket_query(language, bucket))
+
+    # empty buckets do not need any request
+    if total_count == 0:
+        return []
+
+    children = split_bucket(bucket)
+
+    if total_count <= MAX_SEARCH_RESULTS or not children:
+        return [(bucket, total_count)]
+
+    # the children divide the bucket, so only the first one is probed and the second one has the remaining results
+    first_count = get_total_count(token, get_bucket_query(language, children[0]))
+    second_count = total_count - first_count if first_count <= total_count else None
+
+    return plan_buckets(token, language, children[0], first_count) + plan_buckets(token, language, children[1], second_count)
+
+def split_bucket(bucket):
+    # bisect the pushed dates first, then the creation dates and finally the stars
+    for dimension in ['pushed', 'created']:
+        start, end = bucket[dimension]
+        if start < end:
+            middle = start + (end - start) // 2
+            return [dict(bucket, **{dimension: (start, middle)}), dict(bucket, **{dimension: (middle + timedelta(days=1), end)})]
+
+    start, end = bucket['stars']
+    if end is None:
+        # the stars are very skewed, so the open range is divided in geometric steps
+        return [dict(bucket, stars=(start, start * 2)), dict(bucket, stars=(start * 2 + 1, None))]
+    if start < end:
+        middle = (start + end) // 2
+        return [dict(bucket, stars=(start, middle)), dict(bucket, stars=(middle + 1, end))]
+
+    return []
+
+def merge_buckets(buckets):
+    merged = []
+
+    for bucket, total_count in buckets:
+        if merged:
+            last_bucket, last_count = merged[-1]
+            merged_bucket = get_merged_bucket(last_bucket, bucket)
+
+            # adjacent buckets are queried together while they fit in the result limit
+            if merged_bucket and last_count + total_count <= MAX_SEARCH_RESULTS:
+                merged[-1] = (merged_bucket, last_count + total_count)
+                continue
+
+        merged.append((bucket, total_count))
+
+    return merged
+
+def get_merged_bucket(first, second):
+    different = [dimension for dimension in ['pushed', 'created', 'stars'] if first[dimension] != second[dimension]]
+
+    if len(different) != 1:
+        return None
+
+    dimension = different[0]
+    first_end, second_start = first[dimension][1], second[dimension][0]
+
+    # only contiguous ranges can be merged
+    if first_end is None:
+        return None
+    if dimension == 'stars' and first_end + 1 != second_start:
+        return None
+    if dimension != 'stars' and first_end + timedelta(days=1) != second_start:
+        return None
+
+    return dict(first, **{dimension: (first[dimension][0], second[dimension][1])})
+
+def get_bucket_query(language, bucket):
+    q_language = f'%3A\"{language}\"'
+    pushed, created, stars = get_bucket_labels(bucket)
+
+    if bucket['stars'][1] is None:
+        q_stars = f'%3A>%3D{bucket["stars"][0]}'
     else:
-        # open the file and get the last date crawled
-        # the logs for that date have to be excluded
-        log_file_df = pd.read_csv(file_name, sep=separator)
-        last_updated_date = max(log_file_df['updated_at'])
+        q_stars = f'%3A{bucket["stars"][0]}..{bucket["stars"][1]}'
+
+    return (f'{api.API_URL}/search/repositories?q=stars{q_stars}+created%3A{created}'
+            f'+pushed%3A{pushed}+language{q_language}')
+
+def get_bucket_labels(bucket):
+    pushed = f"{bucket['pushed'][0]}..{bucket['pushed'][1]}"
+    created = f"{bucket['created'][0]}..{bucket['created'][1]}"
+    stars = f"{bucket['stars'][0]}..{bucket['stars'][1] if bucket['stars'][1] is not None else '*'}"
+
+    return pushed, created, stars
+
+def get_file_label(label):
+    # the ranges in the file names without the characters of the shells and of other systems
+    return label.replace('..', '_').replace('*', 'inf')
+
+def get_total_count(token, query):
+    # a single item is enough to know the number of results
+    # the retries of utils_api give a response with the total count or an error
+    result = api.get(query + '&per_page=1', token, 'search')
+    total_count = int(api.get_data(result)['total_count'])
+
+    print(f'Probing {query} - {total_count} results')
+
+    return total_count
+
+def parse_date(date):
+    return datetime.strptime(str(date)[:10], '%Y-%m-%d').date()
+
+def save_result_query(token, query, repositories_sink, file_name):
+    result = cache.get(query, [token], 'search')
+    data = api.get_data(result)
+
+    if data['total_count'] > MAX_SEARCH_RESULTS:
+        print(f'WARNING: total count is greater than {MAX_SEARCH_RESULTS}, some results will not be collected')
 
-        log_file_df = log_file_df[log_file_df['updated_at'] != last_updated_date]
-        log_file_df.to_csv(file_name, sep=',', index=False)
+    if data['items']:
+        repositories_sink.write(data['items'], file_name)
 
-    return file_name, last_updated_date
+    return data
 
 def main():    
     parser = argparse.ArgumentParser(description='Repositories collector from Github')
@@ -210,9 +243,36 @@ def main():
                         help='The programming language to be collected (hint: replace spaces by +)', required=True)
     parser.add_argument('-d', '--date', default='2019-12-01', 
                         help='The start date for crawling (format: YYYY-MM-DD)', required=True)
+    parser.add_argument('--end_date', default=None,
+                        help='The last pushed date for crawling (format: YYYY-MM-DD, the current date by default)',
+                        required=False)
     parser.add_argument('--cont', default=False,
                         help='Use this param with True value to continue a started crawling in a specific language',
                         required=False)
+    parser.add_argument('--cache', default='false',
+                        help='Use this param with True value to keep responses on disk and send conditional requests',
+                        required=False)
+    parser.add_argument('--cache-size', default=None,
+                        help='Maximum size of the responses cache in MB', required=False)
+    parser.add_argument('-o', '--output', default='csv', choices=['csv', 'parquet'],
+                        help='Save one csv file per page or parquet shards with the flattened repositories', required=False)
+    parser.add_argument('-f', '--fields', default=None,
+                        help='Comma separated fields of the repositories to be saved, or a json file with the fields '
+                             '(without it, the csv pages keep every field of the API)', required=False)
+    parser.add_argument('-w', '--window', default=7,
+                        help='Number of pushed days planned together (days with few results are queried together)',
+                        required=False)
+    parser.add_argument('--timeout', default=None,
+                        help='Seconds to wait for the response of each request (60 by default)', required=False)
+    parser.add_argument('--pool-size', default=None,
+                        help='Maximum number of connections kept open with the API (10 by default)', required=False)
+    parser.add_argument('--metrics', default='false',
+                        help='Use this param with True value to save a summary of the metrics and report the throughput periodically',
+                        required=False)
+    parser.add_argument('--metrics-port', default=None,
+                        help='Port of a local Prometheus endpoint with the metrics of the crawling', required=False)
+    parser.add_argument('--metrics-interval', default=60,
+                        help='Seconds between the metrics summaries', required=False)
 
     args = parser.parse_args()
     
@@ -224,15 +284,45 @@ def main():
     token = utils.get_token_key(args.token)
     print(f'Token successfully obtained using token key {args.token}\n')
 
-    # Recover the metadata file
-    in_progress = args.cont.lower() == 'true'
-    metadata_file_name, last_updated_date = create_progress_file(in_progress, args.language)
+    # Only the selected fields of the repositories are saved
+    projection = None
+    if args.fields:
+        try:
+            projection = sink.select_fields(sink.REPOSITORIES_SCHEMA, args.fields, sink.REPOSITORIES_REQUIRED)
+        except ValueError as error:
+            print(error)
+            sys.exit(-1)
+
+    # Export the metrics of the crawling
+    metrics.start('collect_repositories', args.language, args.metrics_port, args.metrics.lower() == 'true', args.metrics_interval)
+
+    # Set the timeout and the connections of the requests
+    http.configure(read_timeout=args.timeout, pool_maxsize=args.pool_size)
 
-    # Replace the date when last_updated_date is not null
-    crawling_date = last_updated_date if last_updated_date else args.date
+    # Enable the responses cache
+    if args.cache.lower() == 'true':
+        cache.configure(max_size_mb=args.cache_size)
+
+    # Recover the progress of the crawling from the checkpoint of the language
+    checkpoint = cp.open_checkpoint(args.language)
+
+    in_progress = str(args.cont).lower() == 'true'
+    last_window_date = cp.get_last_repository_window(checkpoint, parse_date(args.date)) if in_progress else None
+
+    if not in_progress:
+        cp.clear_repository_windows(checkpoint)
+
+    # Continue on the day after the last finished window
+    crawling_date = parse_date(last_window_date) + timedelta(days=1) if last_window_date else args.date
 
     # Create the search query using the given params and save the results
-    get_repositories_by_time(token, metadata_file_name, args.language, crawling_date)
+    get_repositories_by_time(token, checkpoint, args.language, crawling_date, args.end_date, int(args.window),
+                             resume=in_progress, output=args.output, projection=projection)
+
+    checkpoint.close()
+
+    # Save the last metrics summary
+    metrics.stop()
     
     # Print finish time processing
     end_time = datetime.now()
@@ -1,8 +1,5 @@
-import requests
-import json
 import argparse
 from datetime import datetime
-import time
 import csv
 
 import os
@@ -13,15 +10,18 @@ import pandas as pd
 
 import utils as utils
 import utils_api as api
+import utils_checkpoint as cp
+import utils_http as http
+import utils_metrics as metrics
 
 def get_max_stars(token, language, start_date):
     q_date = f'%3e{start_date}'
     q_language = f'\"{language}\"'
     
-    complete_query = f'https://api.github.com/search/repositories?q=language%3A{q_language}+pushed%3A{q_date}&s=stars&o=desc'
-    r = requests.get(complete_query,  headers={'Authorization': 'token %s' % token})
+    complete_query = f'{api.API_URL}/search/repositories?q=language%3A{q_language}+pushed%3A{q_date}&s=stars&o=desc'
+    r = api.get(complete_query, token, 'search')
 
-    data = json.loads(r.content)
+    data = api.get_data(r)
 
     total_repositories = int(data['total_count'])
     incomplete_results = bool(data['incomplete_results'])
@@ -35,13 +35,10 @@ def get_max_stars(token, language, start_date):
 
     return stars
 
-def save_stars_histogram(token, language, start_date, init_star, max_stars, stars_file_path, separator=','):
+def save_stars_histogram(token, checkpoint, language, start_date, init_star, max_stars, stars_file_path, separator=','):
     # Get stars base query by the language and start date
     stars_query = get_stars_base_query(start_date, language)
 
-    stars_count = {}
-    stars_incomplete = {}
-
     with open(stars_file_path, mode='a', newline='') as a:
         csv_file = csv.writer(a, delimiter=separator)
 
@@ -49,28 +46,88 @@ def save_stars_histogram(token, language, start_date, init_star, max_stars, star
         for i in range(init_star, max_stars+10):
             print(f'Getting {language} repositories with {i} stars')
 
-            number_of_repositories, incomplete_results = get_repositories_from_stars(stars_query, i, token)
+            number_of_repositories, incomplete_results = get_repositories_from_stars(stars_query, i, token, checkpoint)
 
             # save the retrieved row in file
             csv_file.writerow([i, number_of_repositories, incomplete_results])
 
-            # verify the request time from API
-            api.verify_request_time(token, 'search')
+            # the row is on disk before the checkpoint considers it done
+            a.flush()
+            cp.save_stars_range(checkpoint, i, i, number_of_repositories, incomplete_results)
+    a.close()
+
+def save_stars_histogram_by_range(token, checkpoint, language, start_date, init_star, max_stars, stars_file_path,
+                                  separator=','):
+    # Get stars base query by the language and start date
+    stars_query = get_stars_base_query(start_date, language)
+
+    with open(stars_file_path, mode='a', newline='') as a:
+        csv_file = csv.writer(a, delimiter=separator)
+
+        # Add 10 to the max_stars number due to possible gain of more stars during the process
+        # the ranges are kept in a stack, so they are visited in ascending order of stars
+        ranges = [(init_star, max_stars+10)]
+
+        # consecutive empty ranges are saved in a single row
+        empty_range = None
+
+        while ranges:
+            start, end = ranges.pop()
+            stars = get_stars_label(start, end)
+
+            print(f'Getting {language} repositories with {stars} stars')
+
+            number_of_repositories, incomplete_results = get_repositories_from_stars(stars_query, stars, token, checkpoint)
+
+            # only non empty ranges wider than one star need to be divided
+            if number_of_repositories > 0 and start < end:
+                middle = (start + end) // 2
+                ranges.append((middle + 1, end))
+                ranges.append((start, middle))
+                continue
+
+            if number_of_repositories == 0 and not incomplete_results:
+                empty_range = (empty_range[0] if empty_range else start, end)
+                continue
+
+            if empty_range:
+                save_stars_row(csv_file, a, checkpoint, *empty_range, 0, False)
+                empty_range = None
+
+            # save the retrieved row in file
+            save_stars_row(csv_file, a, checkpoint, start, end, number_of_repositories, incomplete_results)
+
+        if empty_range:
+            save_stars_row(csv_file, a, checkpoint, *empty_range, 0, False)
     a.close()
 
-def get_repositories_from_stars(stars_query, stars, token):
+def save_stars_row(csv_file, stars_file, checkpoint, start, end, number_of_repositories, incomplete_results):
+    csv_file.writerow([get_stars_label(start, end), number_of_repositories, incomplete_results])
+
+    # the row is on disk before the checkpoint considers it done
+    stars_file.flush()
+    cp.save_stars_range(checkpoint, start, end, number_of_repositories, incomplete_results)
+
+def get_stars_label(start, end):
+    return f'{start}..{end}' if start < end else start
+
+def get_repositories_from_stars(stars_query, stars, token, checkpoint=None):
     stars_statement = f'+stars%3A{stars}'
     complete_query = stars_query + stars_statement
-    r = requests.get(complete_query, headers={'Authorization': 'token %s' % token})
-
-    data = json.loads(r.content)
 
     try:
-        number_of_repositories = int(data['total_count'])
-        incomplete_results = bool(data['incomplete_results'])
-    except:
-        print(data)
-        sys.exit(-1)
+        r = api.get(complete_query, token, 'search')
+    except api.RequestError as error:
+        # saved as an incomplete row, so the query is requested again by the reprocessing
+        print(f'ERROR: the query was given up - {error}')
+        if checkpoint is not None:
+            cp.save_dead_letter(checkpoint, error)
+        return 0, True
+
+    data = api.get_data(r)
+
+    number_of_repositories = int(data['total_count'])
+    incomplete_results = bool(data['incomplete_results'])
 
     return number_of_repositories, incomplete_results
 
@@ -78,11 +135,11 @@ def get_stars_base_query(start_date, language):
     q_date = f'%3e{start_date}'
     q_language = f'\"{language}\"'
 
-    stars_query = f'https://api.github.com/search/repositories?q=language%3A{q_language}+pushed%3A{q_date}'
+    stars_query = f'{api.API_URL}/search/repositories?q=language%3A{q_language}+pushed%3A{q_date}'
 
     return stars_query
 
-def reprocess_stars_histogram(token, language, start_date, stars_file_path, separator=','):
+def reprocess_stars_histogram(token, language, start_date, stars_file_path, checkpoint=None, separator=','):
     # read the complete stars file for a specific language
     df_stars = pd.read_csv(stars_file_path, sep=separator)
     df_stars_reprocessed = df_stars.copy()
@@ -90,16 +147,13 @@ def reprocess_stars_histogram(token, language, start_date, stars_file_path, sepa
 
     stars_query = get_stars_base_query(start_date, language)
 
-    for rep_star in df_stars[df_stars['incomplete_results']]['stars']:
+    for index, rep_star in df_stars[df_stars['incomplete_results']]['stars'].items():
         print(f'Reprocessing {language} repositories with {rep_star} stars')
         
-        number_of_repositories, incomplete_results = get_repositories_from_stars(stars_query, rep_star, token)
-        df_stars_reprocessed.loc[rep_star, ('repositories', 'incomplete_results', 'reprocessed')] = \
+        number_of_repositories, incomplete_results = get_repositories_from_stars(stars_query, rep_star, token, checkpoint)
+        df_stars_reprocessed.loc[index, ('repositories', 'incomplete_results', 'reprocessed')] = \
                                            (number_of_repositories, incomplete_results, True)
 
-        # verify the request time from API
-        api.verify_request_time(token, 'search')
-
     df_stars_reprocessed.to_csv(stars_file_path.replace('.csv', '_reprocessed.csv'), index=False, sep=separator)
 
 def create_replace_stars_file(file_path, separator=','):
@@ -109,7 +163,13 @@ def create_replace_stars_file(file_path, separator=','):
         csv_file.writerow(['stars', 'repositories', 'incomplete_results'])
     w.close()
 
-def get_crawling_progress(file_path, separator=','):
+def get_crawling_progress(checkpoint, file_path, separator=','):
+    last_star = cp.get_last_star(checkpoint)
+
+    if last_star is not None:
+        return last_star + 1
+
+    # files saved without a checkpoint have to be read until the last line
     with open(file_path, mode='r', newline='') as r:
         csv_file = csv.reader(r, delimiter=separator)
         next(csv_file, None)  # skip the headers
@@ -118,7 +178,8 @@ def get_crawling_progress(file_path, separator=','):
         for last_line in csv_file:
             pass 
 
-        last_star = int(last_line[0]) + 1 if last_line else 0
+        # the last row can be a range of stars (start..end)
+        last_star = int(last_line[0].split('..')[-1]) + 1 if last_line else 0
     r.close()
 
     return last_star
@@ -136,6 +197,20 @@ def main():
                         required=False)
     parser.add_argument('--reprocess', '-r', default=False,
                         help='Reprocess queries for the incomplete results in the first time', required=False)
+    parser.add_argument('-m', '--mode', default='single', choices=['single', 'range'],
+                        help='Query one star value at a time or divide ranges of stars until they are empty or a single value',
+                        required=False)
+    parser.add_argument('--timeout', default=None,
+                        help='Seconds to wait for the response of each request (60 by default)', required=False)
+    parser.add_argument('--pool-size', default=None,
+                        help='Maximum number of connections kept open with the API (10 by default)', required=False)
+    parser.add_argument('--metrics', default='false',
+                        help='Use this param with True value to save a summary of the metrics and report the throughput periodically',
+                        required=False)
+    parser.add_argument('--metrics-port', default=None,
+                        help='Port of a local Prometheus endpoint with the metrics of the crawling', required=False)
+    parser.add_argument('--metrics-interval', default=60,
+                        help='Seconds between the metrics summaries', required=False)
 
     args = parser.parse_args()
     
@@ -147,28 +222,46 @@ def main():
     token = utils.get_token_key(args.token)
     print(f'Token successfully obtained using token key {args.token}\n')
 
+    # Set the timeout and the connections of the requests
+    http.configure(read_timeout=args.timeout, pool_maxsize=args.pool_size)
+
+    # Export the metrics of the crawling
+    metrics.start('collect_stars', args.language, args.metrics_port, args.metrics.lower() == 'true', args.metrics_interval)
+
     stars_file_path = os.path.join(utils.get_main_path(), 'data', 'crawler', 'stars', f'{args.language}_stars_histogram.csv')
 
+    # Checkpoint with the ranges of stars already saved
+    checkpoint = cp.open_checkpoint(args.language)
+
     if not args.reprocess:
         # Recover the last number of stars or inicialize a new file
         if args.cont.lower() == 'true':
-            init_star = get_crawling_progress(stars_file_path)
+            init_star = get_crawling_progress(checkpoint, stars_file_path)
         else:
             init_star = 0
             create_replace_stars_file(stars_file_path)
+            cp.clear_stars_ranges(checkpoint)
 
         # Get max stars for language
         max_stars = get_max_stars(token, args.language, args.date)
 
         # Save the histogram of repositories by stars
-        save_stars_histogram(token, args.language, args.date, init_star, max_stars, stars_file_path)
+        if args.mode == 'range':
+            save_stars_histogram_by_range(token, checkpoint, args.language, args.date, init_star, max_stars, stars_file_path)
+        else:
+            save_stars_histogram(token, checkpoint, args.language, args.date, init_star, max_stars, stars_file_path)
         print(f'\nStars file successfully saved on {stars_file_path}\n')
     else:
         # Reprocess the histogram of repositories by stars
         stars_reprocessed_file_path = stars_file_path.replace('.csv', '_reprocessed.csv')
-        reprocess_stars_histogram(token, args.language, args.date, stars_file_path)
+        reprocess_stars_histogram(token, args.language, args.date, stars_file_path, checkpoint)
         print(f'\nStars reprocessed file successfully saved on {stars_reprocessed_file_path}\n')
 
+    checkpoint.close()
+
+    # Save the last metrics summary
+    metrics.stop()
+
     # Print finish time processing
     end_time = datetime.now()
     print(f'Crawling finished at {end_time}\n')
@@ -1,6 +1,8 @@
 import argparse
+import shutil
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
 import os
@@ -8,37 +10,197 @@ import sys
 sys.path.append('../utils')
 
 import utils as utils
+import utils_checkpoint as cp
+import utils_index as index
+import utils_sink as sink
 
-def read_all_files(main_path):
+# columns of each crawled row used to keep the latest version of a repository
+RECENCY_COLUMNS = ['id', 'updated_at', 'pushed_at']
+
+def list_crawled_files(main_path):
     folder_path = os.path.join(main_path, 'daily_crawler')
 
-    repositories_df = pd.DataFrame()
+    # the order of the files does not tell which version of a repository is the latest, the dates of the rows do
+    return [os.path.join(folder_path, file_name) for file_name in sorted(os.listdir(folder_path)) if sink.is_data_file(file_name)]
+
+def index_repositories(file_paths, chunk_size):
+    # only the keys and the position of each row are kept in memory
+    index_chunks = []
+    columns = []
+
+    for file_number, file_path in enumerate(file_paths):
+        print('Indexing file', os.path.basename(file_path))
+
+        columns.extend(column for column in sink.get_file_columns(file_path) if column not in columns)
+
+        file_mtime = os.stat(file_path).st_mtime
+
+        row_number = 0
+        for chunk_df in sink.iter_file_chunks(file_path, RECENCY_COLUMNS, chunk_size):
+            index_chunk_df = get_recency(chunk_df)
+            index_chunk_df['file_mtime'] = file_mtime
+            index_chunk_df['file_number'] = np.int32(file_number)
+            index_chunk_df['row_number'] = np.arange(row_number, row_number + len(chunk_df), dtype=np.int64)
+
+            index_chunks.append(index_chunk_df)
+            row_number += len(chunk_df)
+
+    if not index_chunks:
+        return pd.DataFrame(columns=RECENCY_COLUMNS + ['file_mtime', 'file_number', 'row_number']), columns
+
+    return pd.concat(index_chunks, ignore_index=True), columns
+
+def get_recency(chunk_df):
+    # the dates of each row in seconds, the latest version of a repository has the largest ones
+    return pd.DataFrame({'id': chunk_df['id'].values,
+                         'updated_at': utils.to_epoch(chunk_df['updated_at'].values),
+                         'pushed_at': utils.to_epoch(chunk_df['pushed_at'].values)})
+
+def deduplicate_repositories(index_df):
+    # the id identifies a repository, so a renamed repository keeps only its latest version
+    # the rows crawled with the same dates are taken from the file written last
+    index_df = index_df.sort_values(['updated_at', 'pushed_at', 'file_mtime', 'file_number', 'row_number'], kind='stable')
+
+    return index_df.drop_duplicates(subset=['id'], keep='last')
+
+def get_file_states(file_paths):
+    # a file is identified by the name, size and modification time when it was merged
+    file_states = {}
+
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        file_states[os.path.basename(file_path)] = (stat.st_size, stat.st_mtime)
+
+    return file_states
+
+def get_new_files(file_paths, file_states, merged_files):
+    # a merged file changed or removed would leave stale rows in the store
+    for file_name, state in merged_files.items():
+        if file_states.get(file_name) != tuple(state):
+            print('File changed since the last merge:', file_name)
+            return None
+
+    new_file_paths = [file_path for file_path in file_paths if os.path.basename(file_path) not in merged_files]
+
+    # rows with the same dates are taken from the file written last, as in a rebuild, so the new files must be newer
+    last_merged_mtime = max((mtime for size, mtime in merged_files.values()), default=None)
+    for file_path in new_file_paths:
+        if last_merged_mtime is not None and file_states[os.path.basename(file_path)][1] < last_merged_mtime:
+            print('File older than the last merge:', os.path.basename(file_path))
+            return None
+
+    return new_file_paths
+
+def write_kept_rows(w, file_paths, kept_index_df, columns, chunk_size, header):
+    # rows to be kept in each file
+    kept_rows = {file_number: group_df['row_number'].values
+                 for file_number, group_df in kept_index_df.groupby('file_number')}
+
+    for file_number, input_file_path in enumerate(file_paths):
+        if file_number not in kept_rows:
+            continue
+
+        row_number = 0
+        for chunk_df in sink.iter_file_chunks(input_file_path, chunk_size=chunk_size):
+            positions = np.arange(row_number, row_number + len(chunk_df))
+            row_number += len(chunk_df)
 
-    for file_name in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, file_name)
-        print('Reading file', file_name)
+            chunk_df = chunk_df[np.isin(positions, kept_rows[file_number])].reindex(columns=columns)
+            chunk_df.to_csv(w, index=False, header=header)
+            header = False
 
-        file_df = pd.read_csv(file_path, sep=',')
+    return header
 
-        repositories_df = repositories_df.append(file_df, ignore_index=True)
+def save_deduplicated_file(store_path, file_paths, deduplicated_index_df, columns, chunk_size):
+    with open(store_path + '.tmp', mode='w', newline='') as w:
+        header = write_kept_rows(w, file_paths, deduplicated_index_df, columns, chunk_size, True)
 
-    return repositories_df
+        # files without repositories still have the header
+        if header:
+            pd.DataFrame(columns=columns).to_csv(w, index=False)
+    w.close()
 
-def deduplicate_repositories(repositories_df):
-    return repositories_df.drop_duplicates(subset=['id', 'full_name'], keep='last')
+    os.replace(store_path + '.tmp', store_path)
 
-def save_deduplicated_file(main_path, deduplicated_df, filtered=False):
+def merge_new_files(store_path, new_file_paths, chunk_size):
+    index_df, new_columns = index_repositories(new_file_paths, chunk_size)
+
+    # the latest version of each repository in the new files replaces the one in the store when it is not older
+    new_index_df = deduplicate_repositories(index_df)
+    new_recency_df = new_index_df.set_index('id')[['updated_at', 'pushed_at']]
+
+    columns = sink.get_file_columns(store_path)
+    columns.extend(column for column in new_columns if column not in columns)
+
+    store_rows = 0
+    newer_store_ids = []
+    with open(store_path + '.tmp', mode='w', newline='') as w:
+        header = True
+        for chunk_df in pd.read_csv(store_path, sep=',', chunksize=chunk_size):
+            # the new files are newer than the store, so the rows with the same dates are replaced
+            store_df = get_recency(chunk_df)
+            new_df = new_recency_df.reindex(store_df['id'].values)
+            newer = ((store_df['updated_at'].values > new_df['updated_at'].values) |
+                     ((store_df['updated_at'].values == new_df['updated_at'].values) &
+                      (store_df['pushed_at'].values > new_df['pushed_at'].values)))
+            replaced = new_df['updated_at'].notna().values & ~newer
+            newer_store_ids.extend(store_df['id'].values[new_df['updated_at'].notna().values & newer])
+
+            chunk_df = chunk_df[~replaced].reindex(columns=columns)
+            chunk_df.to_csv(w, index=False, header=header)
+            header = False
+
+            store_rows += len(chunk_df)
+
+        new_index_df = new_index_df[~new_index_df['id'].isin(newer_store_ids)]
+        write_kept_rows(w, new_file_paths, new_index_df, columns, chunk_size, header)
+    w.close()
+
+    os.replace(store_path + '.tmp', store_path)
+
+    print('\nRepositories in new files:', len(index_df))
+    print('Deduplicated repositories:', store_rows + len(new_index_df))
+
+def rebuild_store(store_path, file_paths, chunk_size):
+    # Index the keys of all the files and deduplicate them without loading the repositories
+    index_df, columns = index_repositories(file_paths, chunk_size)
+    deduplicated_index_df = deduplicate_repositories(index_df)
+
+    # Print processed data
+    print('\nRepositories in all files:', len(index_df))
+    print('Deduplicated repositories:', len(deduplicated_index_df))
+
+    # Save the deduplicated store reading the files again in chunks
+    save_deduplicated_file(store_path, file_paths, deduplicated_index_df, columns, chunk_size)
+
+def save_complete_file(main_path, store_path):
     file_path = os.path.join(main_path, 'deduplicated_data', 'complete_repositories.csv')
-    print_msg = '\nDeduplicated file saved on'
+    shutil.copyfile(store_path, file_path)
+
+    print('\nDeduplicated file saved on', file_path)
+
+    return file_path
+
+def save_filtered_file(file_path, start_date, chunk_size):
+    # rename the previously saved file with the sufix _all_dates
+    all_dates_file_path = file_path.replace('complete_repositories.csv', 'complete_repositories_all_dates.csv')
+    os.replace(file_path, all_dates_file_path)
+
+    filtered_rows = 0
 
-    if filtered:
-        # if filtered, rename the previously saved file with the sufix _all_dates
-        os.rename(file_path, file_path.replace('complete_repositories.csv', 'complete_repositories_all_dates.csv'))
-        print_msg = '\nFiltered file saved on'
+    header = True
+    with open(file_path, mode='w', newline='') as w:
+        for chunk_df in pd.read_csv(all_dates_file_path, chunksize=chunk_size):
+            # it is not necessary filter the end_date because the filter will be applyed on commits
+            chunk_df = chunk_df[chunk_df['updated_at'] >= start_date]
+            chunk_df.to_csv(w, index=False, header=header)
+            header = False
 
-    deduplicated_df.to_csv(file_path, index=False)
+            filtered_rows += len(chunk_df)
+    w.close()
 
-    print(print_msg, file_path)
+    print('\nRepositories in filtered file:', filtered_rows)
+    print('Filtered file saved on', file_path)
 
 def main():    
     parser = argparse.ArgumentParser(description='Deduplicate crawled repositories for a language')
@@ -48,6 +210,10 @@ def main():
                         help='The start date for filtering (if necessary)', required=False)
     parser.add_argument('--end_date', default=None, 
                         help='The end date for filtering (if necessary)', required=False)
+    parser.add_argument('--chunk-size', default=100000,
+                        help='Number of rows read at a time from each file', required=False)
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Merge only the files not merged in the previous runs', required=False)
     
     args = parser.parse_args()
     
@@ -57,25 +223,43 @@ def main():
 
     main_path = os.path.join(utils.get_main_path(), 'data', 'crawler', 'repositories', args.language.lower())
 
-    # Read all the files, concat repositories and deduplicate them
-    repositories_df = read_all_files(main_path)
-    deduplicated_repositories_df = deduplicate_repositories(repositories_df)
+    chunk_size = int(args.chunk_size)
+    file_paths = list_crawled_files(main_path)
+    file_states = get_file_states(file_paths)
 
-    # Print processed data
-    print('\nShape of complete dataframe:', repositories_df.shape)
-    print('Shape of deduplicated dataframe:', deduplicated_repositories_df.shape)
+    # the deduplicated store keeps all the dates, the complete file is generated from it
+    store_path = os.path.join(main_path, 'deduplicated_data', 'repositories_store.csv')
+
+    checkpoint = cp.open_checkpoint(args.language)
+
+    new_file_paths = None
+    if args.incremental and os.path.exists(store_path):
+        new_file_paths = get_new_files(file_paths, file_states, cp.get_merged_files(checkpoint))
+
+    if new_file_paths is None:
+        print('Rebuilding the deduplicated store from all the files\n')
+        rebuild_store(store_path, file_paths, chunk_size)
+        cp.save_merged_files(checkpoint, file_states, rebuilt=True)
+    elif new_file_paths:
+        print(f'Merging {len(new_file_paths)} new files in the deduplicated store\n')
+        merge_new_files(store_path, new_file_paths, chunk_size)
+        cp.save_merged_files(checkpoint, {os.path.basename(file_path): file_states[os.path.basename(file_path)]
+                                          for file_path in new_file_paths})
+    else:
+        print('No new files to merge')
+
+    checkpoint.close()
 
-    # Save the deduplicated file
-    save_deduplicated_file(main_path, deduplicated_repositories_df)
+    file_path = save_complete_file(main_path, store_path)
 
-    # Filter the dataframe if necessary
+    # Filter the file if necessary
     if args.start_date and args.end_date:
-        # it is not necessary filter the end_date because the filter will be applyed on commits
-        deduplicated_repositories_df = deduplicated_repositories_df[deduplicated_repositories_df['updated_at'] >= args.start_date]
-        print('\nShape of filtered dataframe:', deduplicated_repositories_df.shape)
+        save_filtered_file(file_path, args.start_date, chunk_size)
 
-        # Save the deduplicated file after filtering
-        save_deduplicated_file(main_path, deduplicated_repositories_df, filtered=True)
+    # Typed index of the complete file, opened by the commits crawling and the division without parsing it
+    index_path = index.get_index_path(args.language)
+    repositories = index.build_index(file_path, index_path, chunk_size)
+    print(f'\nRepository index with {repositories} repositories saved on {index_path}')
 
     # Print finish time processing
     end_time = datetime.now()
@@ -1,27 +1,33 @@
 import argparse
+import heapq
 from datetime import datetime
 
-import pandas as pd
+import numpy as np
 
-import os
 import sys
 sys.path.append('../utils')
 
 import utils as utils
+import utils_api as api
+import utils_checkpoint as cp
+import utils_http as http
+import utils_index as index
 
-def divide_repositories_file(main_path, language, rep_size, filter_list, separator=','):
-    repositories_path = os.path.join(main_path, 'repositories', language.lower(), 'deduplicated_data')
+# commits in each page of the commits crawling
+COMMITS_PER_PAGE = 100
 
-    input_file_path = os.path.join(repositories_path, 'complete_repositories.csv')
-    repositories_df = pd.read_csv(input_file_path)
+# rough rates used to estimate the commits of a repository from the search fields
+KB_PER_COMMIT = 20
+COMMITS_PER_ACTIVE_DAY = 0.5
 
-    print('Total repositories for the language:', len(repositories_df))
+def divide_repositories_file(language, rep_size, filter_list):
+    repositories_index = index.load_index(language)
+    print('Total repositories for the language:', len(repositories_index))
 
     # if filter list is not null, the crawling list needs to be filtered
-    if filter_list:
-        repositories_df = repositories_df[~repositories_df['id'].isin(filter_list)]
+    positions = repositories_index.select(exclude=filter_list)
 
-    repositories_to_be_divided = len(repositories_df)
+    repositories_to_be_divided = len(positions)
     print('Repositories to be divided:', repositories_to_be_divided, '\n')
 
     # divide into small files with 10.000 (default) repositories
@@ -34,23 +40,92 @@ def divide_repositories_file(main_path, language, rep_size, filter_list, separat
         if finish >= repositories_to_be_divided:
             finish = repositories_to_be_divided
 
-        rep_partition_df = repositories_df.iloc[start:finish]
+        part_positions = positions[start:finish]
 
-        print(f'Saving partition {part_number} from id {start} to id {finish} - size: {len(rep_partition_df)}')
+        print(f'Saving partition {part_number} from id {start} to id {finish} - size: {len(part_positions)}')
 
-        output_file_path = os.path.join(repositories_path, 'partitions', f'complete_repositories_part_{part_number}.csv')
-        rep_partition_df.to_csv(output_file_path, sep=',', index=False)
+        index.save_partition(language, part_number, repositories_index.id[part_positions])
 
         part_number += 1
 
-def read_existing_log_metadata(main_path, language, separator=','):
-    file_name = os.path.join(main_path, 'commits', language.lower(), f'crawling_commits_metadata.csv')
-    
-    filter_list = None
+def estimate_costs(repositories_index, positions):
+    # expected commit pages, each page is one request of the commits crawling
+    created_at = repositories_index.created_at[positions]
+    pushed_at = np.where(repositories_index.pushed_at[positions] >= 0, repositories_index.pushed_at[positions], created_at)
+    active_days = np.clip((pushed_at - created_at) // 86400, 0, None) + 1
+
+    # the size and the active time give two estimates of the commits, the forks hint at the number of contributors
+    size_commits = np.maximum(repositories_index.size[positions] / KB_PER_COMMIT, 1)
+    time_commits = np.maximum(active_days * COMMITS_PER_ACTIVE_DAY, 1)
+    forks_factor = 1 + np.log10(1 + repositories_index.forks_count[positions])
+
+    commits = np.sqrt(size_commits * time_commits) * forks_factor
+
+    return np.ceil(commits / COMMITS_PER_PAGE).astype(np.int64)
+
+def probe_costs(tokens, repositories_index, positions, costs, probe_size, end_date=None):
+    # with one commit per page, the last page of the Link header is the number of commits
+    probed = 0
+
+    for position in np.argsort(-costs, kind='stable')[:probe_size]:
+        query = f'{api.API_URL}/repos/{repositories_index.get_full_name(positions[position])}/commits?per_page=1'
+        if end_date:
+            query += f'&until={end_date}'
+
+        # repositories not found keep the estimated cost
+        try:
+            response = api.get_from_pool(query, tokens, 'core')
+        except api.RequestError:
+            continue
+
+        commits = api.get_last_page(response.links) if response.links else len(api.get_data(response))
+        costs[position] = max(int(np.ceil(commits / COMMITS_PER_PAGE)), 1)
+        probed += 1
+
+    print(f'Commits counted for {probed} of the {probe_size} most expensive repositories\n')
+
+    return costs
+
+def balance_partitions(costs, partitions_number):
+    # longest processing time first: the next most expensive repository goes to the partition with the lowest cost
+    loads = [(0, part_number) for part_number in range(1, partitions_number + 1)]
+    assignments = np.zeros(len(costs), dtype=np.int64)
+
+    for position in np.argsort(-costs, kind='stable'):
+        load, part_number = heapq.heappop(loads)
+        assignments[position] = part_number
+        heapq.heappush(loads, (load + costs[position], part_number))
+
+    return assignments
+
+def divide_repositories_by_cost(language, partitions_number, filter_list, tokens=None, probe_size=0, end_date=None):
+    repositories_index = index.load_index(language)
+    print('Total repositories for the language:', len(repositories_index))
+
+    # if filter list is not null, the crawling list needs to be filtered
+    positions = repositories_index.select(exclude=filter_list)
+    print('Repositories to be divided:', len(positions), '\n')
+
+    costs = estimate_costs(repositories_index, positions)
+    if tokens and probe_size:
+        costs = probe_costs(tokens, repositories_index, positions, costs, probe_size, end_date)
+
+    assignments = balance_partitions(costs, partitions_number)
+
+    # the repositories keep the order of the index inside each partition
+    for part_number in range(1, partitions_number + 1):
+        part_positions = positions[assignments == part_number]
+        part_cost = costs[assignments == part_number].sum()
+
+        print(f'Saving partition {part_number} - size: {len(part_positions)} - expected requests: {part_cost}')
+
+        index.save_partition(language, part_number, repositories_index.id[part_positions])
 
-    # open the file and get the list of repositories
-    log_file_df = pd.read_csv(file_name, sep=separator)
-    filter_list = log_file_df['id'].unique().tolist()
+def read_finished_repositories(language):
+    # repositories with all the commit pages saved in the checkpoint of the language
+    checkpoint = cp.open_checkpoint(language)
+    filter_list = list(cp.get_finished_repositories(checkpoint))
+    checkpoint.close()
 
     return filter_list
 
@@ -61,7 +136,21 @@ def main():
     parser.add_argument('--part-size', default=10000, 
                         help='Number of repositories in each new file', required=False)
     parser.add_argument('--ignore', default=True,
-                        help='Ignore files already collected due the log metadata')
+                        help='Ignore repositories already collected due the crawling checkpoint')
+    parser.add_argument('-n', '--partitions', default=None,
+                        help='Number of partitions with balanced expected commit requests (replaces --part-size)',
+                        required=False)
+    parser.add_argument('--probe', default=0,
+                        help='Number of the most expensive repositories with the commits counted in the API', required=False)
+    parser.add_argument('-t', '--token', default=None,
+                        help='The Github token identifier used by the probe (use all to share every token of the tokens file)',
+                        required=False)
+    parser.add_argument('--end_date', default=None,
+                        help='The end date of the commits counted by the probe (format: YYYY-MM-DD)', required=False)
+    parser.add_argument('--timeout', default=None,
+                        help='Seconds to wait for the response of each request (60 by default)', required=False)
+    parser.add_argument('--pool-size', default=None,
+                        help='Maximum number of connections kept open with the API (10 by default)', required=False)
     
     args = parser.parse_args()
     
@@ -69,15 +158,24 @@ def main():
     start_time = datetime.now()
     print(f'Job stated at {start_time}\n')  
 
-    main_path = os.path.join(utils.get_main_path(), 'data', 'crawler')
+    # Set the timeout and the connections of the requests of the probe
+    http.configure(read_timeout=args.timeout, pool_maxsize=args.pool_size)
 
     repositories_list = []
 
-    if args.ignore.lower() == 'true':
-        repositories_list = read_existing_log_metadata(main_path, args.language)
+    if str(args.ignore).lower() == 'true':
+        repositories_list = read_finished_repositories(args.language)
 
     # Read the main file and divide it into partitions
-    divide_repositories_file(main_path, args.language, int(args.part_size), repositories_list)
+    if args.partitions:
+        tokens = None
+        if args.token and int(args.probe):
+            tokens = utils.get_all_tokens() if args.token.lower() == 'all' else [utils.get_token_key(args.token)]
+
+        divide_repositories_by_cost(args.language, int(args.partitions), repositories_list, tokens, int(args.probe),
+                                    args.end_date)
+    else:
+        divide_repositories_file(args.language, int(args.part_size), repositories_list)
 
     # Print finish time processing
     end_time = datetime.now()
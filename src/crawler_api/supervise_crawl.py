@@ -0,0 +1,383 @@
+import csv
+import glob
+import time
+import signal
+import argparse
+import subprocess
+import collections
+from datetime import datetime
+
+import os
+import sys
+sys.path.append('../utils')
+
+import utils as utils
+import utils_checkpoint as cp
+import utils_index as index
+
+# seconds between the checks of the workers
+POLL_SECONDS = 2
+
+# seconds to wait before a crashed worker is started again, multiplied by its restarts
+RESTART_DELAY = 10
+
+class Worker:
+    # a collect_commits process of one language and partition, started again from the checkpoint when it fails
+    def __init__(self, language, partition, log_path):
+        self.language = language
+        self.partition = partition
+        self.log_path = log_path
+
+        self.process = None
+        self.log = None
+        self.token_keys = None
+        self.restarts = 0
+        self.exit_code = None
+        self.started_at = None
+        self.finished_at = None
+        self.next_start = 0
+        self.number = 0
+        self.log_size = None
+        self.last_output = None
+
+    def get_name(self):
+        return f'{self.language} part {self.partition}' if self.partition else self.language
+
+    def start(self, command, token_keys):
+        self.token_keys = token_keys
+        self.log = open(self.log_path, mode='a')
+        self.log.write(f'\n>>> {datetime.now()} - started with tokens {",".join(token_keys)} '
+                       f'(restart {self.restarts})\n')
+        self.log.flush()
+
+        self.process = subprocess.Popen([sys.executable, 'collect_commits.py'] + command, stdout=self.log,
+                                        stderr=subprocess.STDOUT, env=dict(os.environ, PYTHONUNBUFFERED='1'))
+        self.started_at = self.started_at if self.started_at else datetime.now()
+        self.last_output = time.time()
+
+    def poll(self):
+        exit_code = self.process.poll()
+
+        # the output shows that the worker is alive, the sleeps of the rate limit are printed before they start
+        size = os.path.getsize(self.log_path)
+        if size != self.log_size:
+            self.log_size = size
+            self.last_output = time.time()
+
+        return exit_code
+
+    def stop(self, timeout=30):
+        if self.process is None or self.process.poll() is not None:
+            return
+
+        # the crawler is interrupted as with ctrl+c, it saves the buffered pages and closes the checkpoint before exiting
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+def get_token_groups(token_keys, workers_number):
+    # the running workers do not share tokens while there are enough of them
+    if len(token_keys) >= workers_number:
+        return [token_keys[position::workers_number] for position in range(workers_number)]
+
+    return [[token_keys[position % len(token_keys)]] for position in range(workers_number)]
+
+def get_logs_path(language):
+    logs_path = os.path.join(utils.get_main_path(), 'data', 'crawler', 'commits', language.lower(), 'logs')
+    os.makedirs(logs_path, exist_ok=True)
+
+    return logs_path
+
+def divide_language(language, partitions_number, args):
+    # balanced partitions of the repositories not finished in the checkpoint
+    command = [sys.executable, 'divide_repositories.py', '-l', language, '-n', str(partitions_number)]
+    if args.probe and int(args.probe):
+        command += ['--probe', str(args.probe), '-t', 'all', '--end_date', args.end_date] + get_http_options(args)
+
+    print(f'Dividing the repositories of {language} in {partitions_number} partitions')
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+def get_http_options(args):
+    # the workers and the division use the same timeout and connections
+    options = []
+    if args.timeout:
+        options += ['--timeout', str(args.timeout)]
+    if args.pool_size:
+        options += ['--pool-size', str(args.pool_size)]
+
+    return options
+
+def create_workers(languages, partitions_number):
+    workers = []
+
+    for language in languages:
+        logs_path = get_logs_path(language)
+        partitions = range(1, partitions_number + 1) if partitions_number else [None]
+
+        for partition in partitions:
+            log_name = f'worker_part_{partition}.log' if partition else 'worker.log'
+            workers.append(Worker(language, partition, os.path.join(logs_path, log_name)))
+            workers[-1].number = len(workers) - 1
+
+    return workers
+
+def get_command(args, worker, token_keys, resume):
+    command = ['-t', ','.join(token_keys), '-l', worker.language, '--end_date', args.end_date,
+               '--cont', 'true' if resume else 'false', '--incremental', args.incremental, '-o', args.output,
+               '-c', str(args.concurrency), '-b', args.backend]
+
+    if worker.partition:
+        command += ['-p', str(worker.partition)]
+    if args.fields:
+        command += ['-f', args.fields]
+    command += get_http_options(args)
+    if args.metrics_port:
+        command += ['--metrics-port', str(int(args.metrics_port) + worker.number)]
+    if args.metrics.lower() == 'true':
+        command += ['--metrics', 'true']
+
+    return command
+
+def supervise(args, workers, token_groups, max_restarts, stall_seconds):
+    waiting = collections.deque(workers)
+    free_groups = collections.deque(token_groups)
+    running = []
+
+    stopping = {'signal': None}
+
+    def request_stop(signal_number, frame):
+        stopping['signal'] = signal_number
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    resume = str(args.cont).lower() == 'true'
+
+    while (waiting or running) and not stopping['signal']:
+        # start the waiting workers while there are free token groups
+        for _ in range(len(waiting)):
+            if not free_groups:
+                break
+
+            worker = waiting.popleft()
+            if worker.next_start > time.time():
+                waiting.append(worker)
+                continue
+
+            token_keys = free_groups.popleft()
+            print(f'{datetime.now()} - starting {worker.get_name()} with tokens {",".join(token_keys)}')
+            worker.start(get_command(args, worker, token_keys, resume or worker.restarts > 0), token_keys)
+            running.append(worker)
+
+        time.sleep(POLL_SECONDS)
+
+        for worker in list(running):
+            exit_code = worker.poll()
+
+            if exit_code is None and stall_seconds and time.time() - worker.last_output > stall_seconds:
+                print(f'{datetime.now()} - {worker.get_name()} without output for {stall_seconds} seconds, stopping it')
+                worker.stop()
+                exit_code = worker.process.returncode if worker.process.returncode else -1
+
+            if exit_code is None:
+                continue
+
+            running.remove(worker)
+            free_groups.append(worker.token_keys)
+            worker.close()
+
+            if exit_code == 0:
+                worker.exit_code = 0
+                worker.finished_at = datetime.now()
+                print(f'{datetime.now()} - {worker.get_name()} finished')
+            elif worker.restarts < max_restarts:
+                # the restarted worker continues from the pages saved in the checkpoint
+                worker.restarts += 1
+                worker.next_start = time.time() + RESTART_DELAY * worker.restarts
+                waiting.append(worker)
+                print(f'{datetime.now()} - {worker.get_name()} failed with code {exit_code}, '
+                      f'restart {worker.restarts} of {max_restarts} (see {worker.log_path})')
+            else:
+                worker.exit_code = exit_code
+                worker.finished_at = datetime.now()
+                print(f'{datetime.now()} - {worker.get_name()} failed with code {exit_code}, no restarts left')
+
+    if stopping['signal']:
+        print(f'\n{datetime.now()} - stopping the workers, they continue from the checkpoint with --cont True\n')
+        for worker in running:
+            worker.stop()
+            worker.close()
+
+def merge_not_found(language, separator=','):
+    main_path = os.path.join(utils.get_main_path(), 'data', 'crawler', 'commits', language.lower())
+    merged_path = os.path.join(main_path, 'crawling_commits_repositories_not_found.csv')
+
+    # the files of the partitions are kept, so merging again gives the same file
+    file_paths = sorted(glob.glob(os.path.join(main_path, 'crawling_commits_repositories_not_found_part_*.csv')))
+    if os.path.exists(merged_path):
+        file_paths = [merged_path] + file_paths
+
+    rows = {}
+    for file_path in file_paths:
+        with open(file_path, mode='r', newline='') as r:
+            for row in csv.reader(r, delimiter=separator):
+                if len(row) == 2 and (row[1] not in rows or row[0] < rows[row[1]]):
+                    rows[row[1]] = row[0]
+        r.close()
+
+    with open(merged_path + '.tmp', mode='w', newline='') as w:
+        csv_file = csv.writer(w, delimiter=separator)
+        for query, date in sorted(rows.items(), key=lambda row: row[1]):
+            csv_file.writerow([date, query])
+    w.close()
+    os.replace(merged_path + '.tmp', merged_path)
+
+    return merged_path, len(rows)
+
+def merge_logs(language, workers, start_time):
+    merged_path = os.path.join(get_logs_path(language), f"supervisor_{start_time.strftime('%Y%m%d%H%M%S')}.log")
+
+    with open(merged_path, mode='w') as w:
+        for worker in workers:
+            if worker.language != language or not os.path.exists(worker.log_path):
+                continue
+
+            w.write(f'=== {worker.get_name()} ===\n')
+            with open(worker.log_path, mode='r') as r:
+                for line in r:
+                    w.write(line)
+            r.close()
+            w.write('\n')
+    w.close()
+
+    return merged_path
+
+def print_report(workers, languages, end_date):
+    print(f"\n{'worker':<32}{'status':>10}{'restarts':>10}{'exit':>6}  duration")
+
+    for worker in workers:
+        if worker.exit_code == 0:
+            status = 'done'
+        elif worker.exit_code is not None:
+            status = 'failed'
+        else:
+            status = 'stopped'
+
+        duration = worker.finished_at - worker.started_at if worker.finished_at and worker.started_at else '-'
+        exit_code = worker.exit_code if worker.exit_code is not None else '-'
+        print(f'{worker.get_name():<32}{status:>10}{worker.restarts:>10}{exit_code:>6}  {duration}')
+
+    # progress of each language in the shared checkpoint
+    for language in languages:
+        checkpoint = cp.open_checkpoint(language)
+        finished = len(cp.get_finished_repositories(checkpoint, end_date))
+        dead_letters = len(cp.get_dead_letters(checkpoint))
+        checkpoint.close()
+
+        print(f'\n{language}: {finished} repositories finished - {dead_letters} requests in the dead letters')
+
+def main():
+    parser = argparse.ArgumentParser(description='Crawl the commits of many partitions and languages with one command')
+    parser.add_argument('-l', '--languages',
+                        help='Comma separated programming languages to be collected (hint: replace spaces by +)',
+                        required=True)
+    parser.add_argument('--end_date', default='2020-11-30',
+                        help='The end date for crawling (format: YYYY-MM-DD)', required=True)
+    parser.add_argument('-t', '--tokens', default='all',
+                        help='Comma separated token identifiers shared by the workers (all uses every token)',
+                        required=False)
+    parser.add_argument('-n', '--partitions', default=None,
+                        help='Number of partitions of each language (without it, one worker by language)',
+                        required=False)
+    parser.add_argument('--divide', default='false',
+                        help='Use this param with True value to divide the repositories before the crawling',
+                        required=False)
+    parser.add_argument('--probe', default=0,
+                        help='Number of the most expensive repositories with the commits counted by the division',
+                        required=False)
+    parser.add_argument('-w', '--workers', default=None,
+                        help='Maximum number of workers running at the same time (the number of cores by default)',
+                        required=False)
+    parser.add_argument('--max-restarts', default=5,
+                        help='Number of times a failed worker is started again', required=False)
+    parser.add_argument('--stall-minutes', default=90,
+                        help='Minutes without output before a worker is considered stalled and restarted (0 disables)',
+                        required=False)
+    parser.add_argument('--cont', default='false',
+                        help='Use this param with True value to continue a started crawling', required=False)
+    parser.add_argument('--incremental', default='false',
+                        help='Use this param with True value to crawl only the commits after the last crawling',
+                        required=False)
+    parser.add_argument('-o', '--output', default='csv', choices=['csv', 'parquet'],
+                        help='Save one csv file per page or parquet shards with the flattened commits', required=False)
+    parser.add_argument('-f', '--fields', default=None,
+                        help='Comma separated fields of the commits to be saved, or a json file with the fields',
+                        required=False)
+    parser.add_argument('-c', '--concurrency', default=1,
+                        help='Maximum number of requests in flight of each worker', required=False)
+    parser.add_argument('-b', '--backend', default='rest', choices=['rest', 'graphql'],
+                        help='Request the commits from the REST endpoint or the GraphQL API', required=False)
+    parser.add_argument('--timeout', default=None,
+                        help='Seconds to wait for the response of each request (60 by default)', required=False)
+    parser.add_argument('--pool-size', default=None,
+                        help='Maximum number of connections kept open with the API by each worker (10 by default)', required=False)
+    parser.add_argument('--metrics', default='false',
+                        help='Use this param with True value to save a metrics summary of each worker', required=False)
+    parser.add_argument('--metrics-port', default=None,
+                        help='First port of the Prometheus endpoints, one port for each worker', required=False)
+
+    args = parser.parse_args()
+
+    # Print start time processing
+    start_time = datetime.now()
+    print(f'Supervisor stated at {start_time}\n')
+
+    languages = [language.strip() for language in args.languages.split(',') if language.strip()]
+    partitions_number = int(args.partitions) if args.partitions else 0
+
+    token_keys = utils.get_all_token_keys() if args.tokens.lower() == 'all' else args.tokens.split(',')
+
+    if partitions_number and args.divide.lower() == 'true':
+        for language in languages:
+            divide_language(language, partitions_number, args)
+
+    # the workers open the same repository index, built here when it is missing or outdated
+    for language in languages:
+        index.load_index(language)
+
+    workers = create_workers(languages, partitions_number)
+
+    workers_number = min(len(workers), int(args.workers) if args.workers else os.cpu_count())
+    token_groups = get_token_groups(token_keys, workers_number)
+
+    print(f'{len(workers)} workers, {workers_number} at a time, sharing {len(token_keys)} tokens\n')
+
+    supervise(args, workers, token_groups, int(args.max_restarts), int(args.stall_minutes) * 60)
+
+    print_report(workers, languages, args.end_date)
+
+    # Merge the files written by each worker
+    for language in languages:
+        merged_path, not_found = merge_not_found(language)
+        print(f'{not_found} repositories not found merged on {merged_path}')
+        print('Logs merged on', merge_logs(language, workers, start_time))
+
+    # Print finish time processing
+    end_time = datetime.now()
+    print(f'\nSupervisor finished at {end_time}\n')
+
+    print('>> Supervisor finished in', end_time - start_time, '<<')
+
+    if any(worker.exit_code != 0 for worker in workers):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import sys
+sys.path.append('../utils')
+
+import utils_commits as commits
+import utils_network as network
+
+# partial edges kept before they are combined
+MAX_PARTIAL_EDGES = 5000000
+
+def aggregate_edges(edges_df):
+    return edges_df.groupby(['developer', 'repository'], sort=False).agg(
+        commits=('commits', 'sum'), first_commit=('first_commit', 'min'), last_commit=('last_commit', 'max')).reset_index()
+
+def build_bipartite(file_paths, chunk_size, identity_map=None):
+    developers = commits.Interner()
+    repositories = commits.Interner()
+    developers_info = []
+    repository_names = {}
+
+    partial_edges = []
+    partial_rows = 0
+    total_commits = 0
+
+    for chunk_df in commits.iter_commit_chunks(file_paths, chunk_size):
+        chunk_df, keys = commits.get_valid_commits(chunk_df, identity_map)
+
+        if chunk_df.empty:
+            continue
+
+        known_developers = len(developers)
+        developer_ids = developers.intern(keys)
+        repository_ids = repositories.intern(chunk_df['repository_id'].values.astype(np.int64))
+
+        # login, name and email of the first commit of each new developer
+        new_developers, positions = np.unique(developer_ids[developer_ids >= known_developers], return_index=True)
+        if len(new_developers):
+            first_rows = chunk_df[developer_ids >= known_developers].iloc[positions]
+            developers_info.append(pd.DataFrame({'developer': new_developers,
+                                                 'identity': keys[developer_ids >= known_developers][positions],
+                                                 'login': first_rows['author_login'].values,
+                                                 'name': first_rows['author_name'].values,
+                                                 'email': first_rows['author_email'].values}))
+
+        unique_repositories, positions = np.unique(repository_ids, return_index=True)
+        for repository_id, full_name in zip(unique_repositories, chunk_df['repository_full_name'].values[positions]):
+            if isinstance(full_name, str) and repository_id not in repository_names:
+                repository_names[repository_id] = full_name
+
+        partial_edges.append(aggregate_edges(pd.DataFrame({'developer': developer_ids,
+                                                           'repository': repository_ids,
+                                                           'commits': np.ones(len(developer_ids), dtype=np.int64),
+                                                           'first_commit': chunk_df['author_date'].values,
+                                                           'last_commit': chunk_df['author_date'].values})))
+        partial_rows += len(partial_edges[-1])
+        total_commits += len(chunk_df)
+
+        # the edges of the chunks are combined before they use too much memory
+        if partial_rows > MAX_PARTIAL_EDGES:
+            partial_edges = [aggregate_edges(pd.concat(partial_edges, ignore_index=True))]
+            partial_rows = len(partial_edges[0])
+
+        print(f'Commits read: {total_commits} - developers: {len(developers)} - repositories: {len(repositories)}')
+
+    columns = ['developer', 'repository', 'commits', 'first_commit', 'last_commit']
+    edges_df = aggregate_edges(pd.concat(partial_edges, ignore_index=True)) if partial_edges else pd.DataFrame(columns=columns)
+
+    developers_df = pd.concat(developers_info, ignore_index=True) if developers_info else \
+        pd.DataFrame(columns=['developer', 'identity', 'login', 'name', 'email'])
+    repositories_df = pd.DataFrame({'repository': np.arange(len(repositories)),
+                                    'repository_id': repositories.keys,
+                                    'full_name': [repository_names.get(number) for number in range(len(repositories))]})
+
+    return edges_df, developers_df, repositories_df
+
+def save_bipartite(language, edges_df, developers_df, repositories_df):
+    shape = (len(developers_df), len(repositories_df))
+
+    indptr, indices, edge_values = network.to_csr(
+        edges_df['developer'].values.astype(np.int64), edges_df['repository'].values.astype(np.int64), shape,
+        {'commits': edges_df['commits'].values.astype(np.int64),
+         'first_commit': edges_df['first_commit'].values.astype(np.int64),
+         'last_commit': edges_df['last_commit'].values.astype(np.int64)})
+
+    network.save_bipartite(language, indptr, indices, shape, edge_values, developers_df, repositories_df)
+
+    print('\nBipartite network saved on', network.get_bipartite_path(language))
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the developer x repository network from the crawled commits')
+    parser.add_argument('-l', '--language',
+                        help='The programming language of the crawled commits (hint: replace spaces by +)', required=True)
+    parser.add_argument('-i', '--identities', action='store_true',
+                        help='Merge the identities of the same person with the table of resolve_identities.py',
+                        required=False)
+    parser.add_argument('--chunk-size', default=1000000,
+                        help='Number of commits read at a time from the parquet shards', required=False)
+
+    args = parser.parse_args()
+
+    # Print start time processing
+    start_time = datetime.now()
+    print(f'Job stated at {start_time}\n')
+
+    # Stream the commit files and count the commits of each developer in each repository
+    file_paths = commits.list_commit_files(args.language)
+    identity_map = commits.load_identity_map(args.language) if args.identities else None
+    edges_df, developers_df, repositories_df = build_bipartite(file_paths, int(args.chunk_size), identity_map)
+
+    # Print processed data
+    print('\nDevelopers:', len(developers_df))
+    print('Repositories:', len(repositories_df))
+    print('Edges:', len(edges_df))
+
+    save_bipartite(args.language, edges_df, developers_df, repositories_df)
+
+    # Print finish time processing
+    end_time = datetime.now()
+    print(f'\nJob finished at {end_time}\n')
+
+    print('>> Job finished in', end_time - start_time, '<<')
+
+if __name__ == '__main__':
+    main()
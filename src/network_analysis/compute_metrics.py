@@ -0,0 +1,253 @@
+import json
+import time
+import argparse
+import concurrent.futures
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+import os
+import sys
+sys.path.append('../utils')
+
+import utils_commits as commits
+import utils_network as network
+
+METRICS = ['degree', 'weighted_degree', 'clustering', 'components', 'pagerank', 'betweenness']
+
+# adjacency matrix loaded once in each process
+_graph = {}
+
+def init_worker(language, mode):
+    _graph['binary'] = get_binary(network.load_projection(language, mode))
+
+def get_binary(matrix):
+    return sparse.csr_matrix((np.ones(matrix.nnz), matrix.indices, matrix.indptr), shape=matrix.shape)
+
+def run_blocks(function, blocks, language, mode, binary, workers):
+    if workers <= 1:
+        _graph['binary'] = binary
+        return [function(*block) for block in blocks]
+
+    # each process loads the network once and computes a part of the blocks
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                initargs=(language, mode)) as executor:
+        return list(executor.map(function, *zip(*blocks)))
+
+def get_degrees(matrix):
+    return np.diff(matrix.indptr)
+
+def get_weighted_degrees(matrix):
+    return np.asarray(matrix.sum(axis=1)).ravel()
+
+def count_triangles(start, end):
+    # the common neighbors of the linked nodes close the triangles of each row
+    binary = _graph['binary']
+    block = binary[start:end]
+
+    return np.asarray(block.dot(binary).multiply(block).sum(axis=1)).ravel() / 2
+
+def get_clustering(language, mode, matrix, block_entries, workers):
+    binary = get_binary(matrix)
+    degrees = get_degrees(binary)
+
+    # paths of length two from each row bound the entries of the product
+    blocks = network.get_row_blocks(binary.dot(degrees.astype(np.float64)), block_entries)
+
+    triangles = run_blocks(count_triangles, blocks, language, mode, binary, workers)
+    triangles = np.concatenate(triangles) if triangles else np.zeros(0)
+
+    possible = degrees * (degrees - 1) / 2
+
+    return np.divide(triangles, possible, out=np.zeros(len(degrees)), where=possible > 0)
+
+def get_components(matrix):
+    coo = sparse.triu(matrix, k=1).tocoo()
+
+    union_find = network.UnionFind(matrix.shape[0])
+    union_find.union(coo.row, coo.col)
+
+    labels, sizes = union_find.components()
+
+    # the components are numbered from the largest
+    ranks = np.empty(len(sizes), dtype=np.int64)
+    ranks[np.argsort(-sizes, kind='stable')] = np.arange(len(sizes))
+
+    return ranks[labels], sizes[labels]
+
+def get_pagerank(matrix, damping=0.85, tolerance=1e-10, max_iterations=100):
+    nodes = matrix.shape[0]
+    strength = get_weighted_degrees(matrix)
+
+    # column stochastic transition by the weights, the nodes without edges spread their rank to all nodes
+    inverse_strength = np.divide(1, strength, out=np.zeros(nodes), where=strength > 0)
+    transition = matrix.T.dot(sparse.diags(inverse_strength)).tocsr()
+    dangling = strength == 0
+
+    rank = np.full(nodes, 1 / nodes) if nodes else np.zeros(0)
+
+    for iteration in range(max_iterations):
+        new_rank = damping * (transition.dot(rank) + rank[dangling].sum() / nodes) + (1 - damping) / nodes
+
+        error = np.abs(new_rank - rank).sum()
+        rank = new_rank
+
+        if error < nodes * tolerance:
+            break
+
+    print(f'PageRank converged in {iteration + 1} iterations')
+
+    return rank
+
+def accumulate_betweenness(sources):
+    # Brandes accumulation from each source, with the levels of the breadth-first search as sparse slices
+    matrix = _graph['binary']
+    nodes = matrix.shape[0]
+    betweenness = np.zeros(nodes)
+
+    for source in sources:
+        distance = np.full(nodes, -1, dtype=np.int64)
+        sigma = np.zeros(nodes)
+        distance[source] = 0
+        sigma[source] = 1
+
+        levels = [np.array([source])]
+        while True:
+            frontier = levels[-1]
+            reached = matrix[frontier].tocoo()
+
+            # paths to the new nodes come from every node of the frontier linked to them
+            new = distance[reached.col] == -1
+            next_level = np.unique(reached.col[new])
+            if not len(next_level):
+                break
+
+            distance[next_level] = len(levels)
+            np.add.at(sigma, reached.col[new], sigma[frontier[reached.row[new]]])
+            levels.append(next_level)
+
+        delta = np.zeros(nodes)
+        for depth in range(len(levels) - 2, -1, -1):
+            level = levels[depth]
+            successors = levels[depth + 1]
+
+            coefficient = np.zeros(nodes)
+            coefficient[successors] = (1 + delta[successors]) / sigma[successors]
+
+            delta[level] = sigma[level] * matrix[level].dot(coefficient)
+
+        delta[source] = 0
+        betweenness += delta
+
+    return betweenness
+
+def get_betweenness(language, mode, matrix, samples, seed, workers):
+    nodes = matrix.shape[0]
+    samples = min(samples, nodes)
+
+    # the same seed samples the same sources
+    sources = np.random.default_rng(seed).choice(nodes, size=samples, replace=False)
+    chunks = [(chunk,) for chunk in np.array_split(sources, max(workers, 1)) if len(chunk)]
+
+    betweenness = sum(run_blocks(accumulate_betweenness, chunks, language, mode, get_binary(matrix), workers),
+                      np.zeros(nodes))
+
+    # each pair is counted from both ends, and the sample is scaled to all the sources
+    return betweenness / 2 * (nodes / samples) if samples else betweenness
+
+def compute_metrics(language, mode, metrics, block_entries, samples, seed, workers):
+    matrix = network.load_projection(language, mode)
+    print(f'Network with {matrix.shape[0]} nodes and {matrix.nnz // 2} edges\n')
+
+    metrics_df = pd.DataFrame({'node': np.arange(matrix.shape[0])})
+    timing = {}
+
+    for metric in metrics:
+        start = time.perf_counter()
+
+        if metric == 'degree':
+            metrics_df['degree'] = get_degrees(matrix)
+        elif metric == 'weighted_degree':
+            metrics_df['weighted_degree'] = get_weighted_degrees(matrix)
+        elif metric == 'clustering':
+            metrics_df['clustering'] = get_clustering(language, mode, matrix, block_entries, workers)
+        elif metric == 'components':
+            metrics_df['component'], metrics_df['component_size'] = get_components(matrix)
+        elif metric == 'pagerank':
+            metrics_df['pagerank'] = get_pagerank(matrix)
+        elif metric == 'betweenness':
+            metrics_df['betweenness'] = get_betweenness(language, mode, matrix, samples, seed, workers)
+
+        timing[metric] = time.perf_counter() - start
+        print(f'{metric} computed in {timing[metric]:.2f} seconds')
+
+    return metrics_df, timing
+
+def save_metrics(language, mode, metrics_df, timing, params):
+    processed_path = commits.get_processed_path(language)
+
+    # the names of the nodes beside the metrics
+    if mode == 'developers':
+        nodes_df = network.load_developers(language)[['developer', 'identity', 'login']]
+    else:
+        nodes_df = network.load_repositories(language)[['repository', 'repository_id', 'full_name']]
+    metrics_df = nodes_df.rename(columns={nodes_df.columns[0]: 'node'}).merge(metrics_df, on='node', how='right')
+
+    metrics_path = os.path.join(processed_path, f'{mode}_metrics.parquet')
+    metrics_df.to_parquet(metrics_path, index=False)
+
+    timing_path = os.path.join(processed_path, f'{mode}_metrics_timing.json')
+    with open(timing_path, mode='w') as w:
+        json.dump({'params': params, 'seconds': timing, 'date': str(datetime.now())}, w, indent=2)
+    w.close()
+
+    print('\nMetrics saved on', metrics_path)
+    print('Timing saved on', timing_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute the metrics of the nodes of a projected network')
+    parser.add_argument('-l', '--language',
+                        help='The programming language of the crawled commits (hint: replace spaces by +)', required=True)
+    parser.add_argument('-m', '--mode', default='developers', choices=['developers', 'repositories'],
+                        help='The projected network of developers or of repositories', required=False)
+    parser.add_argument('--metrics', default=','.join(METRICS),
+                        help=f'Comma separated metrics to be computed ({", ".join(METRICS)})', required=False)
+    parser.add_argument('--samples', default=1000,
+                        help='Number of sources sampled to estimate the betweenness', required=False)
+    parser.add_argument('--seed', default=42,
+                        help='Seed of the sampled sources', required=False)
+    parser.add_argument('--block-entries', default=20000000,
+                        help='Maximum number of entries of the product computed at a time for the clustering',
+                        required=False)
+    parser.add_argument('-j', '--workers', default=1,
+                        help='Number of processes computing the clustering and the betweenness', required=False)
+
+    args = parser.parse_args()
+
+    # Print start time processing
+    start_time = datetime.now()
+    print(f'Job stated at {start_time}\n')
+
+    metrics = [metric.strip() for metric in args.metrics.split(',') if metric.strip()]
+    unknown = [metric for metric in metrics if metric not in METRICS]
+    if unknown:
+        print('Unknown metrics:', ', '.join(unknown))
+        sys.exit(-1)
+
+    metrics_df, timing = compute_metrics(args.language, args.mode, metrics, int(args.block_entries), int(args.samples),
+                                         int(args.seed), int(args.workers))
+
+    params = {'mode': args.mode, 'metrics': metrics, 'samples': int(args.samples), 'seed': int(args.seed),
+              'workers': int(args.workers)}
+    save_metrics(args.language, args.mode, metrics_df, timing, params)
+
+    # Print finish time processing
+    end_time = datetime.now()
+    print(f'\nJob finished at {end_time}\n')
+
+    print('>> Job finished in', end_time - start_time, '<<')
+
+if __name__ == '__main__':
+    main()
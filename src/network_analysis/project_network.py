@@ -0,0 +1,229 @@
+import argparse
+import collections
+import concurrent.futures
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import scipy.sparse as sparse
+
+import os
+import sys
+sys.path.append('../utils')
+
+import utils_network as network
+
+EDGES_SCHEMA = pa.schema([pa.field('source', pa.int64()), pa.field('target', pa.int64()), pa.field('weight', pa.float64())])
+
+# blocks submitted to each process before the results of the first ones are saved
+BLOCKS_IN_FLIGHT = 2
+
+# factors of the product loaded once in each process
+_factors = {}
+
+def get_factors(language, mode, weighting):
+    matrix, _ = network.load_bipartite(language)
+
+    # the projection counts the shared neighbors, not the commits
+    matrix = sparse.csr_matrix((np.ones(matrix.nnz), matrix.indices, matrix.indptr), shape=matrix.shape)
+    if mode == 'repositories':
+        matrix = matrix.T.tocsr()
+
+    shared = matrix.T.tocsr()
+
+    # Newman's weighting: each shared neighbor with n nodes adds 1 / (n - 1) to every pair
+    if weighting == 'newman':
+        sizes = np.asarray(matrix.sum(axis=0)).ravel()
+        scale = np.divide(1, sizes - 1, out=np.zeros(len(sizes)), where=sizes > 1)
+        shared = sparse.diags(scale).dot(shared).tocsr()
+
+    return matrix, shared
+
+def init_worker(language, mode, weighting):
+    _factors['nodes'], _factors['shared'] = get_factors(language, mode, weighting)
+
+def project_block(start, end, min_weight, top_k):
+    # the rows of the block against all the nodes, without building the whole projection
+    block = _factors['nodes'][start:end].dot(_factors['shared']).tocoo()
+
+    sources = block.row.astype(np.int64) + start
+    targets = block.col.astype(np.int64)
+    weights = block.data
+
+    keep = (sources != targets) & (weights >= min_weight)
+    sources, targets, weights = sources[keep], targets[keep], weights[keep]
+
+    if top_k:
+        return get_top_k(sources, targets, weights, top_k)
+
+    # each pair appears in both rows, the one with the smaller source is kept
+    keep = targets > sources
+
+    return sources[keep], targets[keep], weights[keep]
+
+def get_top_k(sources, targets, weights, top_k):
+    # rank of each edge inside its row, from the largest weight
+    order = np.lexsort((-weights, sources))
+    sources, targets, weights = sources[order], targets[order], weights[order]
+
+    row_starts = np.flatnonzero(np.r_[True, sources[1:] != sources[:-1]])
+    row_sizes = np.diff(np.r_[row_starts, len(sources)])
+    ranks = np.arange(len(sources)) - np.repeat(row_starts, row_sizes)
+
+    keep = ranks < top_k
+
+    return sources[keep], targets[keep], weights[keep]
+
+def get_blocks(nodes, shared, block_entries):
+    # paths of length two from each row, the most entries of the row in the product
+    paths = nodes.dot(np.diff(shared.indptr).astype(np.float64))
+
+    return network.get_row_blocks(paths, block_entries)
+
+def iter_blocks(language, mode, weighting, blocks, min_weight, top_k, workers):
+    if workers <= 1:
+        init_worker(language, mode, weighting)
+        for start, end in blocks:
+            yield project_block(start, end, min_weight, top_k)
+        return
+
+    # each process loads the bipartite network and computes blocks of rows
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                initargs=(language, mode, weighting)) as executor:
+        # a bounded window of blocks in flight, so the finished blocks waiting to be saved do not fill the memory
+        futures = collections.deque()
+        for start, end in blocks:
+            if len(futures) >= workers * BLOCKS_IN_FLIGHT:
+                yield futures.popleft().result()
+            futures.append(executor.submit(project_block, start, end, min_weight, top_k))
+
+        while futures:
+            yield futures.popleft().result()
+
+def save_projection(language, mode, weighting, block_entries, min_weight, top_k, workers):
+    blocks = get_blocks(*get_factors(language, mode, 'count'), block_entries)
+
+    projection_path = network.get_projection_path(language, mode)
+    writer = pq.ParquetWriter(projection_path + '.tmp', EDGES_SCHEMA, compression='zstd')
+
+    pruned_edges = []
+    total_edges = 0
+
+    for number, (sources, targets, weights) in enumerate(
+            iter_blocks(language, mode, weighting, blocks, min_weight, top_k, workers)):
+        print(f'Block {number + 1} of {len(blocks)} - edges: {len(sources)}')
+
+        if top_k:
+            # a pair kept by any of its nodes is one undirected edge
+            pruned_edges.append(pd.DataFrame({'source': np.minimum(sources, targets),
+                                              'target': np.maximum(sources, targets),
+                                              'weight': weights}))
+            continue
+
+        writer.write_table(pa.Table.from_arrays([pa.array(sources), pa.array(targets), pa.array(weights)],
+                                                schema=EDGES_SCHEMA))
+        total_edges += len(sources)
+
+    if top_k and pruned_edges:
+        edges_df = pd.concat(pruned_edges, ignore_index=True).drop_duplicates(subset=['source', 'target'])
+        edges_df = edges_df.sort_values(['source', 'target'])
+
+        writer.write_table(pa.Table.from_pandas(edges_df, schema=EDGES_SCHEMA, preserve_index=False))
+        total_edges = len(edges_df)
+
+    writer.close()
+    os.replace(projection_path + '.tmp', projection_path)
+
+    print(f'\nEdges: {total_edges}')
+    print('Projection saved on', projection_path)
+
+    return projection_path
+
+def export_networkx(language, mode, projection_path, max_nodes):
+    # networkx is used only to export small subsets of the projection
+    try:
+        import networkx as nx
+    except ImportError:
+        print('networkx is not installed, the graphml export was skipped')
+        return
+
+    parquet_file = pq.ParquetFile(projection_path)
+
+    # nodes with the largest weighted degree
+    strength = get_weighted_degrees(parquet_file)
+    selected = set(strength.nlargest(max_nodes).index)
+
+    graph = nx.Graph()
+    nodes_df = network.load_developers(language) if mode == 'developers' else network.load_repositories(language)
+    key = 'developer' if mode == 'developers' else 'repository'
+    for row in nodes_df[nodes_df[key].isin(selected)].to_dict('records'):
+        graph.add_node(int(row[key]), **{name: str(value) for name, value in row.items() if name != key})
+
+    for row_group in range(parquet_file.num_row_groups):
+        edges_df = parquet_file.read_row_group(row_group).to_pandas()
+        edges_df = edges_df[edges_df['source'].isin(selected) & edges_df['target'].isin(selected)]
+        graph.add_weighted_edges_from(edges_df.itertuples(index=False, name=None))
+
+    graphml_path = network.get_projection_path(language, mode, 'graphml')
+    nx.write_graphml(graph, graphml_path)
+
+    print(f'Subset with {graph.number_of_nodes()} nodes and {graph.number_of_edges()} edges saved on {graphml_path}')
+
+def get_weighted_degrees(parquet_file):
+    strength = None
+
+    for row_group in range(parquet_file.num_row_groups):
+        edges_df = parquet_file.read_row_group(row_group).to_pandas()
+        group_strength = pd.concat([edges_df.groupby('source')['weight'].sum(),
+                                    edges_df.groupby('target')['weight'].sum()])
+        group_strength = group_strength.groupby(level=0).sum()
+
+        strength = group_strength if strength is None else strength.add(group_strength, fill_value=0)
+
+    return strength if strength is not None else pd.Series(dtype=np.float64)
+
+def main():
+    parser = argparse.ArgumentParser(description='Project the developer x repository network into one of its modes')
+    parser.add_argument('-l', '--language',
+                        help='The programming language of the crawled commits (hint: replace spaces by +)', required=True)
+    parser.add_argument('-m', '--mode', default='developers', choices=['developers', 'repositories'],
+                        help='Developers linked by shared repositories or repositories linked by shared developers',
+                        required=False)
+    parser.add_argument('-w', '--weighting', default='count', choices=['count', 'newman'],
+                        help='Number of shared neighbors or the collaboration weighting of Newman', required=False)
+    parser.add_argument('--min-weight', default=0,
+                        help='Minimum weight of the edges kept', required=False)
+    parser.add_argument('-k', '--top-k', default=None,
+                        help='Maximum number of edges kept for each node, from the largest weight', required=False)
+    parser.add_argument('--block-entries', default=20000000,
+                        help='Maximum number of entries of the product computed at a time by each process', required=False)
+    parser.add_argument('-j', '--workers', default=1,
+                        help='Number of processes computing blocks of rows', required=False)
+    parser.add_argument('--networkx', default=None,
+                        help='Export the nodes with the largest weighted degree (this number of nodes) as graphml',
+                        required=False)
+
+    args = parser.parse_args()
+
+    # Print start time processing
+    start_time = datetime.now()
+    print(f'Job stated at {start_time}\n')
+
+    # Multiply the bipartite network by its transpose in blocks of rows
+    projection_path = save_projection(args.language, args.mode, args.weighting, int(args.block_entries),
+                                      float(args.min_weight), int(args.top_k) if args.top_k else None, int(args.workers))
+
+    # Export a small subset for the tools based on networkx
+    if args.networkx:
+        export_networkx(args.language, args.mode, projection_path, int(args.networkx))
+
+    # Print finish time processing
+    end_time = datetime.now()
+    print(f'\nJob finished at {end_time}\n')
+
+    print('>> Job finished in', end_time - start_time, '<<')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import unicodedata
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import sys
+sys.path.append('../utils')
+
+import utils_commits as commits
+import utils_network as network
+
+# partial links kept before the duplicates are removed
+MAX_PARTIAL_LINKS = 5000000
+
+# links by the account or the login are always merged, the others only when they are not shared by many accounts
+STRONG_BLOCKS = ['login']
+
+# blocking keys with more identities than this are too common to identify a person
+MAX_BLOCK_IDENTITIES = 20
+
+GENERIC_LOCAL_PARTS = {'admin', 'bot', 'build', 'ci', 'contact', 'dev', 'developer', 'email', 'git', 'github', 'hello',
+                       'info', 'jenkins', 'mail', 'me', 'no-reply', 'none', 'noreply', 'pi', 'root', 'support', 'test',
+                       'travis', 'ubuntu', 'unknown', 'user', 'vagrant'}
+
+GENERIC_NAMES = {'github action', 'github actions', 'no name', 'unknown author', 'your name'}
+
+NOREPLY_DOMAIN = '@users.noreply.github.com'
+
+def normalize_name(name):
+    # lowercase words without accents or punctuation, only full names are distinctive enough
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+    words = ''.join(character if character.isalnum() else ' ' for character in name).split()
+
+    if len(words) < 2 or ' '.join(words) in GENERIC_NAMES:
+        return ''
+
+    return ' '.join(words)
+
+def normalize_unique(values, function):
+    # the normalization runs once for each distinct value of the chunk
+    codes, uniques = pd.factorize(values)
+
+    return np.array([function(value) for value in uniques] + [''], dtype=object)[codes]
+
+def get_local_part(email):
+    local_part = email.split('@', 1)[0].split('+', 1)[0]
+
+    if len(local_part) < 3 or local_part in GENERIC_LOCAL_PARTS:
+        return ''
+
+    return local_part
+
+def get_noreply_login(email):
+    # the emails of the GitHub web interface have the login of the author
+    if not email.endswith(NOREPLY_DOMAIN):
+        return ''
+
+    return email[:-len(NOREPLY_DOMAIN)].split('+')[-1]
+
+def get_chunk_links(chunk_df, keys):
+    email = chunk_df['author_email'].astype('object').where(chunk_df['author_email'].notna(), '').astype(str).str.lower().values
+    login = chunk_df['author_login'].astype('object').where(chunk_df['author_login'].notna(), '').astype(str).str.lower().values
+    name = chunk_df['author_name'].astype('object').where(chunk_df['author_name'].notna(), '').astype(str).values
+
+    blocks = [('email', 'email:', email),
+              ('login', 'login:', login),
+              ('login', 'login:', normalize_unique(email, get_noreply_login)),
+              ('local', 'local:', normalize_unique(email, get_local_part)),
+              ('name', 'fullname:', normalize_unique(name, normalize_name))]
+
+    links = []
+    for block, prefix, values in blocks:
+        present = values != ''
+        links.append(pd.DataFrame({'identity': keys[present], 'token': prefix + pd.Series(values[present], dtype=str).values,
+                                   'block': block}))
+
+    return pd.concat(links, ignore_index=True).drop_duplicates()
+
+def read_links(file_paths, chunk_size):
+    # one pass over the commits, keeping only the distinct links between identities and blocking keys
+    partial_links = []
+    partial_rows = 0
+    identity_commits = []
+
+    for chunk_df in commits.iter_commit_chunks(file_paths, chunk_size):
+        chunk_df, keys = commits.get_valid_commits(chunk_df)
+        if chunk_df.empty:
+            continue
+
+        identity_commits.append(pd.Series(keys).value_counts())
+        partial_links.append(get_chunk_links(chunk_df, keys))
+        partial_rows += len(partial_links[-1])
+
+        if partial_rows > MAX_PARTIAL_LINKS:
+            partial_links = [pd.concat(partial_links, ignore_index=True).drop_duplicates()]
+            partial_rows = len(partial_links[0])
+            identity_commits = [pd.concat(identity_commits).groupby(level=0).sum()]
+
+    if not partial_links:
+        return pd.DataFrame(columns=['identity', 'token', 'block']), pd.Series(dtype=np.int64)
+
+    links_df = pd.concat(partial_links, ignore_index=True).drop_duplicates()
+    identity_commits = pd.concat(identity_commits).groupby(level=0).sum()
+
+    return links_df, identity_commits
+
+def resolve_identities(links_df, identity_commits, max_accounts):
+    tokens = commits.Interner(identity_commits.index.values)
+    identities = tokens.intern(links_df['identity'].values)
+    blocking_keys = tokens.intern(links_df['token'].values)
+
+    # a blocking key shared by different accounts is not a person (a generic name, email or local part)
+    is_account = pd.Series(tokens.keys, dtype=str).str.startswith('id:').values
+    block_accounts = np.bincount(blocking_keys, weights=is_account[identities], minlength=len(tokens))
+    block_identities = np.bincount(blocking_keys, minlength=len(tokens))
+
+    strong = links_df['block'].isin(STRONG_BLOCKS).values
+    keep = strong | ((block_accounts[blocking_keys] <= max_accounts) &
+                     (block_identities[blocking_keys] <= MAX_BLOCK_IDENTITIES))
+
+    print(f'Links kept: {keep.sum()} of {len(keep)}')
+
+    union_find = network.UnionFind(len(tokens))
+    union_find.union(identities[keep], blocking_keys[keep])
+
+    # the identities are the first keys of the interner, the blocking keys come after them
+    roots = union_find.find(np.arange(len(identity_commits)))
+
+    mapping_df = pd.DataFrame({'identity': identity_commits.index.values, 'root': roots,
+                               'commits': identity_commits.values, 'account': is_account[:len(identity_commits)]})
+
+    # the canonical identity is the account with more commits or, without accounts, the identity with more commits
+    canonical_df = mapping_df.sort_values(['root', 'account', 'commits'], ascending=[True, False, False])
+    canonical_df = canonical_df.drop_duplicates(subset=['root'])[['root', 'identity']]
+    mapping_df = mapping_df.merge(canonical_df.rename(columns={'identity': 'canonical'}), on='root')
+
+    mapping_df['person'] = pd.factorize(mapping_df['canonical'])[0]
+
+    return mapping_df[['identity', 'canonical', 'person', 'commits']].sort_values(['person', 'commits'],
+                                                                                   ascending=[True, False])
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge the identities of the commit authors of a language')
+    parser.add_argument('-l', '--language',
+                        help='The programming language of the crawled commits (hint: replace spaces by +)', required=True)
+    parser.add_argument('--max-accounts', default=1,
+                        help='Maximum number of GitHub accounts sharing an email, local part or name to merge by it',
+                        required=False)
+    parser.add_argument('--chunk-size', default=1000000,
+                        help='Number of commits read at a time from the parquet shards', required=False)
+
+    args = parser.parse_args()
+
+    # Print start time processing
+    start_time = datetime.now()
+    print(f'Job stated at {start_time}\n')
+
+    # Stream the commits and link each identity to its blocking keys
+    links_df, identity_commits = read_links(commits.list_commit_files(args.language), int(args.chunk_size))
+    print(f'Identities: {len(identity_commits)} - links: {len(links_df)}')
+
+    mapping_df = resolve_identities(links_df, identity_commits, int(args.max_accounts))
+    print(f'People: {mapping_df["person"].nunique()}')
+
+    mapping_path = commits.get_identities_path(args.language)
+    mapping_df.to_csv(mapping_path, index=False)
+    print('\nIdentities saved on', mapping_path)
+
+    # Print finish time processing
+    end_time = datetime.now()
+    print(f'\nJob finished at {end_time}\n')
+
+    print('>> Job finished in', end_time - start_time, '<<')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import os
+import sys
+sys.path.append('../utils')
+
+import utils_commits as commits
+import utils_network as network
+
+# partial monthly edges kept before they are combined
+MAX_PARTIAL_EDGES = 5000000
+
+DELTAS_SCHEMA = pa.schema([pa.field('month', pa.string()), pa.field('developer', pa.int64()),
+                           pa.field('repository', pa.int64()), pa.field('change', pa.int8())])
+
+def get_interners(language):
+    # the ids of the bipartite network are kept when it was already built
+    try:
+        developers = commits.Interner(network.load_developers(language)['identity'].values)
+        repositories = commits.Interner(network.load_repositories(language)['repository_id'].values)
+    except FileNotFoundError:
+        developers = commits.Interner()
+        repositories = commits.Interner()
+
+    return developers, repositories
+
+def to_month(seconds):
+    dates = pd.to_datetime(seconds, unit='s')
+
+    return (dates.year * 12 + dates.month - 1).values.astype(np.int64)
+
+def month_label(month):
+    return f'{month // 12:04d}-{month % 12 + 1:02d}'
+
+def aggregate_events(events_df):
+    return events_df.groupby(['month', 'developer', 'repository'], sort=False)['commits'].sum().reset_index()
+
+def read_monthly_events(file_paths, chunk_size, developers, repositories, identity_map=None):
+    # the commits are reduced to the commits of each developer in each repository by month
+    partial_events = []
+    partial_rows = 0
+
+    for chunk_df in commits.iter_commit_chunks(file_paths, chunk_size):
+        chunk_df, keys = commits.get_valid_commits(chunk_df, identity_map)
+        if chunk_df.empty:
+            continue
+
+        partial_events.append(aggregate_events(pd.DataFrame({
+            'month': to_month(chunk_df['author_date'].values),
+            'developer': developers.intern(keys),
+            'repository': repositories.intern(chunk_df['repository_id'].values.astype(np.int64)),
+            'commits': np.ones(len(chunk_df), dtype=np.int64)})))
+        partial_rows += len(partial_events[-1])
+
+        if partial_rows > MAX_PARTIAL_EDGES:
+            partial_events = [aggregate_events(pd.concat(partial_events, ignore_index=True))]
+            partial_rows = len(partial_events[0])
+
+    if not partial_events:
+        return pd.DataFrame(columns=['month', 'developer', 'repository', 'commits'], dtype=np.int64)
+
+    events_df = aggregate_events(pd.concat(partial_events, ignore_index=True))
+
+    # the only sort of the events, the snapshots are consecutive slices of it
+    return events_df.sort_values('month', kind='stable').reset_index(drop=True)
+
+class SnapshotGraph:
+    # active edges of the developer x repository network, updated by the monthly deltas
+    def __init__(self, developers, repositories, edge_developers, edge_repositories):
+        self.developers = developers
+
+        # months of each edge inside the window, the edge is active while it is positive
+        self.edge_months = np.zeros(len(edge_developers), dtype=np.int64)
+        self.edge_developers = edge_developers
+        self.edge_repositories = edge_repositories
+
+        self.developer_degrees = np.zeros(developers, dtype=np.int64)
+        self.repository_degrees = np.zeros(repositories, dtype=np.int64)
+        self.active_edges = 0
+
+        # developers and repositories are the nodes of the same union-find, repositories after the developers
+        self.union_find = network.UnionFind(developers + repositories)
+
+        # nodes of the expired edges, their components are built again before the next count
+        self.expired_nodes = []
+
+    def apply(self, edge_ids, change):
+        # change is 1 for the month entering the window and -1 for the month leaving it
+        before = self.edge_months[edge_ids] > 0
+        self.edge_months[edge_ids] += change
+        after = self.edge_months[edge_ids] > 0
+
+        # an edge changes only when the first month enters or the last month leaves the window
+        changed = edge_ids[before != after]
+        if not len(changed):
+            return changed
+
+        np.add.at(self.developer_degrees, self.edge_developers[changed], change)
+        np.add.at(self.repository_degrees, self.edge_repositories[changed], change)
+        self.active_edges += change * len(changed)
+
+        if change > 0:
+            # insertions only join components
+            self.union_find.union(self.edge_developers[changed], self.developers + self.edge_repositories[changed])
+        else:
+            # an expired edge can split a component, which the union-find does not undo
+            self.expired_nodes.append(self.edge_developers[changed])
+
+        return changed
+
+    def split_components(self):
+        # only the components with an expired edge are built again, from their active edges
+        # the other components did not lose any edge, so they are still the connected parts of the snapshot
+        roots = self.union_find.compress()
+
+        touched_roots = np.zeros(len(roots), dtype=bool)
+        touched_roots[roots[np.concatenate(self.expired_nodes)]] = True
+        touched = touched_roots[roots]
+        touched_nodes = np.flatnonzero(touched)
+        self.expired_nodes = []
+
+        # the edges of a component have both nodes in it, so the developers select them
+        edges = np.flatnonzero(touched[self.edge_developers] & (self.edge_months > 0))
+
+        # a smaller union-find with the touched nodes only, the nodes are sorted so the smallest one is still the root
+        union_find = network.UnionFind(len(touched_nodes))
+        union_find.union(np.searchsorted(touched_nodes, self.edge_developers[edges]),
+                         np.searchsorted(touched_nodes, self.developers + self.edge_repositories[edges]))
+
+        self.union_find.assign(touched_nodes, touched_nodes[union_find.compress()])
+
+    def get_components(self):
+        if self.expired_nodes:
+            self.split_components()
+
+        # only the nodes with edges in the snapshot are counted
+        active_nodes = np.flatnonzero(np.r_[self.developer_degrees > 0, self.repository_degrees > 0])
+        if not len(active_nodes):
+            return 0, 0
+
+        roots, sizes = np.unique(self.union_find.find(active_nodes), return_counts=True)
+
+        return len(roots), int(sizes.max())
+
+    def get_statistics(self):
+        components, largest_component = self.get_components()
+
+        active_developers = self.developer_degrees[self.developer_degrees > 0]
+        active_repositories = self.repository_degrees[self.repository_degrees > 0]
+
+        return {'developers': len(active_developers),
+                'repositories': len(active_repositories),
+                'edges': self.active_edges,
+                'mean_developer_degree': active_developers.mean() if len(active_developers) else 0,
+                'max_developer_degree': int(active_developers.max()) if len(active_developers) else 0,
+                'mean_repository_degree': active_repositories.mean() if len(active_repositories) else 0,
+                'max_repository_degree': int(active_repositories.max()) if len(active_repositories) else 0,
+                'components': components,
+                'largest_component': largest_component}
+
+def build_snapshots(events_df, developers, repositories, window, cumulative, deltas_writer=None):
+    months = events_df['month'].values
+    first_month, last_month = months.min(), months.max()
+
+    # dense ids of the edges, computed once for all the events
+    edge_ids, edge_keys = pd.factorize(events_df['developer'].values * repositories + events_df['repository'].values)
+    edge_ids = edge_ids.astype(np.int64)
+
+    graph = SnapshotGraph(developers, repositories, edge_keys // repositories, edge_keys % repositories)
+    snapshots = []
+
+    for month in range(first_month, last_month + 1):
+        # the events of a month are a slice of the sorted events
+        inserted = graph.apply(get_month_edges(edge_ids, months, month), 1)
+
+        expired = np.zeros(0, dtype=np.int64)
+        if not cumulative and month - window >= first_month:
+            expired = graph.apply(get_month_edges(edge_ids, months, month - window), -1)
+
+        statistics = {'month': month_label(month), 'inserted_edges': len(inserted), 'expired_edges': len(expired)}
+        statistics.update(graph.get_statistics())
+        snapshots.append(statistics)
+
+        print(f"Snapshot {statistics['month']} - edges: {statistics['edges']} - components: {statistics['components']}")
+
+        if deltas_writer is not None:
+            save_deltas(deltas_writer, graph, month, inserted, expired)
+
+    return pd.DataFrame(snapshots)
+
+def get_month_edges(edge_ids, months, month):
+    start, end = np.searchsorted(months, [month, month + 1])
+
+    return edge_ids[start:end]
+
+def save_deltas(writer, graph, month, inserted, expired):
+    edge_ids = np.r_[inserted, expired]
+    changes = np.r_[np.ones(len(inserted), dtype=np.int8), -np.ones(len(expired), dtype=np.int8)]
+
+    writer.write_table(pa.Table.from_arrays([pa.array([month_label(month)] * len(edge_ids)),
+                                             pa.array(graph.edge_developers[edge_ids]),
+                                             pa.array(graph.edge_repositories[edge_ids]),
+                                             pa.array(changes)], schema=DELTAS_SCHEMA))
+
+def main():
+    parser = argparse.ArgumentParser(description='Build monthly snapshots of the developer x repository network')
+    parser.add_argument('-l', '--language',
+                        help='The programming language of the crawled commits (hint: replace spaces by +)', required=True)
+    parser.add_argument('-m', '--mode', default='sliding', choices=['sliding', 'cumulative'],
+                        help='Snapshots with the edges of the last months or with all the edges until each month',
+                        required=False)
+    parser.add_argument('-w', '--window', default=12,
+                        help='Number of months of each sliding snapshot', required=False)
+    parser.add_argument('--deltas', action='store_true',
+                        help='Save the edges inserted and expired in each snapshot', required=False)
+    parser.add_argument('-i', '--identities', action='store_true',
+                        help='Merge the identities of the same person with the table of resolve_identities.py',
+                        required=False)
+    parser.add_argument('--chunk-size', default=1000000,
+                        help='Number of commits read at a time from the parquet shards', required=False)
+
+    args = parser.parse_args()
+
+    # Print start time processing
+    start_time = datetime.now()
+    print(f'Job stated at {start_time}\n')
+
+    # One pass over the commits, sorted by month once
+    developers, repositories = get_interners(args.language)
+    identity_map = commits.load_identity_map(args.language) if args.identities else None
+    events_df = read_monthly_events(commits.list_commit_files(args.language), int(args.chunk_size), developers,
+                                    repositories, identity_map)
+
+    print(f'Monthly events: {len(events_df)}\n')
+    if events_df.empty:
+        print('There are no commits to build the snapshots')
+        sys.exit(-1)
+
+    cumulative = args.mode == 'cumulative'
+    name = 'cumulative' if cumulative else f'sliding_{int(args.window)}'
+    processed_path = commits.get_processed_path(args.language)
+
+    deltas_writer = None
+    if args.deltas:
+        deltas_path = os.path.join(processed_path, f'snapshots_{name}_deltas.parquet')
+        deltas_writer = pq.ParquetWriter(deltas_path, DELTAS_SCHEMA, compression='zstd')
+
+    snapshots_df = build_snapshots(events_df, len(developers), len(repositories), int(args.window), cumulative,
+                                   deltas_writer)
+
+    if deltas_writer is not None:
+        deltas_writer.close()
+        print('\nDeltas saved on', deltas_path)
+
+    snapshots_path = os.path.join(processed_path, f'snapshots_{name}.csv')
+    snapshots_df.to_csv(snapshots_path, index=False)
+    print('Snapshots saved on', snapshots_path)
+
+    # Print finish time processing
+    end_time = datetime.now()
+    print(f'\nJob finished at {end_time}\n')
+
+    print('>> Job finished in', end_time - start_time, '<<')
+
+if __name__ == '__main__':
+    main()
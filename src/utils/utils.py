@@ -1,6 +1,7 @@
 import sys
 import os
 
+import numpy as np
 import pandas as pd
 
 def get_main_path():
@@ -19,4 +20,33 @@ def get_token_key(token_key, filename='tokens.csv'):
         return df_tokens[df_tokens['token_key'] == token_key].iloc[0]['token']
     except:
         print(f'The token key ({token_key}) does not exist in the tokens file ({tokens_path})')
-        sys.exit(-1)
\ No newline at end of file
+        sys.exit(-1)
+
+def get_all_tokens(filename='tokens.csv'):
+    tokens_path = os.path.join(get_main_path(), 'data', filename)
+
+    df_tokens = pd.read_csv(tokens_path, header=None, sep=',', names=['token_key', 'token'])
+
+    if df_tokens.empty:
+        print(f'There are no tokens in the tokens file ({tokens_path})')
+        sys.exit(-1)
+
+    return df_tokens['token'].drop_duplicates().tolist()
+
+def get_all_token_keys(filename='tokens.csv'):
+    tokens_path = os.path.join(get_main_path(), 'data', filename)
+
+    df_tokens = pd.read_csv(tokens_path, header=None, sep=',', names=['token_key', 'token'])
+
+    if df_tokens.empty:
+        print(f'There are no tokens in the tokens file ({tokens_path})')
+        sys.exit(-1)
+
+    return df_tokens.drop_duplicates(subset=['token'])['token_key'].tolist()
+
+def to_epoch(dates):
+    # seconds since 1970 in UTC, -1 for the missing dates
+    dates = pd.to_datetime(pd.Series(dates), utc=True, errors='coerce')
+    seconds = (dates - pd.Timestamp(0, tz='UTC')).dt.total_seconds()
+
+    return seconds.fillna(-1).astype(np.int64).values
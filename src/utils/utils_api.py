@@ -1,21 +1,309 @@
-import requests
+import os
 import json
 import time
+import random
+import threading
 
 from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+# orjson decodes the pages faster than the json module (the whole page is still decoded in memory),
+# the json module is kept for installations without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import utils_http as http
+import utils_metrics as metrics
+
+# seconds to wait after the reset time before using the token again
+RESET_MARGIN = 10
+
+# root of the API, replaced by a local server in the benchmarks
+API_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
+
+# failed attempts of a request before it is given up, with exponential waits between them (in seconds)
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 2
+BACKOFF_MAX = 300
+
+# searches answered with incomplete results are requested again a few times before the results are accepted
+INCOMPLETE_ATTEMPTS = 2
+
+# kinds of failures
+TRANSIENT = 'transient'
+RATE_LIMITED = 'rate_limited'
+SECONDARY_RATE_LIMITED = 'secondary_rate_limited'
+PERMANENT = 'permanent'
+INCOMPLETE = 'incomplete'
+
+# answers that will not change by requesting again: not found, blocked, empty repository, gone, invalid query
+PERMANENT_STATUS = [404, 409, 410, 422, 451]
+
+# remaining budget and reset time by (token, resource), updated from the response headers
+_rate_limits = {}
+_rate_limits_lock = threading.Lock()
+
+# permissions of each token, from the scopes of the classic tokens (the fine-grained tokens do not have them)
+_permissions = {}
+
+def update_rate_limit(token, headers, request_type=None):
+    remaining = headers.get('X-RateLimit-Remaining')
+    reset = headers.get('X-RateLimit-Reset')
+
+    if remaining is None or reset is None:
+        return
+
+    resource = headers.get('X-RateLimit-Resource', request_type)
+
+    with _rate_limits_lock:
+        _rate_limits[(token, resource)] = {'remaining': int(remaining), 'reset': int(reset)}
+
+def get_rate_limit(token, request_type):
+    with _rate_limits_lock:
+        return _rate_limits.get((token, request_type))
+
+def load_rate_limit(token):
+    # requests to /rate_limit do not count against the budget
+    rate_limit_request = f'{API_URL}/rate_limit'
+    response = http.get(rate_limit_request, token)
+    rate_limit = json.loads(response.content)
+
+    with _rate_limits_lock:
+        _permissions[token] = response.headers.get('X-OAuth-Scopes')
+        for resource, values in rate_limit['resources'].items():
+            _rate_limits[(token, resource)] = {'remaining': int(values['remaining']), 'reset': int(values['reset'])}
+
+def get_permissions(token):
+    # the scopes are sent with every response, the free request to /rate_limit is used when they are unknown
+    with _rate_limits_lock:
+        known = token in _permissions
+    if not known:
+        load_rate_limit(token)
+
+    with _rate_limits_lock:
+        return _permissions[token]
 
 def verify_request_time(token, request_type):
-    rate_limit_request = 'https://api.github.com/rate_limit'
-    rate_limit = requests.get(rate_limit_request, headers={'Authorization': 'token %s' % token})
-    rate_limit = json.loads(rate_limit.content)
+    rate_limit = get_rate_limit(token, request_type)
+
+    # without a previous response there is nothing to wait for
+    if not rate_limit or rate_limit['remaining'] > 0:
+        return
+
+    now = datetime.utcnow()
+    reset_time = datetime.utcfromtimestamp(rate_limit['reset'])
+
+    wait_seconds = (reset_time - now).total_seconds()
+
+    # wait the reset time to continue
+    if wait_seconds > 0:
+        print(f'\nSleeping {wait_seconds} until continue...\n')
+        time.sleep(wait_seconds + RESET_MARGIN)
+        metrics.observe_sleep(request_type, wait_seconds + RESET_MARGIN)
+
+    # the budget is unknown again until the next response
+    with _rate_limits_lock:
+        _rate_limits.pop((token, request_type), None)
+
+def is_waiting_reset(token, request_type):
+    # the next request with the token sleeps until the reset in verify_request_time
+    rate_limit = get_rate_limit(token, request_type)
+
+    return bool(rate_limit) and rate_limit['remaining'] == 0 and rate_limit['reset'] > time.time()
+
+class RequestError(Exception):
+    # a request that failed permanently or in all its attempts
+    def __init__(self, url, request_type, kind, status=None, message=None, attempts=1):
+        super().__init__(f'{kind} failure ({status}) in {url}: {message}')
+        self.url = url
+        self.request_type = request_type
+        self.kind = kind
+        self.status = status
+        self.message = message
+        self.attempts = attempts
+
+def loads(content):
+    return orjson.loads(content) if orjson is not None else json.loads(content)
+
+def get_data(response):
+    # the body is decoded once, when the response is checked, and the crawlers read the same data
+    data = getattr(response, 'data', None)
+    if data is None:
+        data = loads(response.content)
+        response.data = data
+
+    return data
+
+def get_last_page(links):
+    # the link to the last page is missing when there is only one page
+    if 'last' not in links:
+        return 1
+
+    query = parse_qs(urlparse(links['last']['url']).query)
+
+    return int(query['page'][0])
+
+def get_message(response):
+    try:
+        return loads(response.content).get('message')
+    except (ValueError, AttributeError):
+        return response.text[:200]
+
+def is_rate_limited(response):
+    if response.headers.get('X-RateLimit-Remaining') != '0':
+        return False
+
+    # the GraphQL API answers an exhausted budget with an error in a normal response
+    return response.status_code in (403, 429) or b'RATE_LIMITED' in response.content
+
+def choose_token(tokens, request_type):
+    # tokens without a known budget are used first to discover it
+    for token in tokens:
+        if get_rate_limit(token, request_type) is None:
+            return token
+
+    budgets = [(get_rate_limit(token, request_type), token) for token in tokens]
+    budgets = [(rate_limit, token) for rate_limit, token in budgets if rate_limit]
+
+    if not budgets:
+        return tokens[0]
+
+    # use the token with the most remaining requests or, if all are exhausted, the first to reset
+    rate_limit, token = max(budgets, key=lambda budget: budget[0]['remaining'])
+    if rate_limit['remaining'] == 0:
+        rate_limit, token = min(budgets, key=lambda budget: budget[0]['reset'])
+
+    return token
+
+def reserve_request(token, request_type):
+    # discount the request before the response arrives, so concurrent requests spread over the tokens
+    with _rate_limits_lock:
+        rate_limit = _rate_limits.get((token, request_type))
+        if rate_limit and rate_limit['remaining'] > 0:
+            rate_limit['remaining'] -= 1
+
+def is_secondary_rate_limited(response):
+    if response.status_code not in (403, 429):
+        return False
+
+    # the limits of concurrent or too fast requests do not exhaust the budget
+    message = (get_message(response) or '').lower()
+
+    return 'Retry-After' in response.headers or 'secondary rate limit' in message or 'abuse' in message
+
+def classify_response(response, request_type):
+    # None for a usable response, otherwise the kind of failure
+    if response.status_code == 304:
+        return None
+    if is_rate_limited(response):
+        return RATE_LIMITED
+    if is_secondary_rate_limited(response):
+        return SECONDARY_RATE_LIMITED
+    if response.status_code in PERMANENT_STATUS:
+        return PERMANENT
+    if response.status_code == 403 and 'blocked' in (get_message(response) or '').lower():
+        return PERMANENT
+    if response.status_code != 200:
+        return TRANSIENT
+
+    # a truncated body or an answer without the expected fields is requested again
+    try:
+        data = get_data(response)
+    except ValueError:
+        return TRANSIENT
+
+    if request_type == 'search':
+        if not isinstance(data, dict) or 'total_count' not in data:
+            return TRANSIENT
+        if data.get('incomplete_results'):
+            return INCOMPLETE
+    if request_type == 'graphql' and not (isinstance(data, dict) and data.get('data')):
+        return TRANSIENT
+
+    return None
+
+def get_backoff(attempt, response=None):
+    # full jitter, so the processes sharing the tokens do not retry at the same time
+    wait = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        wait = max(wait, int(retry_after))
+
+    return wait
+
+def send_request(url, token, headers=None, payload=None):
+    # queries to the GraphQL API are sent in the body of a post
+    if payload is None:
+        return http.get(url, token, headers)
+
+    return http.post(url, token, payload, headers)
+
+def get_from_pool(url, tokens, request_type, headers=None, payload=None):
+    attempts = 0
+    incomplete_attempts = 0
+    secondary_attempts = 0
+    rate_limited_attempts = 0
+
+    while True:
+        token = choose_token(tokens, request_type)
+        verify_request_time(token, request_type)
+        reserve_request(token, request_type)
+
+        try:
+            response = send_request(url, token, headers, payload)
+        except requests.RequestException as error:
+            response, kind, message = None, TRANSIENT, str(error)
+        else:
+            update_rate_limit(token, response.headers, request_type)
+            kind = classify_response(response, request_type)
+            message = get_message(response) if kind else None
+
+        if kind is None:
+            return response
+
+        status = response.status_code if response is not None else None
+
+        if kind == PERMANENT:
+            metrics.observe_failure(request_type, kind)
+            raise RequestError(url, request_type, kind, status, message, attempts + 1)
+
+        if kind == INCOMPLETE:
+            incomplete_attempts += 1
+            if incomplete_attempts > INCOMPLETE_ATTEMPTS:
+                return response
+            wait = get_backoff(incomplete_attempts, response)
+        elif kind == RATE_LIMITED:
+            # the budget was exhausted by another process using the same token, the next token waits for its reset
+            rate_limited_attempts += 1
+            metrics.observe_rate_limited(request_type)
+            if is_waiting_reset(token, request_type):
+                continue
+
+            # a reset already passed (clock skew or a stale header) is not waited, so the retries back off
+            wait = get_backoff(min(rate_limited_attempts, MAX_ATTEMPTS), response)
+        elif kind == SECONDARY_RATE_LIMITED:
+            # the secondary limits always end, so they are waited without giving up
+            secondary_attempts += 1
+            metrics.observe_rate_limited(request_type)
+            wait = get_backoff(min(secondary_attempts, MAX_ATTEMPTS), response)
+        else:
+            attempts += 1
+            if attempts >= MAX_ATTEMPTS:
+                metrics.observe_failure(request_type, kind)
+                raise RequestError(url, request_type, kind, status, message, attempts)
+            wait = get_backoff(attempts, response)
 
-    if rate_limit['resources'][request_type]['remaining'] == 0:
-        now = datetime.utcnow()
-        reset_time = datetime.utcfromtimestamp(rate_limit['resources'][request_type]['reset'])
+        print(f'{kind} failure ({status if status else message}) - requesting {url} again in {wait:.1f} seconds')
+        metrics.observe_retry(request_type, kind, wait)
+        time.sleep(wait)
 
-        wait_seconds = (reset_time - now).total_seconds()
+def get(url, token, request_type, headers=None):
+    return get_from_pool(url, [token], request_type, headers)
 
-        # wait the reset time to continue
-        if wait_seconds > 0:
-            print(f'\nSleeping {wait_seconds} until continue...\n')
-            time.sleep(wait_seconds + 10)
\ No newline at end of file
+def post_from_pool(url, tokens, request_type, payload, headers=None):
+    return get_from_pool(url, tokens, request_type, headers, payload)
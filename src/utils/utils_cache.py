@@ -0,0 +1,187 @@
+import os
+import json
+import hashlib
+import threading
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import utils as utils
+import utils_api as api
+
+# maximum size of the cache on disk, the least recently used responses are removed above it
+MAX_SIZE_MB = 2048
+
+_cache_path = None
+_cache_size = None
+_cache_lock = threading.Lock()
+
+def configure(cache_path=None, max_size_mb=None):
+    global _cache_path, _cache_size, MAX_SIZE_MB
+
+    if not cache_path:
+        cache_path = os.path.join(utils.get_main_path(), 'data', 'crawler', 'cache')
+
+    if max_size_mb:
+        MAX_SIZE_MB = float(max_size_mb)
+
+    os.makedirs(cache_path, exist_ok=True)
+
+    with _cache_lock:
+        _cache_path = cache_path
+        _cache_size = None
+
+def is_enabled():
+    return _cache_path is not None
+
+def normalize_url(url):
+    parts = urlsplit(url)
+
+    # the same query with the params in another order has the same response
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+def get_token_scope(tokens):
+    # the responses depend on the permissions of the tokens, not on the token of the pool that made the request,
+    # so the rotated tokens and the tokens added to the pool share the entries
+    permissions = [get_permission_scope(token) for token in tokens]
+
+    return hashlib.sha256('|'.join(sorted(set(permissions))).encode()).hexdigest()[:16]
+
+def get_permission_scope(token):
+    permissions = api.get_permissions(token)
+
+    # without the scopes the permissions are unknown, so each token has its own entries
+    # the tokens themselves are never written
+    if permissions is None:
+        return 'token:' + hashlib.sha256(token.encode()).hexdigest()
+
+    return 'scopes:' + ','.join(sorted(scope.strip() for scope in permissions.split(',') if scope.strip()))
+
+def get_entry_path(url, tokens):
+    key = hashlib.sha256(f'{get_token_scope(tokens)} {normalize_url(url)}'.encode()).hexdigest()
+
+    return os.path.join(_cache_path, key[:2], key)
+
+def load_entry(entry_path):
+    try:
+        with open(entry_path + '.json', mode='r') as r:
+            metadata = json.load(r)
+        with open(entry_path + '.body', mode='rb') as r:
+            body = r.read()
+    except (OSError, ValueError):
+        return None, None
+
+    return metadata, body
+
+def save_entry(entry_path, url, response):
+    metadata = {'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'link': response.headers.get('Link')}
+
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+
+    previous_size = get_entry_size(entry_path)
+
+    # write in temporary files to never leave a partial entry
+    for extension, mode, content in [('.body', 'wb', response.content), ('.json', 'w', json.dumps(metadata))]:
+        with open(entry_path + extension + '.tmp', mode=mode) as w:
+            w.write(content)
+        os.replace(entry_path + extension + '.tmp', entry_path + extension)
+
+    update_cache_size(get_entry_size(entry_path) - previous_size)
+
+def get_entry_size(entry_path):
+    size = 0
+
+    for extension in ['.json', '.body']:
+        try:
+            size += os.path.getsize(entry_path + extension)
+        except OSError:
+            pass
+
+    return size
+
+def touch_entry(entry_path):
+    # the modification time of the body is the last access used by the eviction
+    try:
+        os.utime(entry_path + '.body')
+    except OSError:
+        pass
+
+def update_cache_size(delta):
+    global _cache_size
+
+    with _cache_lock:
+        if _cache_size is None:
+            _cache_size = sum(entry['size'] for entry in list_entries())
+        else:
+            _cache_size += delta
+
+        if _cache_size > MAX_SIZE_MB * 1024 * 1024:
+            _cache_size = evict_entries(_cache_size)
+
+def list_entries():
+    entries = []
+
+    for folder in os.scandir(_cache_path):
+        if not folder.is_dir():
+            continue
+
+        for file in os.scandir(folder.path):
+            if file.name.endswith('.body'):
+                entry_path = file.path[:-len('.body')]
+                entries.append({'path': entry_path, 'size': get_entry_size(entry_path),
+                                'last_access': file.stat().st_mtime})
+
+    return entries
+
+def evict_entries(cache_size):
+    # remove the least recently used entries until the cache uses 90% of the maximum size
+    target_size = MAX_SIZE_MB * 1024 * 1024 * 0.9
+
+    for entry in sorted(list_entries(), key=lambda entry: entry['last_access']):
+        if cache_size <= target_size:
+            break
+
+        for extension in ['.json', '.body']:
+            try:
+                os.remove(entry['path'] + extension)
+            except OSError:
+                pass
+
+        cache_size -= entry['size']
+
+    return cache_size
+
+def get(url, tokens, request_type):
+    if not is_enabled():
+        return api.get_from_pool(url, tokens, request_type)
+
+    entry_path = get_entry_path(url, tokens)
+    metadata, body = load_entry(entry_path)
+
+    # conditional request, a not modified response does not count against the rate limit
+    headers = {}
+    if metadata:
+        if metadata['etag']:
+            headers['If-None-Match'] = metadata['etag']
+        if metadata['last_modified']:
+            headers['If-Modified-Since'] = metadata['last_modified']
+
+    response = api.get_from_pool(url, tokens, request_type, headers)
+
+    if response.status_code == 304 and metadata:
+        # answer with the cached body as a normal response
+        response.status_code = 200
+        response._content = body
+        response.from_cache = True
+        if metadata['link']:
+            response.headers['Link'] = metadata['link']
+
+        touch_entry(entry_path)
+    elif response.status_code == 200 and (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+        save_entry(entry_path, url, response)
+
+    return response
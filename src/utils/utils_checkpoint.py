@@ -0,0 +1,294 @@
+import os
+import sqlite3
+import threading
+
+from datetime import datetime, timedelta
+
+import utils as utils
+
+# seconds to wait when another process is writing in the same database
+BUSY_TIMEOUT = 60
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS commit_pages (
+    repository_id INTEGER NOT NULL,
+    until TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    full_name TEXT,
+    updated_at TEXT,
+    complete_query TEXT,
+    status TEXT NOT NULL,
+    log_date TEXT NOT NULL,
+    end_cursor TEXT,
+    PRIMARY KEY (repository_id, until, page)
+);
+
+CREATE TABLE IF NOT EXISTS commit_repositories (
+    repository_id INTEGER NOT NULL,
+    until TEXT NOT NULL,
+    full_name TEXT,
+    updated_at TEXT,
+    last_page INTEGER,
+    newest_commit_date TEXT,
+    newest_sha TEXT,
+    status TEXT NOT NULL,
+    log_date TEXT NOT NULL,
+    PRIMARY KEY (repository_id, until)
+);
+
+CREATE INDEX IF NOT EXISTS commit_repositories_status ON commit_repositories (until, status);
+
+CREATE TABLE IF NOT EXISTS high_water_marks (
+    repository_id INTEGER PRIMARY KEY,
+    full_name TEXT,
+    last_commit_date TEXT NOT NULL,
+    last_sha TEXT NOT NULL,
+    log_date TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS repository_pages (
+    complete_query TEXT PRIMARY KEY,
+    stars TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    page INTEGER,
+    total_count INTEGER,
+    incomplete_results INTEGER,
+    log_date TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS repository_windows (
+    start_date TEXT PRIMARY KEY,
+    end_date TEXT NOT NULL,
+    log_date TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS stars_ranges (
+    start_star INTEGER PRIMARY KEY,
+    end_star INTEGER NOT NULL,
+    repositories INTEGER,
+    incomplete_results INTEGER,
+    log_date TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS merged_files (
+    file_name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    log_date TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS dead_letters (
+    url TEXT PRIMARY KEY,
+    request_type TEXT,
+    kind TEXT NOT NULL,
+    status INTEGER,
+    message TEXT,
+    attempts INTEGER,
+    log_date TEXT NOT NULL
+);
+'''
+
+class Checkpoint:
+    def __init__(self, file_name):
+        # the connection is shared by the crawling threads, the lock keeps one transaction at a time
+        self.connection = sqlite3.connect(file_name, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(SCHEMA)
+
+            # checkpoints created before the cursors of the GraphQL pages were saved
+            columns = [column[1] for column in self.connection.execute('PRAGMA table_info(commit_pages)')]
+            if 'end_cursor' not in columns:
+                self.connection.execute('ALTER TABLE commit_pages ADD COLUMN end_cursor TEXT')
+
+    def execute(self, statement, params=()):
+        with self.lock, self.connection:
+            return self.connection.execute(statement, params).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+def get_checkpoint_path(language):
+    return os.path.join(utils.get_main_path(), 'data', 'crawler', 'checkpoints', f'{language.lower()}.db')
+
+def open_checkpoint(language, file_name=None):
+    file_name = file_name if file_name else get_checkpoint_path(language)
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+
+    return Checkpoint(file_name)
+
+def now():
+    return str(datetime.now())
+
+# commits
+
+def start_commit_page(checkpoint, row, until, page, complete_query):
+    checkpoint.execute('''INSERT OR REPLACE INTO commit_pages (repository_id, until, page, full_name, updated_at,
+                          complete_query, status, log_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                       (int(row['id']), until, page, row['full_name'], row['updated_at'], complete_query,
+                        'started', now()))
+
+def finish_commit_page(checkpoint, row, until, page, end_cursor=None):
+    # the cursor of the next page is saved with the page, so an interrupted history continues after it
+    checkpoint.execute('''UPDATE commit_pages SET status = ?, log_date = ?, end_cursor = ?
+                          WHERE repository_id = ? AND until = ? AND page = ?''',
+                       ('done', now(), end_cursor, int(row['id']), until, page))
+
+def save_commit_repository(checkpoint, row, until, last_page=None, newest_commit=None):
+    newest_commit_date = newest_commit['commit']['committer']['date'] if newest_commit else None
+    newest_sha = newest_commit['sha'] if newest_commit else None
+
+    checkpoint.execute('INSERT OR REPLACE INTO commit_repositories VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (int(row['id']), until, row['full_name'], row['updated_at'], last_page,
+                        newest_commit_date, newest_sha, 'started', now()))
+
+def finish_commit_repository(checkpoint, row, until):
+    with checkpoint.lock, checkpoint.connection:
+        connection = checkpoint.connection
+
+        connection.execute('UPDATE commit_repositories SET status = ?, log_date = ? WHERE repository_id = ? AND until = ?',
+                           ('done', now(), int(row['id']), until))
+
+        # the newest commit becomes the high-water mark only when all the pages were saved
+        connection.execute('''INSERT OR REPLACE INTO high_water_marks
+                              SELECT repository_id, full_name, newest_commit_date, newest_sha, ?
+                              FROM commit_repositories
+                              WHERE repository_id = ? AND until = ? AND newest_sha IS NOT NULL''',
+                           (now(), int(row['id']), until))
+
+def get_finished_repositories(checkpoint, until=None):
+    if until:
+        rows = checkpoint.execute('SELECT repository_id FROM commit_repositories WHERE until = ? AND status = ?',
+                                  (until, 'done'))
+    else:
+        rows = checkpoint.execute('SELECT DISTINCT repository_id FROM commit_repositories WHERE status = ?', ('done',))
+
+    return set(row[0] for row in rows)
+
+def get_unfinished_repositories(checkpoint, until):
+    unfinished = {}
+
+    rows = checkpoint.execute('''SELECT repository_id, last_page, newest_commit_date, newest_sha
+                                 FROM commit_repositories WHERE until = ? AND status = ?''', (until, 'started'))
+    for repository_id, last_page, newest_commit_date, newest_sha in rows:
+        unfinished[repository_id] = {'last_page': last_page, 'done_pages': set(),
+                                     'newest_commit_date': newest_commit_date, 'newest_sha': newest_sha}
+
+    # only the pages done are skipped, pages still started were in flight and have to be requested again
+    rows = checkpoint.execute('''SELECT p.repository_id, p.page FROM commit_pages p
+                                 JOIN commit_repositories r ON r.repository_id = p.repository_id AND r.until = p.until
+                                 WHERE p.until = ? AND p.status = ? AND r.status = ?''', (until, 'done', 'started'))
+    for repository_id, page in rows:
+        unfinished[repository_id]['done_pages'].add(page)
+
+    return unfinished
+
+def get_commit_page_query(checkpoint, repository_id, until, page):
+    rows = checkpoint.execute('SELECT complete_query FROM commit_pages WHERE repository_id = ? AND until = ? AND page = ?',
+                              (int(repository_id), until, page))
+
+    return rows[0][0] if rows else None
+
+def get_commit_page_cursor(checkpoint, repository_id, until, page):
+    rows = checkpoint.execute('SELECT end_cursor FROM commit_pages WHERE repository_id = ? AND until = ? AND page = ?',
+                              (int(repository_id), until, page))
+
+    return rows[0][0] if rows else None
+
+def get_high_water_marks(checkpoint):
+    rows = checkpoint.execute('SELECT repository_id, last_commit_date, last_sha FROM high_water_marks')
+
+    return {repository_id: {'last_commit_date': last_commit_date, 'last_sha': last_sha}
+            for repository_id, last_commit_date, last_sha in rows}
+
+# repositories
+
+def save_repository_page(checkpoint, stars, created_at, updated_at, page, total_count, incomplete_results, complete_query):
+    checkpoint.execute('INSERT OR REPLACE INTO repository_pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       (complete_query, stars, created_at, updated_at, page, total_count, int(incomplete_results), now()))
+
+def is_repository_page_saved(checkpoint, complete_query):
+    return bool(checkpoint.execute('SELECT 1 FROM repository_pages WHERE complete_query = ?', (complete_query,)))
+
+def finish_repository_window(checkpoint, start_date, end_date):
+    checkpoint.execute('INSERT OR REPLACE INTO repository_windows VALUES (?, ?, ?)', (str(start_date), str(end_date), now()))
+
+def clear_repository_windows(checkpoint):
+    # a new crawling does not continue the windows and pages of a previous one
+    checkpoint.execute('DELETE FROM repository_windows')
+    checkpoint.execute('DELETE FROM repository_pages')
+
+def get_last_repository_window(checkpoint, first_date):
+    rows = checkpoint.execute('SELECT start_date, end_date FROM repository_windows WHERE start_date >= ? ORDER BY start_date',
+                              (str(first_date),))
+
+    # the finished windows must follow each other from the start date of the crawling,
+    # a window left unfinished by a failed request is crawled again, with the windows after it
+    last_end_date = None
+    expected_date = str(first_date)[:10]
+    for start_date, end_date in rows:
+        if start_date[:10] != expected_date:
+            break
+        last_end_date = end_date
+        expected_date = get_next_day(end_date)
+
+    return last_end_date
+
+def get_next_day(date):
+    return str((datetime.strptime(date[:10], '%Y-%m-%d') + timedelta(days=1)).date())
+
+# stars
+
+def save_stars_range(checkpoint, start_star, end_star, repositories, incomplete_results):
+    checkpoint.execute('INSERT OR REPLACE INTO stars_ranges VALUES (?, ?, ?, ?, ?)',
+                       (start_star, end_star, repositories, int(incomplete_results), now()))
+
+def clear_stars_ranges(checkpoint):
+    checkpoint.execute('DELETE FROM stars_ranges')
+
+def get_last_star(checkpoint):
+    rows = checkpoint.execute('SELECT MAX(end_star) FROM stars_ranges')
+
+    return rows[0][0]
+
+# deduplication
+
+def get_merged_files(checkpoint):
+    rows = checkpoint.execute('SELECT file_name, size, mtime FROM merged_files')
+
+    return {file_name: (size, mtime) for file_name, size, mtime in rows}
+
+def save_merged_files(checkpoint, file_states, rebuilt=False):
+    with checkpoint.lock, checkpoint.connection:
+        connection = checkpoint.connection
+
+        # a rebuild merges all the files again, so the files merged before are forgotten
+        if rebuilt:
+            connection.execute('DELETE FROM merged_files')
+
+        log_date = now()
+        connection.executemany('INSERT OR REPLACE INTO merged_files VALUES (?, ?, ?, ?)',
+                               [(file_name, size, mtime, log_date) for file_name, (size, mtime) in file_states.items()])
+
+# dead letters
+
+def save_dead_letter(checkpoint, error):
+    # the request given up, with the failure of utils_api.RequestError
+    checkpoint.execute('INSERT OR REPLACE INTO dead_letters VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (error.url, error.request_type, error.kind, error.status, error.message, error.attempts, now()))
+
+def get_dead_letters(checkpoint, kind=None):
+    if kind:
+        rows = checkpoint.execute('SELECT url, request_type, kind, status, message, attempts FROM dead_letters WHERE kind = ?',
+                                  (kind,))
+    else:
+        rows = checkpoint.execute('SELECT url, request_type, kind, status, message, attempts FROM dead_letters')
+
+    return [dict(zip(['url', 'request_type', 'kind', 'status', 'message', 'attempts'], row)) for row in rows]
+
+def remove_dead_letter(checkpoint, url):
+    checkpoint.execute('DELETE FROM dead_letters WHERE url = ?', (url,))
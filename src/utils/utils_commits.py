@@ -0,0 +1,180 @@
+import os
+import re
+import ast
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import utils as utils
+import utils_sink as sink
+
+# columns of the commits used by the network analysis
+COMMIT_COLUMNS = ['repository_id', 'repository_full_name', 'sha', 'author_id', 'author_login', 'author_name',
+                  'author_email', 'author_date']
+
+# the csv pages are small, so many of them are read before a chunk is returned
+CSV_PAGES_PER_CHUNK = 500
+
+REPOSITORY_URL = re.compile(r'/repos/([^/]+/[^/]+)/commits/')
+
+def get_crawler_path(language):
+    return os.path.join(utils.get_main_path(), 'data', 'crawler', 'commits', language.lower(), 'crawler_files')
+
+def get_processed_path(language):
+    processed_path = os.path.join(utils.get_main_path(), 'data', 'processed', language.lower())
+    os.makedirs(processed_path, exist_ok=True)
+
+    return processed_path
+
+def get_identities_path(language):
+    return os.path.join(get_processed_path(language), 'identities.csv')
+
+def load_identity_map(language):
+    # identity of the commits to the canonical identity of the person
+    identities_df = pd.read_csv(get_identities_path(language), usecols=['identity', 'canonical'])
+
+    return pd.Series(identities_df['canonical'].values, index=identities_df['identity'].values)
+
+def list_commit_files(language):
+    crawler_path = get_crawler_path(language)
+
+    return [os.path.join(crawler_path, file_name) for file_name in sorted(os.listdir(crawler_path))
+            if sink.is_data_file(file_name)]
+
+def iter_commit_chunks(file_paths, chunk_size=1000000):
+    # the parquet shards already have the flattened columns, the csv pages have the items of the API
+    csv_pages = []
+
+    for file_path in file_paths:
+        if file_path.endswith('.parquet'):
+            for chunk_df in iter_parquet_chunks(file_path, chunk_size):
+                yield chunk_df
+            continue
+
+        csv_pages.append(file_path)
+        if len(csv_pages) >= CSV_PAGES_PER_CHUNK:
+            yield read_csv_pages(csv_pages)
+            csv_pages = []
+
+    if csv_pages:
+        yield read_csv_pages(csv_pages)
+
+def iter_parquet_chunks(file_path, chunk_size):
+    parquet_file = pq.ParquetFile(file_path)
+
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=COMMIT_COLUMNS):
+        chunk_df = batch.to_pandas()
+        chunk_df['author_date'] = utils.to_epoch(chunk_df['author_date'])
+
+        yield chunk_df
+
+def read_csv_pages(file_paths):
+    pages = []
+    projected_pages = []
+
+    for file_path in file_paths:
+        page_df = pd.read_csv(file_path, sep=',')
+        if page_df.empty:
+            continue
+
+        # the file names start with the id of the repository
+        page_df['repository_id'] = int(os.path.basename(file_path).split('_', 1)[0])
+
+        # pages saved with a field selection already have the flattened columns
+        if 'commit' in page_df.columns:
+            pages.append(page_df)
+        elif 'author_date' in page_df.columns:
+            projected_pages.append(page_df.reindex(columns=COMMIT_COLUMNS))
+
+    chunks = [pd.concat(projected_pages, ignore_index=True)] if projected_pages else []
+    if pages:
+        chunks.append(flatten_csv_pages(pd.concat(pages, ignore_index=True)))
+
+    if not chunks:
+        return pd.DataFrame(columns=COMMIT_COLUMNS)
+
+    chunk_df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+    chunk_df['author_date'] = utils.to_epoch(chunk_df['author_date'])
+
+    return chunk_df
+
+def flatten_csv_pages(pages_df):
+    # the nested objects were saved as python literals
+    commits = pages_df['commit'].map(parse_literal)
+    authors = pages_df['author'].map(parse_literal) if 'author' in pages_df.columns else pd.Series([{}] * len(pages_df))
+    urls = pages_df['url'] if 'url' in pages_df.columns else pd.Series([None] * len(pages_df))
+
+    return pd.DataFrame({
+        'repository_id': pages_df['repository_id'].values,
+        'repository_full_name': [get_full_name(url) for url in urls],
+        'sha': pages_df['sha'].values,
+        'author_id': [author.get('id') for author in authors],
+        'author_login': [author.get('login') for author in authors],
+        'author_name': [commit.get('author', {}).get('name') for commit in commits],
+        'author_email': [commit.get('author', {}).get('email') for commit in commits],
+        'author_date': [commit.get('author', {}).get('date') for commit in commits],
+    })
+
+def parse_literal(value):
+    if not isinstance(value, str):
+        return {}
+
+    try:
+        parsed = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return {}
+
+    return parsed if isinstance(parsed, dict) else {}
+
+def get_full_name(url):
+    match = REPOSITORY_URL.search(url) if isinstance(url, str) else None
+
+    return match.group(1) if match else None
+
+def get_identity_keys(chunk_df):
+    # the account is the best identity, the email and the name are used for commits without a linked account
+    author_id = pd.to_numeric(chunk_df['author_id'], errors='coerce')
+    email = chunk_df['author_email'].astype('object').where(chunk_df['author_email'].notna(), '').astype(str).str.lower()
+    name = chunk_df['author_name'].astype('object').where(chunk_df['author_name'].notna(), '').astype(str).str.strip()
+
+    keys = np.where(email != '', 'email:' + email, np.where(name != '', 'name:' + name, ''))
+    keys = np.where(author_id.notna(), 'id:' + author_id.fillna(0).astype(np.int64).astype(str), keys)
+
+    return keys
+
+def get_valid_commits(chunk_df, identity_map=None):
+    keys = get_identity_keys(chunk_df)
+
+    # commits without author and date do not create edges
+    valid = (keys != '') & (chunk_df['author_date'].values >= 0)
+    chunk_df, keys = chunk_df[valid], keys[valid]
+
+    # the identities merged by the identity resolution become one developer
+    if identity_map is not None and len(keys):
+        keys = pd.Series(keys).map(identity_map).fillna(pd.Series(keys)).values
+
+    return chunk_df, keys
+
+class Interner:
+    # dense integer ids for the keys, in the order they are found
+    def __init__(self, keys=None):
+        self.keys = list(keys) if keys is not None else []
+        self.ids = {key: dense_id for dense_id, key in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def intern(self, values):
+        codes, uniques = pd.factorize(values)
+
+        unique_ids = np.empty(len(uniques), dtype=np.int64)
+        for position, key in enumerate(uniques):
+            dense_id = self.ids.get(key)
+            if dense_id is None:
+                dense_id = len(self.keys)
+                self.ids[key] = dense_id
+                self.keys.append(key)
+            unique_ids[position] = dense_id
+
+        return unique_ids[codes]
@@ -0,0 +1,82 @@
+import time
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+import utils_metrics as metrics
+
+# timeouts (in seconds) to open a connection and to wait for the response
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+# number of hosts with a cached pool and number of keep-alive connections per host
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 10
+
+_session = None
+
+def create_session(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+    session = requests.Session()
+
+    # block when all the connections of a host are in use instead of opening new ones
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    session.headers.update({'Accept': 'application/vnd.github.v3+json',
+                            'Accept-Encoding': 'gzip, deflate'})
+
+    return session
+
+def configure(connect_timeout=None, read_timeout=None, pool_connections=None, pool_maxsize=None):
+    global CONNECT_TIMEOUT, READ_TIMEOUT, POOL_CONNECTIONS, POOL_MAXSIZE, _session
+
+    if connect_timeout:
+        CONNECT_TIMEOUT = float(connect_timeout)
+    if read_timeout:
+        READ_TIMEOUT = float(read_timeout)
+    if pool_connections:
+        POOL_CONNECTIONS = int(pool_connections)
+    if pool_maxsize:
+        POOL_MAXSIZE = int(pool_maxsize)
+
+    # the session is recreated in the next request with the new pool sizes
+    if _session is not None:
+        _session.close()
+        _session = None
+
+def get_session():
+    global _session
+
+    if _session is None:
+        _session = create_session(POOL_CONNECTIONS, POOL_MAXSIZE)
+
+    return _session
+
+def get_headers(token, headers=None):
+    request_headers = {'Authorization': 'token %s' % token}
+
+    if headers:
+        request_headers.update(headers)
+
+    return request_headers
+
+def request(method, url, token, headers=None, timeout=None, payload=None):
+    timeout = timeout if timeout else (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+    start = time.perf_counter()
+    response = None
+    try:
+        response = get_session().request(method, url, json=payload, headers=get_headers(token, headers), timeout=timeout)
+    finally:
+        # failed connections are counted with the error status
+        metrics.observe_request(url, response, time.perf_counter() - start)
+
+    return response
+
+def get(url, token, headers=None, timeout=None):
+    return request('GET', url, token, headers, timeout)
+
+def post(url, token, payload, headers=None, timeout=None):
+    return request('POST', url, token, headers, timeout, payload)
@@ -0,0 +1,200 @@
+import os
+import json
+import shutil
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import utils as utils
+
+# typed columns of the index, one .npy file each (dates in seconds since 1970, -1 when missing)
+INDEX_COLUMNS = ['id', 'updated_at', 'created_at', 'pushed_at', 'size', 'forks_count', 'owner', 'name']
+
+# the columns read from the deduplicated file to build the index
+SOURCE_COLUMNS = ['id', 'full_name', 'updated_at', 'created_at', 'pushed_at', 'size', 'forks_count']
+
+def get_repositories_path(language):
+    return os.path.join(utils.get_main_path(), 'data', 'crawler', 'repositories', language.lower(), 'deduplicated_data')
+
+def get_index_path(language):
+    return os.path.join(get_repositories_path(language), 'repositories_index')
+
+def get_source_state(file_path):
+    # the index is built again when the deduplicated file changes
+    stat = os.stat(file_path)
+
+    return {'source': os.path.basename(file_path), 'mtime': stat.st_mtime, 'size': stat.st_size}
+
+def read_source(file_path, chunk_size):
+    chunks = []
+
+    for chunk_df in pd.read_csv(file_path, sep=',', usecols=lambda column: column in SOURCE_COLUMNS, chunksize=chunk_size):
+        chunk_df = chunk_df.reindex(columns=SOURCE_COLUMNS)
+        full_names = chunk_df['full_name'].fillna('').astype(str).str.split('/', n=1, expand=True).reindex(columns=[0, 1])
+
+        chunks.append(pd.DataFrame({
+            'id': chunk_df['id'].values.astype(np.int64),
+            'updated_at': utils.to_epoch(chunk_df['updated_at'].values),
+            'created_at': utils.to_epoch(chunk_df['created_at'].values),
+            'pushed_at': utils.to_epoch(chunk_df['pushed_at'].values),
+            'size': pd.to_numeric(chunk_df['size'], errors='coerce').fillna(0).values.astype(np.int64),
+            'forks_count': pd.to_numeric(chunk_df['forks_count'], errors='coerce').fillna(0).values.astype(np.int64),
+            'owner': full_names[0].fillna('').values,
+            'name': full_names[1].fillna('').values}))
+
+    if not chunks:
+        return pd.DataFrame(columns=INDEX_COLUMNS)
+
+    return pd.concat(chunks, ignore_index=True)
+
+def build_index(file_path, index_path, chunk_size=100000):
+    # the repositories are sorted by the updated date, the order of the commits crawling
+    source_df = read_source(file_path, chunk_size).sort_values('updated_at', kind='stable').reset_index(drop=True)
+
+    # owners and names are interned in one table of strings, saved as a blob with the offset of each string
+    codes, strings = pd.factorize(np.concatenate([source_df['owner'].values, source_df['name'].values]))
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in encoded])
+
+    arrays = {column: source_df[column].values.astype(np.int64) for column in INDEX_COLUMNS[:-2]}
+    arrays['owner'] = codes[:len(source_df)].astype(np.int32)
+    arrays['name'] = codes[len(source_df):].astype(np.int32)
+    arrays['string_offsets'] = offsets
+    arrays['strings'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+    # the arrays are written in a new folder that replaces the old index at once
+    temporary_path = f'{index_path}_{os.getpid()}.tmp'
+    os.makedirs(temporary_path, exist_ok=True)
+
+    for name, values in arrays.items():
+        np.save(os.path.join(temporary_path, f'{name}.npy'), values)
+
+    with open(os.path.join(temporary_path, 'index.json'), mode='w') as w:
+        json.dump({'repositories': len(source_df), 'strings': len(encoded), 'built_at': str(datetime.now()),
+                   **get_source_state(file_path)}, w, indent=2)
+    w.close()
+
+    if os.path.exists(index_path):
+        old_path = f'{index_path}_{os.getpid()}.old'
+        os.replace(index_path, old_path)
+        os.replace(temporary_path, index_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    else:
+        os.replace(temporary_path, index_path)
+
+    return len(source_df)
+
+def is_updated(index_path, file_path):
+    metadata_path = os.path.join(index_path, 'index.json')
+    if not os.path.exists(metadata_path):
+        return False
+
+    with open(metadata_path, mode='r') as r:
+        metadata = json.load(r)
+    r.close()
+
+    state = get_source_state(file_path)
+
+    return metadata.get('mtime') == state['mtime'] and metadata.get('size') == state['size']
+
+def load_index(language):
+    # the index is built from the deduplicated file when it is missing or older than the file
+    index_path = get_index_path(language)
+    file_path = os.path.join(get_repositories_path(language), 'complete_repositories.csv')
+
+    if os.path.exists(file_path) and not is_updated(index_path, file_path):
+        print('Building the repository index from', file_path)
+        build_index(file_path, index_path)
+
+    return RepositoryIndex(index_path)
+
+class RepositoryIndex:
+    # memory mapped arrays of the deduplicated repositories, the pages are read only when they are used
+    def __init__(self, index_path):
+        self.index_path = index_path
+
+        for name in INDEX_COLUMNS + ['string_offsets', 'strings']:
+            setattr(self, name, np.load(os.path.join(index_path, f'{name}.npy'), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.id)
+
+    def get_string(self, code):
+        start, end = self.string_offsets[code], self.string_offsets[code + 1]
+
+        return bytes(self.strings[start:end]).decode('utf-8')
+
+    def get_full_name(self, position):
+        return f'{self.get_string(self.owner[position])}/{self.get_string(self.name[position])}'
+
+    def get_row(self, position, api_url):
+        # the same fields of the rows of the deduplicated file used by the commits crawling
+        full_name = self.get_full_name(position)
+        updated_at = int(self.updated_at[position])
+
+        return {'id': int(self.id[position]),
+                'full_name': full_name,
+                'updated_at': format_epoch(updated_at) if updated_at >= 0 else None,
+                'new_commits_url': f'{api_url}/repos/{full_name}/commits'}
+
+    def select(self, ids=None, exclude=None):
+        # positions in the order of the index, the order of the updated dates
+        positions = np.arange(len(self), dtype=np.int64)
+
+        if ids is not None:
+            positions = positions[np.isin(self.id, np.asarray(ids, dtype=np.int64))]
+        if exclude:
+            positions = positions[~np.isin(self.id[positions], np.fromiter(exclude, dtype=np.int64))]
+
+        return positions
+
+class RepositoryQueue:
+    # repositories waiting to be crawled, each row is created when it leaves the queue
+    def __init__(self, repositories_index, positions, api_url):
+        self.repositories_index = repositories_index
+        self.positions = positions
+        self.api_url = api_url
+        self.next_position = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.positions) - self.next_position
+
+    def popleft(self):
+        with self.lock:
+            if self.next_position >= len(self.positions):
+                raise IndexError('pop from an empty queue')
+
+            position = self.positions[self.next_position]
+            self.next_position += 1
+
+        return self.repositories_index.get_row(position, self.api_url)
+
+def format_epoch(seconds):
+    # the dates of the API, as in the deduplicated file
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def get_partition_path(language, partition):
+    return os.path.join(get_repositories_path(language), 'partitions', f'repositories_part_{partition}.npy')
+
+def save_partition(language, partition, ids):
+    partition_path = get_partition_path(language, partition)
+    os.makedirs(os.path.dirname(partition_path), exist_ok=True)
+
+    np.save(partition_path, np.asarray(ids, dtype=np.int64))
+
+    return partition_path
+
+def load_partition(language, partition):
+    # the partitions keep the ids, so they are still valid when the index is built again
+    partition_path = get_partition_path(language, partition)
+    if os.path.exists(partition_path):
+        return np.load(partition_path)
+
+    # partitions saved as csv files by older versions of the division
+    file_path = os.path.join(get_repositories_path(language), 'partitions', f'complete_repositories_part_{partition}.csv')
+
+    return pd.read_csv(file_path, sep=',', usecols=['id'])['id'].values.astype(np.int64)
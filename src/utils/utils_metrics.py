@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import prometheus_client as prometheus
+
+import utils as utils
+
+# seconds between the summaries, also the period of the throughput report
+INTERVAL = 60
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+WRITE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+REQUESTS = prometheus.Counter('crawler_requests', 'Requests to the API by endpoint and status', ['endpoint', 'status'])
+REQUEST_SECONDS = prometheus.Histogram('crawler_request_seconds', 'Time waiting for the responses of the API',
+                                       ['endpoint'], buckets=LATENCY_BUCKETS)
+RESPONSE_BYTES = prometheus.Counter('crawler_response_bytes', 'Bytes of the bodies received from the API', ['endpoint'])
+RATE_LIMITED = prometheus.Counter('crawler_rate_limited', 'Responses refused by an exhausted budget', ['resource'])
+RATE_LIMIT_SLEEP = prometheus.Counter('crawler_rate_limit_sleep_seconds', 'Time sleeping until the budget is reset',
+                                      ['resource'])
+RETRIES = prometheus.Counter('crawler_retries', 'Requests sent again after a failure', ['resource', 'kind'])
+RETRY_SLEEP = prometheus.Counter('crawler_retry_sleep_seconds', 'Time waiting before the retries', ['resource'])
+FAILURES = prometheus.Counter('crawler_failures', 'Requests given up', ['resource', 'kind'])
+PAGES_WRITTEN = prometheus.Counter('crawler_pages_written', 'Pages of results given to the sinks', ['sink'])
+ITEMS_WRITTEN = prometheus.Counter('crawler_items_written', 'Items of the pages given to the sinks', ['sink'])
+WRITE_SECONDS = prometheus.Histogram('crawler_write_seconds', 'Time writing the results on disk', ['sink', 'operation'],
+                                     buckets=WRITE_BUCKETS)
+QUEUE_DEPTH = prometheus.Gauge('crawler_queue_depth', 'Work waiting in the queues of the crawling', ['queue'])
+STAGE_SECONDS = prometheus.Histogram('crawler_stage_seconds', 'Time of the stages of the crawling', ['stage'],
+                                     buckets=LATENCY_BUCKETS)
+
+_reporter = None
+
+def get_endpoint(url):
+    # few labels, so the number of series does not grow with the crawled repositories
+    path = urlsplit(url).path.rstrip('/')
+
+    if path.startswith('/search/'):
+        return 'search'
+    if path.startswith('/repos/') and path.endswith('/commits'):
+        return 'commits'
+    if path.endswith('/rate_limit'):
+        return 'rate_limit'
+    if path.endswith('/graphql'):
+        return 'graphql'
+
+    return 'other'
+
+def observe_request(url, response, seconds):
+    endpoint = get_endpoint(url)
+
+    REQUESTS.labels(endpoint, str(response.status_code) if response is not None else 'error').inc()
+    REQUEST_SECONDS.labels(endpoint).observe(seconds)
+
+    if response is not None:
+        RESPONSE_BYTES.labels(endpoint).inc(len(response.content))
+
+def observe_rate_limited(resource):
+    RATE_LIMITED.labels(resource).inc()
+
+def observe_sleep(resource, seconds):
+    RATE_LIMIT_SLEEP.labels(resource).inc(seconds)
+
+def observe_retry(resource, kind, seconds):
+    RETRIES.labels(resource, kind).inc()
+    RETRY_SLEEP.labels(resource).inc(seconds)
+
+def observe_failure(resource, kind):
+    FAILURES.labels(resource, kind).inc()
+
+def observe_page(sink, items):
+    PAGES_WRITTEN.labels(sink).inc()
+    ITEMS_WRITTEN.labels(sink).inc(items)
+
+@contextlib.contextmanager
+def track_write(sink, operation):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        WRITE_SECONDS.labels(sink, operation).observe(time.perf_counter() - start)
+
+@contextlib.contextmanager
+def track_stage(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+def track_queue(queue, function):
+    # the depth is read when the metrics are collected
+    QUEUE_DEPTH.labels(queue).set_function(function)
+
+def get_samples(metric):
+    samples = {}
+
+    for family in metric.collect():
+        for sample in family.samples:
+            samples[(sample.name, tuple(sorted(sample.labels.items())))] = sample.value
+
+    return samples
+
+def sum_samples(samples, suffix, key=None):
+    # totals of the samples of a metric, by one of its labels
+    totals = {}
+
+    for (name, labels), value in samples.items():
+        if not name.endswith(suffix):
+            continue
+
+        labels = dict(labels)
+        label = labels.get(key, 'total') if key else 'total'
+        totals[label] = totals.get(label, 0) + value
+
+    return totals
+
+def get_summary():
+    requests = get_samples(REQUESTS)
+    request_seconds = get_samples(REQUEST_SECONDS)
+    write_seconds = get_samples(WRITE_SECONDS)
+
+    by_status = {}
+    for (name, labels), value in requests.items():
+        if name.endswith('_total'):
+            labels = dict(labels)
+            by_status.setdefault(labels['endpoint'], {})[labels['status']] = int(value)
+
+    latency = {}
+    counts = sum_samples(request_seconds, '_count', 'endpoint')
+    for endpoint, total in sum_samples(request_seconds, '_sum', 'endpoint').items():
+        latency[endpoint] = {'requests': int(counts.get(endpoint, 0)), 'seconds': round(total, 3),
+                             'mean_seconds': round(total / counts[endpoint], 4) if counts.get(endpoint) else 0}
+
+    writes = {}
+    write_counts = sum_samples(write_seconds, '_count', 'operation')
+    for operation, total in sum_samples(write_seconds, '_sum', 'operation').items():
+        writes[operation] = {'writes': int(write_counts.get(operation, 0)), 'seconds': round(total, 3)}
+
+    stages = {stage: round(total, 3) for stage, total in sum_samples(get_samples(STAGE_SECONDS), '_sum', 'stage').items()}
+
+    return {'requests': by_status,
+            'latency': latency,
+            'response_bytes': {endpoint: int(total) for endpoint, total
+                               in sum_samples(get_samples(RESPONSE_BYTES), '_total', 'endpoint').items()},
+            'rate_limited': {resource: int(total) for resource, total
+                             in sum_samples(get_samples(RATE_LIMITED), '_total', 'resource').items()},
+            'rate_limit_sleep_seconds': {resource: round(total, 3) for resource, total
+                                         in sum_samples(get_samples(RATE_LIMIT_SLEEP), '_total', 'resource').items()},
+            'retries': {kind: int(total) for kind, total
+                        in sum_samples(get_samples(RETRIES), '_total', 'kind').items()},
+            'retry_sleep_seconds': {resource: round(total, 3) for resource, total
+                                    in sum_samples(get_samples(RETRY_SLEEP), '_total', 'resource').items()},
+            'failures': {kind: int(total) for kind, total
+                         in sum_samples(get_samples(FAILURES), '_total', 'kind').items()},
+            'pages_written': {sink: int(total) for sink, total
+                              in sum_samples(get_samples(PAGES_WRITTEN), '_total', 'sink').items()},
+            'items_written': {sink: int(total) for sink, total
+                              in sum_samples(get_samples(ITEMS_WRITTEN), '_total', 'sink').items()},
+            'writes': writes,
+            'stages_seconds': stages,
+            'queue_depth': {queue: int(total) for queue, total
+                            in sum_samples(get_samples(QUEUE_DEPTH), '', 'queue').items()}}
+
+def get_totals(summary):
+    # the time of the requests is summed over the threads, so it can be larger than the elapsed time
+    return {'requests': sum(sum(statuses.values()) for statuses in summary['requests'].values()),
+            'pages': sum(summary['pages_written'].values()),
+            'network_seconds': sum(latency['seconds'] for latency in summary['latency'].values()),
+            'sleep_seconds': sum(summary['rate_limit_sleep_seconds'].values()),
+            'retry_seconds': sum(summary['retry_sleep_seconds'].values()),
+            'write_seconds': sum(write['seconds'] for write in summary['writes'].values())}
+
+class Reporter:
+    # writes the summary and prints the throughput of the last interval, in a background thread
+    def __init__(self, name, summary_path, interval):
+        self.name = name
+        self.summary_path = summary_path
+        self.interval = interval
+        self.started_at = time.time()
+        self.stopped = threading.Event()
+
+        self.last_time = self.started_at
+        self.last_totals = get_totals(get_summary())
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def report(self, final=False):
+        now = time.time()
+        summary = get_summary()
+        totals = get_totals(summary)
+
+        seconds = max(now - self.last_time, 1e-9)
+        changes = {key: totals[key] - self.last_totals[key] for key in totals}
+
+        print(f"\n[metrics] {changes['requests'] / seconds:.1f} req/s - {changes['pages'] / seconds:.1f} pages/s - "
+              f"network {changes['network_seconds']:.1f}s - rate limit sleep {changes['sleep_seconds']:.1f}s - "
+              f"retries {changes['retry_seconds']:.1f}s - "
+              f"sinks {changes['write_seconds']:.1f}s in the last {seconds:.0f}s\n")
+
+        self.last_time, self.last_totals = now, totals
+
+        if self.summary_path:
+            save_summary(self.summary_path, {'name': self.name, 'date': str(datetime.now()), 'final': final,
+                                             'elapsed_seconds': round(now - self.started_at, 3), 'totals': totals,
+                                             **summary})
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.report(final=True)
+
+def save_summary(summary_path, summary):
+    # the summary is replaced at once, so a reader never sees a partial file
+    with open(summary_path + '.tmp', mode='w') as w:
+        json.dump(summary, w, indent=2)
+    w.close()
+
+    os.replace(summary_path + '.tmp', summary_path)
+
+def get_summary_path(name, language):
+    metrics_path = os.path.join(utils.get_main_path(), 'data', 'crawler', 'metrics')
+    os.makedirs(metrics_path, exist_ok=True)
+
+    return os.path.join(metrics_path, f'{name}_{language.lower()}.json')
+
+def start(name, language, port=None, summary=False, interval=None):
+    global _reporter
+
+    # the text format of Prometheus on http://127.0.0.1:<port>/metrics
+    if port:
+        prometheus.start_http_server(int(port), addr='127.0.0.1')
+        print(f'Metrics exported on http://127.0.0.1:{int(port)}/metrics\n')
+
+    if summary:
+        summary_path = get_summary_path(name, language)
+        _reporter = Reporter(name, summary_path, float(interval) if interval else INTERVAL)
+        print(f'Metrics summary saved on {summary_path}\n')
+
+def stop():
+    global _reporter
+
+    if _reporter is not None:
+        _reporter.stop()
+        _reporter = None
@@ -0,0 +1,139 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import scipy.sparse as sparse
+
+import utils_commits as commits
+
+BIPARTITE_FOLDER = 'bipartite'
+DEVELOPERS_FILE = 'developers.csv'
+REPOSITORIES_FILE = 'repositories.csv'
+
+def get_bipartite_path(language):
+    return os.path.join(commits.get_processed_path(language), BIPARTITE_FOLDER)
+
+def to_csr(rows, columns, shape, values):
+    # the edges sorted by row and column are the csr arrays, with every value in the same order
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+
+    return indptr, columns[order], {name: array[order] for name, array in values.items()}
+
+def save_bipartite(language, indptr, indices, shape, edge_values, developers_df, repositories_df):
+    processed_path = commits.get_processed_path(language)
+    bipartite_path = get_bipartite_path(language)
+    os.makedirs(bipartite_path, exist_ok=True)
+
+    # one .npy file for each array, the indexes in the type used by scipy so the matrix keeps the mapped arrays
+    index_type = np.int32 if max(len(indices), *shape) <= np.iinfo(np.int32).max else np.int64
+    arrays = {'indptr': indptr.astype(index_type), 'indices': indices.astype(index_type), 'shape': np.array(shape),
+              **edge_values}
+
+    for name, values in arrays.items():
+        np.save(os.path.join(bipartite_path, f'{name}.npy'), values)
+
+    developers_df.to_csv(os.path.join(processed_path, DEVELOPERS_FILE), index=False)
+    repositories_df.to_csv(os.path.join(processed_path, REPOSITORIES_FILE), index=False)
+
+def load_bipartite(language, weight='commits'):
+    # developer x repository matrix with the commits (or another edge value) as weights
+    # the arrays are memory mapped, the pages are read only when they are used
+    bipartite_path = get_bipartite_path(language)
+    arrays = {file_name[:-4]: np.load(os.path.join(bipartite_path, file_name), mmap_mode='r')
+              for file_name in os.listdir(bipartite_path) if file_name.endswith('.npy')}
+    shape = tuple(int(size) for size in arrays['shape'])
+
+    matrix = sparse.csr_matrix((arrays[weight], arrays['indices'], arrays['indptr']), shape=shape)
+    edge_values = {name: values for name, values in arrays.items() if name not in ['indptr', 'indices', 'shape']}
+
+    return matrix, edge_values
+
+def load_developers(language):
+    return pd.read_csv(os.path.join(commits.get_processed_path(language), DEVELOPERS_FILE))
+
+def load_repositories(language):
+    return pd.read_csv(os.path.join(commits.get_processed_path(language), REPOSITORIES_FILE))
+
+def get_projection_path(language, mode, extension='parquet'):
+    return os.path.join(commits.get_processed_path(language), f'{mode}_projection.{extension}')
+
+def load_projection(language, mode):
+    # symmetric weighted adjacency matrix of the edge list saved by the projection
+    nodes = len(load_developers(language)) if mode == 'developers' else len(load_repositories(language))
+    edges = pq.read_table(get_projection_path(language, mode)).to_pandas()
+
+    sources = edges['source'].values
+    targets = edges['target'].values
+    weights = edges['weight'].values
+
+    matrix = sparse.csr_matrix((np.r_[weights, weights], (np.r_[sources, targets], np.r_[targets, sources])),
+                               shape=(nodes, nodes))
+    matrix.sum_duplicates()
+
+    return matrix
+
+def get_row_blocks(row_entries, block_entries):
+    # consecutive rows are grouped until the block can have more entries than the limit
+    block_ids = np.floor(np.cumsum(row_entries) / block_entries).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, block_ids[1:] != block_ids[:-1]])
+
+    return list(zip(starts.tolist(), np.r_[starts[1:], len(row_entries)].tolist()))
+
+class UnionFind:
+    # the unions are done for arrays of pairs at a time, hooking the larger root to the smaller one
+    def __init__(self, size):
+        self.parent = np.arange(size, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def grow(self, size):
+        # new elements start in their own sets
+        if size > len(self.parent):
+            self.parent = np.r_[self.parent, np.arange(len(self.parent), size, dtype=np.int64)]
+
+    def compress(self):
+        while True:
+            grandparent = self.parent[self.parent]
+            if np.array_equal(grandparent, self.parent):
+                return self.parent
+            self.parent = grandparent
+
+    def find(self, elements):
+        self.compress()
+
+        return self.parent[elements]
+
+    def union(self, sources, targets):
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+
+        while len(sources):
+            source_roots = self.find(sources)
+            target_roots = self.find(targets)
+
+            # only the pairs still in different sets need another hook
+            different = source_roots != target_roots
+            if not different.any():
+                break
+
+            sources, targets = sources[different], targets[different]
+            low = np.minimum(source_roots[different], target_roots[different])
+            high = np.maximum(source_roots[different], target_roots[different])
+
+            np.minimum.at(self.parent, high, low)
+
+    def assign(self, elements, roots):
+        # whole sets of elements are divided again, each element is hooked to its new root
+        self.compress()
+        self.parent[elements] = roots
+
+    def components(self):
+        # dense component number of each element and the size of each component
+        roots = self.compress()
+        unique_roots, labels, sizes = np.unique(roots, return_inverse=True, return_counts=True)
+
+        return labels, sizes
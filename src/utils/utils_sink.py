@@ -0,0 +1,357 @@
+import os
+import csv
+import json
+import threading
+
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import utils_metrics as metrics
+
+# columns kept from the API items: (column name, path in the JSON item, type)
+COMMITS_SCHEMA = [
+    ('sha', ('sha',), 'string'),
+    ('author_id', ('author', 'id'), 'int64'),
+    ('author_login', ('author', 'login'), 'string'),
+    ('author_name', ('commit', 'author', 'name'), 'string'),
+    ('author_email', ('commit', 'author', 'email'), 'string'),
+    ('author_date', ('commit', 'author', 'date'), 'timestamp'),
+    ('committer_id', ('committer', 'id'), 'int64'),
+    ('committer_login', ('committer', 'login'), 'string'),
+    ('committer_name', ('commit', 'committer', 'name'), 'string'),
+    ('committer_email', ('commit', 'committer', 'email'), 'string'),
+    ('committer_date', ('commit', 'committer', 'date'), 'timestamp'),
+]
+
+# columns of the crawling added to each commit
+COMMITS_CONTEXT = [
+    ('repository_id', 'int64'),
+    ('repository_full_name', 'string'),
+    ('page', 'int64'),
+]
+
+REPOSITORIES_SCHEMA = [
+    ('id', ('id',), 'int64'),
+    ('full_name', ('full_name',), 'string'),
+    ('name', ('name',), 'string'),
+    ('owner_id', ('owner', 'id'), 'int64'),
+    ('owner_login', ('owner', 'login'), 'string'),
+    ('owner_type', ('owner', 'type'), 'string'),
+    ('fork', ('fork',), 'bool'),
+    ('archived', ('archived',), 'bool'),
+    ('created_at', ('created_at',), 'timestamp'),
+    ('updated_at', ('updated_at',), 'timestamp'),
+    ('pushed_at', ('pushed_at',), 'timestamp'),
+    ('size', ('size',), 'int64'),
+    ('stargazers_count', ('stargazers_count',), 'int64'),
+    ('watchers_count', ('watchers_count',), 'int64'),
+    ('forks_count', ('forks_count',), 'int64'),
+    ('open_issues_count', ('open_issues_count',), 'int64'),
+    ('language', ('language',), 'string'),
+    ('default_branch', ('default_branch',), 'string'),
+    ('license', ('license', 'spdx_id'), 'string'),
+    ('commits_url', ('commits_url',), 'string'),
+]
+
+REPOSITORIES_CONTEXT = []
+
+# seconds between the checks of the age of the buffered rows when no page arrives
+AGE_CHECK_SECONDS = 60
+
+# columns read by the next stages (deduplication, division, commits crawler and network analysis),
+# a field selection cannot leave them out
+REPOSITORIES_REQUIRED = ['id', 'full_name', 'created_at', 'updated_at', 'pushed_at', 'commits_url']
+COMMITS_REQUIRED = ['sha', 'author_id', 'author_login', 'author_name', 'author_email', 'author_date']
+
+ARROW_TYPES = {'string': pa.string(),
+               'int64': pa.int64(),
+               'bool': pa.bool_(),
+               'timestamp': pa.timestamp('s', tz='UTC')}
+
+def get_arrow_schema(schema, context):
+    fields = [pa.field(name, ARROW_TYPES[type_name]) for name, path, type_name in schema]
+    fields += [pa.field(name, ARROW_TYPES[type_name]) for name, type_name in context]
+
+    return pa.schema(fields)
+
+def select_fields(schema, fields, required=()):
+    # fields are comma separated columns of the schema or a json file with the columns of the selection
+    if fields.endswith('.json'):
+        selection = load_fields(fields)
+    else:
+        selection = [field.strip() for field in fields.split(',') if field.strip()]
+
+    columns = {name: (name, path, type_name) for name, path, type_name in schema}
+    selected_schema = []
+
+    for field in selection:
+        if isinstance(field, str):
+            if field not in columns:
+                raise ValueError(f'Unknown field {field} (fields of the schema: {", ".join(columns)})')
+            selected_schema.append(columns[field])
+        else:
+            selected_schema.append(field)
+
+    missing = [name for name in required if name not in [column[0] for column in selected_schema]]
+    if missing:
+        raise ValueError(f'The fields {", ".join(missing)} are used by the next stages and cannot be left out')
+
+    return selected_schema
+
+def load_fields(file_path):
+    # a list of columns of the schema or of objects with the name, the dotted path and the type of new columns
+    with open(file_path, mode='r') as r:
+        fields = json.load(r)
+    r.close()
+
+    selection = []
+    for field in fields:
+        if isinstance(field, str):
+            selection.append(field)
+            continue
+
+        if field.get('type') not in ARROW_TYPES or not field.get('name') or not field.get('path'):
+            raise ValueError(f'Invalid field {field} (the types are {", ".join(ARROW_TYPES)})')
+        selection.append((field['name'], tuple(field['path'].split('.')), field['type']))
+
+    return selection
+
+def get_value(item, path):
+    for key in path:
+        if not isinstance(item, dict):
+            return None
+        item = item.get(key)
+
+    return item
+
+def get_columns(items, schema):
+    columns = []
+
+    for name, path, type_name in schema:
+        if len(path) == 1:
+            # most fields are on the first level of the items
+            key = path[0]
+            columns.append([item.get(key) for item in items])
+        else:
+            columns.append([get_value(item, path) for item in items])
+
+    return columns
+
+def flatten_items(items, schema, context, context_values=None):
+    context_values = context_values if context_values else {}
+    arrays = []
+
+    for (name, path, type_name), values in zip(schema, get_columns(items, schema)):
+        arrays.append(to_arrow_array(values, type_name))
+
+    for name, type_name in context:
+        arrays.append(to_arrow_array([context_values.get(name)] * len(items), type_name))
+
+    return pa.Table.from_arrays(arrays, schema=get_arrow_schema(schema, context))
+
+def project_items(items, schema, context, context_values=None):
+    # rows with the selected fields as they come from the API, the dates are kept as the ISO strings
+    context_values = context_values if context_values else {}
+
+    columns = get_columns(items, schema)
+    columns += [[context_values.get(name)] * len(items) for name, type_name in context]
+
+    return zip(*columns)
+
+def to_arrow_array(values, type_name):
+    if type_name == 'timestamp':
+        # the API dates are ISO 8601 strings in UTC, parsed by arrow unless some have fractions of seconds
+        try:
+            return pa.array(values, type=pa.string()).cast(ARROW_TYPES[type_name])
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            values = pd.to_datetime(pd.Series(values, dtype='object'), utc=True).dt.floor('s')
+            return pa.Array.from_pandas(values, type=ARROW_TYPES[type_name])
+
+    return pa.array(values, type=ARROW_TYPES[type_name])
+
+class CsvSink:
+    # one csv file per page, saved as soon as the page arrives
+    def __init__(self, schema=None, context=None):
+        # without a field selection the pages keep all the fields of the API
+        self.schema = schema
+        self.context = context if context else []
+
+    def write(self, items, file_name, context_values=None):
+        with metrics.track_write('csv', 'page'):
+            if self.schema is None:
+                pd.DataFrame(items).to_csv(file_name, sep=',', index=False)
+            else:
+                self.write_projection(items, file_name, context_values)
+
+        metrics.observe_page('csv', len(items))
+
+    def write_projection(self, items, file_name, context_values):
+        with open(file_name, mode='w', newline='') as w:
+            csv_file = csv.writer(w, delimiter=',')
+            csv_file.writerow([name for name, path, type_name in self.schema] + [name for name, type_name in self.context])
+            csv_file.writerows(project_items(items, self.schema, self.context, context_values))
+        w.close()
+
+    def when_saved(self, callback):
+        callback()
+
+    def close(self):
+        pass
+
+class ParquetSink:
+    # pages are buffered and appended as row groups to parquet shards of bounded size
+    def __init__(self, folder, prefix, schema, context, row_group_rows=50000, max_file_mb=128, max_shard_minutes=10,
+                 compression='zstd'):
+        self.folder = folder
+        self.prefix = prefix
+        self.schema = schema
+        self.context = context
+        self.arrow_schema = get_arrow_schema(schema, context)
+        self.row_group_rows = row_group_rows
+        self.max_file_bytes = max_file_mb * 1024 * 1024
+        self.max_shard_seconds = max_shard_minutes * 60
+        self.compression = compression
+
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.buffered_rows = 0
+        self.writer = None
+        self.shard_path = None
+        self.shard_number = 0
+        self.shard_opened_at = None
+        self.first_row_at = None
+        self.callbacks = []
+
+        metrics.track_queue('sink_buffer', lambda: self.buffered_rows)
+
+        # the age is also checked while the crawler waits, as in the sleeps until the reset of the rate limit
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, items, file_name=None, context_values=None):
+        with metrics.track_write('parquet', 'flatten'):
+            table = flatten_items(items, self.schema, self.context, context_values)
+
+        metrics.observe_page('parquet', len(items))
+
+        with self.lock:
+            self.buffer.append(table)
+            self.buffered_rows += table.num_rows
+            self.first_row_at = self.first_row_at if self.first_row_at else datetime.now()
+
+            if self.buffered_rows >= self.row_group_rows:
+                self.write_row_group()
+
+            self.rotate_if_old()
+
+    def run(self):
+        while not self.stopped.wait(min(AGE_CHECK_SECONDS, self.max_shard_seconds)):
+            with self.lock:
+                self.rotate_if_old()
+
+    def rotate_if_old(self):
+        # the rows are saved after some minutes even in a slow crawling, so a crash loses only the recent pages
+        if self.first_row_at and (datetime.now() - self.first_row_at).total_seconds() >= self.max_shard_seconds:
+            self.write_row_group()
+            self.close_shard()
+
+    def when_saved(self, callback):
+        # the callback runs when every row written before it is in a closed shard
+        with self.lock:
+            if self.writer is None and not self.buffer:
+                callback()
+            else:
+                self.callbacks.append(callback)
+
+    def write_row_group(self):
+        if not self.buffer:
+            return
+
+        if self.writer is None:
+            self.open_shard()
+
+        with metrics.track_write('parquet', 'row_group'):
+            self.writer.write_table(pa.concat_tables(self.buffer))
+        self.buffer = []
+        self.buffered_rows = 0
+
+        if os.path.getsize(self.shard_path + '.tmp') >= self.max_file_bytes:
+            self.close_shard()
+
+    def open_shard(self):
+        self.shard_number += 1
+        self.shard_opened_at = datetime.now()
+        timestamp = self.shard_opened_at.strftime('%Y%m%d%H%M%S')
+        self.shard_path = os.path.join(self.folder, f'{self.prefix}_{timestamp}_{self.shard_number:05d}.parquet')
+
+        # the shard has the final name only when the footer is written
+        self.writer = pq.ParquetWriter(self.shard_path + '.tmp', self.arrow_schema, compression=self.compression)
+
+    def close_shard(self):
+        if self.writer is not None:
+            with metrics.track_write('parquet', 'close_shard'):
+                self.writer.close()
+                os.replace(self.shard_path + '.tmp', self.shard_path)
+            self.writer = None
+
+            print(f'Shard saved on {self.shard_path}')
+
+        self.first_row_at = None
+
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+        with self.lock:
+            self.write_row_group()
+            self.close_shard()
+
+def read_file(file_path, columns=None):
+    chunks = list(iter_file_chunks(file_path, columns))
+
+    if not chunks:
+        return None
+
+    return pd.concat(chunks, ignore_index=True)
+
+def iter_file_chunks(file_path, columns=None, chunk_size=100000):
+    if file_path.endswith('.csv'):
+        for chunk_df in pd.read_csv(file_path, sep=',', usecols=columns, chunksize=chunk_size):
+            yield chunk_df
+    elif file_path.endswith('.parquet'):
+        # each row group of the shards is a bounded chunk
+        parquet_file = pq.ParquetFile(file_path)
+        for row_group in range(parquet_file.num_row_groups):
+            yield format_dates(parquet_file.read_row_group(row_group, columns=columns).to_pandas())
+
+def get_file_columns(file_path):
+    if file_path.endswith('.csv'):
+        return pd.read_csv(file_path, sep=',', nrows=0).columns.tolist()
+
+    return pq.ParquetFile(file_path).schema.names
+
+def format_dates(file_df):
+    # dates are returned in the same format of the API, as in the csv files
+    for column in file_df.select_dtypes(include=['datetimetz', 'datetime']).columns:
+        file_df[column] = file_df[column].dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    return file_df
+
+def is_data_file(file_name):
+    # shards still being written have the .tmp extension
+    return file_name.endswith('.csv') or file_name.endswith('.parquet')
+
+def open_sink(output, folder, prefix, schema, context, max_file_mb=128, projection=None):
+    # a field selection replaces the schema of the shards and also projects the csv pages
+    if output == 'parquet':
+        return ParquetSink(folder, prefix, projection if projection else schema, context, max_file_mb=max_file_mb)
+
+    return CsvSink(projection, context) if projection else CsvSink()
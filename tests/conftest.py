@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+# the scripts import the modules of their folders, as when they run from src
+SRC_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+for folder in ['utils', 'crawler_api', 'network_analysis', 'benchmark']:
+    sys.path.insert(0, os.path.join(SRC_PATH, folder))
+
+import mock_github
+import utils_api as api
+
+# budgets large enough to never wait for a reset in the tests
+TEST_QUOTAS = {'core': (100000, 3600), 'search': (100000, 60), 'graphql': (100000, 3600)}
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    # the data folder is found before the src folder of the working directory
+    crawler_path = tmp_path / 'src' / 'crawler_api'
+    crawler_path.mkdir(parents=True)
+    monkeypatch.chdir(crawler_path)
+
+    return tmp_path
+
+@pytest.fixture
+def mock_server(monkeypatch):
+    servers = []
+
+    def start(repositories=500, start_date='2019-12-01', end_date='2019-12-31', max_commits=5000):
+        data = mock_github.MockData('python', repositories, start_date, end_date, max_commits=max_commits)
+        mock = mock_github.MockGitHub(data, TEST_QUOTAS)
+        servers.append(mock_github.serve(mock))
+        monkeypatch.setattr(api, 'API_URL', mock.base_url)
+
+        return mock
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
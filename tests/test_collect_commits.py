@@ -0,0 +1,68 @@
+import collections
+import os
+
+import numpy as np
+
+import collect_commits
+import utils_checkpoint as cp
+import utils_sink as sink
+
+END_DATE = '2030-01-01'
+
+def get_row(mock, position):
+    full_name = mock.data.names[position]
+
+    return {'id': int(mock.data.ids[position]), 'full_name': full_name, 'updated_at': None,
+            'new_commits_url': f'{mock.base_url}/repos/{full_name}/commits'}
+
+def get_crawling(workspace, token):
+    crawler_path = os.path.join(workspace, 'data', 'crawler', 'commits', 'python', 'crawler_files')
+    os.makedirs(crawler_path, exist_ok=True)
+
+    return {'tokens': [token], 'checkpoint': cp.open_checkpoint('python'),
+            'sink': sink.CsvSink(sink.COMMITS_SCHEMA, sink.COMMITS_CONTEXT), 'crawler_path': crawler_path,
+            'language': 'python', 'end_date': END_DATE, 'partition': None, 'token_key': 'test',
+            'high_water_marks': None, 'resume_state': {}, 'failed': set()}
+
+def get_saved_pages(crawling, row):
+    prefix = f"{row['id']}_"
+
+    return sorted(int(file_name.rsplit('_', 1)[1][:-len('.csv')]) for file_name in os.listdir(crawling['crawler_path'])
+                  if file_name.startswith(prefix))
+
+def test_get_missing_pages():
+    assert collect_commits.get_missing_pages(5, {1, 3}) == [2, 4, 5]
+    assert collect_commits.get_missing_pages(3, {1, 2, 3}) == []
+
+def test_resume_out_of_order_pages(workspace, mock_server):
+    mock = mock_server(repositories=300)
+
+    # a repository with several pages of commits
+    positions = np.flatnonzero((mock.data.commits > 400) & (mock.data.commits <= 1000) & ~mock.data.not_found)
+    row = get_row(mock, positions[0])
+    last_page = (int(mock.data.commits[positions[0]]) + 99) // 100
+
+    crawling = get_crawling(workspace, 'resume-token')
+    base_query, high_water_mark = collect_commits.get_base_query(row, crawling)
+
+    # a concurrent crawling interrupted after saving the pages 1 and 3, but not the page 2
+    for page in [1, 3]:
+        collect_commits.crawl_repository_page(crawling, row, base_query, page, high_water_mark)
+
+    crawling['resume_state'] = cp.get_unfinished_repositories(crawling['checkpoint'], END_DATE)
+    assert crawling['resume_state'][row['id']]['done_pages'] == {1, 3}
+    assert crawling['resume_state'][row['id']]['last_page'] == last_page
+
+    # the pages already saved are not written again
+    saved_paths = [collect_commits.get_file_crawler_path(crawling['crawler_path'], row, page, END_DATE) for page in [1, 3]]
+    for file_path in saved_paths:
+        os.utime(file_path, (1000, 1000))
+
+    collect_commits.crawl_repositories(collections.deque([row]), crawling)
+
+    # only the missing pages are requested, including the one before the last saved page
+    assert get_saved_pages(crawling, row) == list(range(1, last_page + 1))
+    assert [os.stat(file_path).st_mtime for file_path in saved_paths] == [1000, 1000]
+    assert row['id'] in cp.get_finished_repositories(crawling['checkpoint'], END_DATE)
+
+    crawling['checkpoint'].close()
@@ -0,0 +1,58 @@
+from urllib.parse import urlsplit, parse_qs
+
+import collect_repositories
+import mock_github
+
+def get_mock_count(mock, bucket):
+    query = collect_repositories.get_bucket_query('python', bucket)
+    q = parse_qs(urlsplit(query).query)['q'][0]
+
+    return len(mock.data.search(mock_github.parse_search_query(q)))
+
+def test_plan_buckets_counts(mock_server, monkeypatch):
+    mock = mock_server(repositories=6000)
+
+    # the buckets planned and the probes sent to the search
+    calls = []
+    probes = []
+    plan_buckets = collect_repositories.plan_buckets
+    get_total_count = collect_repositories.get_total_count
+
+    def record_plan(token, language, bucket, total_count=None):
+        calls.append((bucket, total_count))
+        return plan_buckets(token, language, bucket, total_count)
+
+    def record_probe(token, query):
+        probes.append(query)
+        return get_total_count(token, query)
+
+    monkeypatch.setattr(collect_repositories, 'plan_buckets', record_plan)
+    monkeypatch.setattr(collect_repositories, 'get_total_count', record_probe)
+
+    root = {'pushed': (collect_repositories.parse_date('2019-12-01'), collect_repositories.parse_date('2019-12-31')),
+            'created': (collect_repositories.parse_date(collect_repositories.MIN_CREATION_DATE),
+                        collect_repositories.parse_date('2019-12-31')),
+            'stars': (1, None)}
+    buckets = collect_repositories.plan_buckets('plan-token', 'python', root)
+
+    # the derived counts are the counts of the search, and the buckets divide the root
+    assert sum(total_count for bucket, total_count in buckets) == get_mock_count(mock, root)
+    for bucket, total_count in buckets:
+        assert total_count == get_mock_count(mock, bucket)
+        assert total_count <= collect_repositories.MAX_SEARCH_RESULTS
+
+    # only the root and the first child of each divided bucket are probed
+    divided = [bucket for bucket, total_count in calls
+               if get_mock_count(mock, bucket) > collect_repositories.MAX_SEARCH_RESULTS]
+    assert len(divided) > 1
+    assert len(probes) == 1 + len(divided)
+    assert len(set(probes)) == len(probes)
+
+def test_file_labels():
+    root = {'pushed': (collect_repositories.parse_date('2019-12-01'), collect_repositories.parse_date('2019-12-07')),
+            'created': (collect_repositories.parse_date('2010-01-01'), collect_repositories.parse_date('2019-12-31')),
+            'stars': (1, None)}
+
+    labels = [collect_repositories.get_file_label(label) for label in collect_repositories.get_bucket_labels(root)]
+
+    assert labels == ['2019-12-01_2019-12-07', '2010-01-01_2019-12-31', '1_inf']
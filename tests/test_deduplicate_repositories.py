@@ -0,0 +1,102 @@
+import os
+
+import pandas as pd
+
+import deduplicate_repositories as dedup
+import mock_github
+
+def get_items(data, positions, updated_at=None):
+    items = [data.get_repository(position, 'http://localhost') for position in positions]
+    for item in items:
+        item['updated_at'] = updated_at if updated_at else item['updated_at']
+
+    return items
+
+def save_file(folder_path, file_name, items, mtime):
+    file_path = os.path.join(folder_path, file_name)
+    pd.DataFrame(items).to_csv(file_path, sep=',', index=False)
+    os.utime(file_path, (mtime, mtime))
+
+    return file_path
+
+def read_store(store_path):
+    store_df = pd.read_csv(store_path, sep=',')
+
+    return dict(zip(store_df['id'], store_df['updated_at']))
+
+def create_folders(workspace):
+    main_path = os.path.join(workspace, 'data', 'crawler', 'repositories', 'python')
+    os.makedirs(os.path.join(main_path, 'daily_crawler'))
+    os.makedirs(os.path.join(main_path, 'deduplicated_data'))
+
+    return main_path, os.path.join(main_path, 'deduplicated_data', 'repositories_store.csv')
+
+def test_rebuild_keeps_the_latest_dates(workspace):
+    data = mock_github.MockData('python', 20, '2019-12-01', '2019-12-31')
+    main_path, store_path = create_folders(workspace)
+    folder_path = os.path.join(main_path, 'daily_crawler')
+
+    # the file sorted last by name and written last has the older version of the repositories
+    save_file(folder_path, 'python_a_1.csv', get_items(data, range(10), '2020-06-01T00:00:00Z'), 1000)
+    save_file(folder_path, 'python_b_1.csv', get_items(data, range(5), '2020-01-01T00:00:00Z'), 2000)
+
+    dedup.rebuild_store(store_path, dedup.list_crawled_files(main_path), 100)
+    store = read_store(store_path)
+
+    assert len(store) == 10
+    assert set(store.values()) == {'2020-06-01T00:00:00Z'}
+
+def test_rows_with_the_same_dates_come_from_the_newest_file(workspace):
+    data = mock_github.MockData('python', 20, '2019-12-01', '2019-12-31')
+    main_path, store_path = create_folders(workspace)
+    folder_path = os.path.join(main_path, 'daily_crawler')
+
+    newer_items = get_items(data, range(3))
+    for item in newer_items:
+        item['stargazers_count'] = -1
+
+    save_file(folder_path, 'python_a_1.csv', newer_items, 2000)
+    save_file(folder_path, 'python_b_1.csv', get_items(data, range(3)), 1000)
+
+    dedup.rebuild_store(store_path, dedup.list_crawled_files(main_path), 100)
+
+    assert set(pd.read_csv(store_path)['stargazers_count']) == {-1}
+
+def test_incremental_merge_matches_the_rebuild(workspace):
+    data = mock_github.MockData('python', 30, '2019-12-01', '2019-12-31')
+    main_path, store_path = create_folders(workspace)
+    folder_path = os.path.join(main_path, 'daily_crawler')
+
+    merged_path = save_file(folder_path, 'python_b_1.csv', get_items(data, range(20), '2020-06-01T00:00:00Z'), 1000)
+    dedup.rebuild_store(store_path, [merged_path], 100)
+    merged_files = dedup.get_file_states([merged_path])
+
+    # a new file sorted before the merged one, with older versions of some repositories and new repositories
+    save_file(folder_path, 'python_a_1.csv', get_items(data, range(10, 30), '2020-01-01T00:00:00Z'), 2000)
+
+    file_paths = dedup.list_crawled_files(main_path)
+    new_file_paths = dedup.get_new_files(file_paths, dedup.get_file_states(file_paths), merged_files)
+    assert [os.path.basename(file_path) for file_path in new_file_paths] == ['python_a_1.csv']
+
+    dedup.merge_new_files(store_path, new_file_paths, 100)
+    merged_store = read_store(store_path)
+
+    dedup.rebuild_store(store_path, file_paths, 100)
+
+    assert merged_store == read_store(store_path)
+    assert len(merged_store) == 30
+    assert merged_store[int(data.ids[15])] == '2020-06-01T00:00:00Z'
+
+def test_new_file_older_than_the_merge_rebuilds(workspace):
+    data = mock_github.MockData('python', 10, '2019-12-01', '2019-12-31')
+    main_path, store_path = create_folders(workspace)
+    folder_path = os.path.join(main_path, 'daily_crawler')
+
+    merged_path = save_file(folder_path, 'python_a_1.csv', get_items(data, range(5)), 2000)
+    merged_files = dedup.get_file_states([merged_path])
+
+    save_file(folder_path, 'python_b_1.csv', get_items(data, range(5, 10)), 1000)
+
+    file_paths = dedup.list_crawled_files(main_path)
+
+    assert dedup.get_new_files(file_paths, dedup.get_file_states(file_paths), merged_files) is None
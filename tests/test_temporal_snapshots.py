@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+from scipy.sparse.csgraph import connected_components
+
+import temporal_snapshots as snapshots
+
+def get_events(developers, repositories, months, events, seed):
+    rng = np.random.default_rng(seed)
+
+    events_df = pd.DataFrame({'month': rng.integers(0, months, size=events) + 2019 * 12,
+                              'developer': rng.integers(0, developers, size=events),
+                              'repository': rng.integers(0, repositories, size=events),
+                              'commits': np.ones(events, dtype=np.int64)})
+
+    return snapshots.aggregate_events(events_df).sort_values('month', kind='stable').reset_index(drop=True)
+
+def get_expected_components(events_df, developers, repositories, month, window):
+    # components of the snapshot built from nothing, with the edges of the months in the window
+    window_df = events_df[(events_df['month'] > month - window) & (events_df['month'] <= month)]
+    if window_df.empty:
+        return 0, 0
+
+    nodes = developers + repositories
+    rows = window_df['developer'].values
+    columns = developers + window_df['repository'].values
+    graph = sparse.coo_matrix((np.ones(len(rows)), (rows, columns)), shape=(nodes, nodes))
+
+    labels = connected_components(graph, directed=False)[1]
+    active_nodes = np.unique(np.r_[rows, columns])
+    sizes = np.unique(labels[active_nodes], return_counts=True)[1]
+
+    return len(sizes), int(sizes.max())
+
+def test_split_components_matches_rebuild():
+    developers, repositories, window = 60, 40, 2
+
+    # sparse monthly edges, so the expired edges often split the components
+    events_df = get_events(developers, repositories, 12, 150, seed=7)
+
+    statistics_df = snapshots.build_snapshots(events_df, developers, repositories, window, cumulative=False)
+
+    for month_number, statistics in enumerate(statistics_df.itertuples()):
+        month = 2019 * 12 + month_number
+        components, largest_component = get_expected_components(events_df, developers, repositories, month, window)
+
+        assert (statistics.components, statistics.largest_component) == (components, largest_component)
+        assert statistics.expired_edges >= 0
+
+    assert statistics_df['expired_edges'].sum() > 0